@@ -44,7 +44,7 @@ while(more_results and len(observations) < OBSERVATION_LIMIT):
 	observation_entities = response.json()
 	entities = observation_entities["value"]
 	print(f'Downloaded {len(entities)} entities: {download_url}')
-	observations = observations + entities
+	observations += entities
 
 	# If the '@iot.nextLink' key is in the response, there is more data
 	# on the server. Otherwise, we are at the end of the collection.
@@ -53,6 +53,9 @@ while(more_results and len(observations) < OBSERVATION_LIMIT):
 
 print(f'Downloaded {len(observations)} Observations in total, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
 
+# Each page here has to wait for the previous one to find out the
+# '@iot.nextLink' URL. See #09 for downloading the pages in parallel.
+
 # Next the list of Observations will be converted into a simple list of 
 # lists. e.g.
 # ('2018-02-07T16:24:13.000Z', 13.858),
@@ -89,3 +92,4 @@ data = list(map(lambda observation: (observation['phenomenonTime'], observation[
 # cannot always expect unique Observations.
 # 
 # TODO: Make this list of data unique on phenomenonTime
+# (#12 does this when storing Observations in its local cache.)
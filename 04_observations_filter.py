@@ -46,6 +46,9 @@ observations = observation_entities['value']
 # Do something with Observation data
 print(f'Found {len(observations)} Observations of {total} Matching')
 
+# If there are more Observations than fit in one page, the rest are not
+# downloaded here. See #19 for downloading all of them.
+
 # Filters could be used on result values as well, to ignore specific
 # "NODATA" values:
 # ('$filter', f'result ne -9999')
@@ -8,7 +8,8 @@
 # 
 # These bandwidth counts do not include any HTTP compression.
 # Server-side gzip can provide a significant size savings, especially
-# for repetitive information like time series data.
+# for repetitive information like time series data. See #16 for
+# asking the server for compressed responses.
 import requests
 import json
 import math
@@ -49,7 +50,7 @@ while(more_results and len(observations) < OBSERVATION_LIMIT):
 	# If the '@iot.nextLink' key is in the response, there is more data
 	# on the server. Otherwise, we are at the end of the collection.
 	more_results = ('@iot.nextLink' in observation_entities)
-	download_url = observation_entities['@iot.nextLink']
+	download_url = observation_entities.get('@iot.nextLink')
 
 print(f'Downloaded {len(observations)} Observations in total, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
 
@@ -57,28 +58,42 @@ print(f'Downloaded {len(observations)} Observations in total, {math.ceil(total_d
 # API. Not all server implementations support this.
 more_results = True
 download_url = f'{DATASTREAM_URL}/Observations'
+params = [
+	('$orderby', 'phenomenonTime desc'),
+	('$select', 'phenomenonTime,result'),
+	('$resultFormat', 'CSV')
+]
 csv_headers = ""
 observations = []
 total_downloaded_bytes = 0
 
 while(more_results and len(observations) < OBSERVATION_LIMIT):
-	response = requests.get(
-		download_url,
-		params=[
-			('$orderby', 'phenomenonTime desc'),
-			('$select', 'phenomenonTime,result'),
-			('$resultFormat', 'CSV')
-		]
-	)
+	response = requests.get(download_url, params=params)
 	total_downloaded_bytes += len(response.content)
-	csv_headers = response.text.split('\n')[0]
-	entities = response.text.lstrip(csv_headers + '\n').splitlines()
+	# The first line is the column names, the rest are Observations.
+	lines = response.text.splitlines()
+	csv_headers = lines[0]
+	entities = lines[1:]
 	observations += entities
 	print(f'Downloaded {len(entities)} entities: {download_url}')
 
-	# If the '@iot.nextLink' key is in the response, there is more data
-	# on the server. Otherwise, we are at the end of the collection.
-	more_results = ('@iot.nextLink' in observation_entities)
-	download_url = observation_entities['@iot.nextLink']
+	# There is no '@iot.nextLink' in CSV. If there is more data, the
+	# server may send the next page URL in the HTTP "Link" header instead.
+	# Otherwise, we skip past the Observations we already have until an
+	# empty page comes back.
+	if 'next' in response.links:
+		download_url = response.links['next']['url']
+		params = None
+	else:
+		more_results = len(entities) > 0
+		download_url = f'{DATASTREAM_URL}/Observations'
+		params = [
+			('$orderby', 'phenomenonTime desc'),
+			('$select', 'phenomenonTime,result'),
+			('$resultFormat', 'CSV'),
+			('$skip', len(observations))
+		]
 
 print(f'Downloaded {len(observations)} Observations in total, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
+
+# See #15 for decoding the CSV and "dataArray" formats into arrays.
@@ -67,3 +67,5 @@ for datastream in datastreams:
 # polygon bounds. While we could have used $expand to combine these
 # requests, this has a significant impact on server performance with
 # these kind of joined queries.
+#
+# See #10 for downloading the Observations for these Datastreams.
@@ -0,0 +1,133 @@
+# This downloads the same Observations as #03, but instead of following
+# '@iot.nextLink' one page at a time, the pages are fetched in parallel.
+#
+# In #03 every request has to wait for the previous response, as the
+# URL of the next page is only known after the current page arrives. For
+# long Datastreams the download time is then mostly spent waiting on
+# round trips, not on transferring data.
+#
+# As the Observations are sorted on the server by 'phenomenonTime', the
+# position of each Observation in the collection is stable. This means
+# we can ask for the total with '$count' on the first page, and then
+# work out the '$skip'/'$top' window of every other page ourselves.
+# Those windows do not depend on each other, so they can be requested at
+# the same time.
+#
+# '$count' usage: http://docs.opengeospatial.org/is/15-078r6/15-078r6.html#53
+# '$top' usage: http://docs.opengeospatial.org/is/15-078r6/15-078r6.html#51
+# '$skip' usage: http://docs.opengeospatial.org/is/15-078r6/15-078r6.html#52
+import requests
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Use server-side paging to download more data until this number is
+# reached.
+OBSERVATION_LIMIT = 500
+# Number of Observations to ask for in each page. The server may return
+# fewer than this if it has a lower maximum page size.
+PAGE_SIZE = 100
+# Maximum number of pages being downloaded at the same time. Be polite,
+# the server is shared with other users.
+CONCURRENCY = 4
+
+
+def create_session(concurrency):
+	# A "Session" keeps HTTP connections open between requests
+	# (keep-alive), instead of a new TCP/TLS connection for every call to
+	# 'requests.get'. The pool has to be as large as the number of
+	# parallel downloads, or connections will be thrown away.
+	session = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
+
+
+def plan_windows(first_page_size, page_size, total):
+	# Return the ('$skip', '$top') pairs for every page after the first.
+	return [(skip, min(page_size, total - skip)) for skip in range(first_page_size, total, page_size)]
+
+
+def fetch_all_pages(session, collection_url, params, limit=None, page_size=PAGE_SIZE, concurrency=CONCURRENCY):
+	# Download all entities in a collection using parallel page requests.
+	#
+	# 'params' are the query options for the collection. They must include
+	# a '$orderby' that gives a stable order, or the windows may overlap
+	# or miss entities.
+	#
+	# Returns the list of entities in server order, and the number of
+	# bytes downloaded.
+	response = session.get(
+		collection_url,
+		params=params + [('$count', 'true'), ('$top', page_size)]
+	)
+	response.raise_for_status()
+	total_downloaded_bytes = len(response.content)
+	first_page = response.json()
+	entities = first_page['value']
+	print(f'Downloaded {len(entities)} entities: {response.url}')
+
+	total = first_page['@iot.count']
+	if limit is not None:
+		total = min(total, limit)
+
+	# If the server returned fewer entities than we asked for while still
+	# having more data, then its maximum page size is smaller than ours.
+	if '@iot.nextLink' in first_page and 0 < len(entities) < page_size:
+		page_size = len(entities)
+
+	windows = plan_windows(len(entities), page_size, total)
+
+	def fetch_window(window):
+		skip, top = window
+		response = session.get(
+			collection_url,
+			params=params + [('$count', 'false'), ('$skip', skip), ('$top', top)]
+		)
+		response.raise_for_status()
+		entities = response.json()['value']
+		print(f'Downloaded {len(entities)} entities: {response.url}')
+		return entities, len(response.content)
+
+	# 'map' returns the results in the same order as the windows, no
+	# matter which page finishes first. That keeps the server's
+	# 'phenomenonTime' order without sorting again.
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		results = list(executor.map(fetch_window, windows))
+
+	# Join the pages once at the end. Adding lists together in the loop
+	# ('observations = observations + entities') copies everything
+	# downloaded so far on every page, which gets slow for long series.
+	pages = [entities] + [page for page, size in results]
+	total_downloaded_bytes += sum(size for page, size in results)
+	observations = list(chain.from_iterable(pages))
+
+	if limit is not None:
+		observations = observations[:limit]
+
+	return observations, total_downloaded_bytes
+
+
+session = create_session(CONCURRENCY)
+observations, total_downloaded_bytes = fetch_all_pages(
+	session,
+	f'{DATASTREAM_URL}/Observations',
+	[
+		('$orderby', 'phenomenonTime asc'),
+		('$select', 'phenomenonTime,result')
+	],
+	limit=OBSERVATION_LIMIT
+)
+
+print(f'Downloaded {len(observations)} Observations in total, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
+
+data = [(observation['phenomenonTime'], observation['result']) for observation in observations]
+
+# Note: if new Observations are added to the Datastream while the pages
+# are downloading, the windows will shift and an Observation may appear
+# twice. This can also happen with '@iot.nextLink' paging, so the same
+# duplicate check on 'phenomenonTime' as in #03 is still needed.
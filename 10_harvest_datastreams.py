@@ -0,0 +1,131 @@
+# This continues from #08. After finding all the "Air Temperature"
+# Datastreams in a polygon, each Datastream is queried for its
+# Observations.
+#
+# There may be hundreds of Datastreams, and downloading them one after
+# the other means the total time grows with the number of Datastreams.
+# Instead we use 'asyncio' to run the downloads at the same time, with a
+# limit on how many requests are in progress at once. When a Datastream
+# has finished downloading it is passed to a callback, so it can be
+# processed or saved without waiting for the rest.
+#
+# As mentioned in #08, we could '$expand' the Observations into the
+# Datastreams query, but that joined query is expensive for the server.
+# Here each Datastream's Observations are separate, simple requests.
+import requests
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# Observed Property selected in #08.
+OBSERVED_PROPERTY_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/ObservedProperties(1)"
+FILTER_GEOM = "POLYGON ((-106 68, -106 70, -105 70, -105 68, -106 68))"
+# Dates for filters must be in ISO8601 format. See #04.
+INTERVAL_START = "2020-09-14T00:00:00.000Z"
+INTERVAL_END = "2020-09-21T00:00:00.000Z"
+
+# Maximum number of requests in progress at the same time, for all
+# Datastreams together. This is what should be tuned to the capacity of
+# the server.
+IN_FLIGHT_LIMIT = 8
+# Maximum number of pages to download for each Datastream, so a single
+# very long Datastream cannot use up the whole harvest.
+PAGE_LIMIT = 10
+
+
+def get_datastreams(session):
+	# The same query as #08, following '@iot.nextLink' in case there are
+	# more Datastreams than fit in one page.
+	datastreams = []
+	download_url = f'{OBSERVED_PROPERTY_URL}/Datastreams'
+	params = [
+		('$filter', f"geo.intersects(observedArea, geography'{FILTER_GEOM}')"),
+		('$select', 'id,name,description')
+	]
+
+	while download_url is not None:
+		response = session.get(download_url, params=params)
+		response.raise_for_status()
+		datastream_entities = response.json()
+		datastreams += datastream_entities['value']
+		download_url = datastream_entities.get('@iot.nextLink')
+		# The nextLink already includes our query options.
+		params = None
+
+	return datastreams
+
+
+async def harvest(session, datastreams, on_datastream, in_flight_limit=IN_FLIGHT_LIMIT, page_limit=PAGE_LIMIT):
+	# Download the Observations for every Datastream concurrently.
+	#
+	# 'requests' is not an asyncio library, so each GET runs in a thread
+	# pool. The semaphore is the global limit: a Datastream has to wait
+	# for a free slot before each of its pages, so all Datastreams share
+	# the same number of connections.
+	loop = asyncio.get_running_loop()
+	executor = ThreadPoolExecutor(max_workers=in_flight_limit)
+	in_flight = asyncio.Semaphore(in_flight_limit)
+
+	async def get_page(url, params):
+		async with in_flight:
+			response = await loop.run_in_executor(
+				executor,
+				lambda: session.get(url, params=params)
+			)
+		response.raise_for_status()
+		return response.json()
+
+	async def harvest_datastream(datastream):
+		observations = []
+		download_url = f'{STA_URL}/Datastreams({datastream["@iot.id"]})/Observations'
+		params = [
+			('$orderby', 'phenomenonTime asc'),
+			('$select', 'phenomenonTime,result'),
+			('$filter', f'phenomenonTime ge {INTERVAL_START} and phenomenonTime le {INTERVAL_END}')
+		]
+		pages = 0
+
+		# The pages of one Datastream are still followed in order with
+		# '@iot.nextLink', but while one Datastream waits for its next page
+		# the other Datastreams are using the free slots.
+		while download_url is not None and pages < page_limit:
+			observation_entities = await get_page(download_url, params)
+			observations += observation_entities['value']
+			download_url = observation_entities.get('@iot.nextLink')
+			params = None
+			pages += 1
+
+		return datastream, observations
+
+	tasks = [asyncio.ensure_future(harvest_datastream(datastream)) for datastream in datastreams]
+
+	try:
+		# Hand each Datastream to the callback as soon as it is complete,
+		# in whatever order they finish.
+		for task in asyncio.as_completed(tasks):
+			datastream, observations = await task
+			on_datastream(datastream, observations)
+	finally:
+		for task in tasks:
+			task.cancel()
+		executor.shutdown(wait=False)
+
+
+def print_datastream(datastream, observations):
+	# Do something with Observation data
+	print(f'Datastream: {datastream["name"]}, {len(observations)} Observations')
+
+
+# As in #09, the session keeps connections open between requests. The
+# pool is sized to the in-flight limit.
+session = requests.Session()
+adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=IN_FLIGHT_LIMIT)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+datastreams = get_datastreams(session)
+print(f'Found {len(datastreams)} Datastreams')
+
+asyncio.run(harvest(session, datastreams, print_datastream))
@@ -0,0 +1,183 @@
+# This is like #01 and #02, listing all the Things and their Locations,
+# but for a Things collection that is larger than one page.
+#
+# #01 needs one extra request per Thing for the Location ("n + 1"), and
+# #02 fixes that with '$expand' but only reads the first page of Things.
+# Here we follow '@iot.nextLink' through every page of Things, collect
+# the Location links of each Thing, and then download the Locations in
+# as few requests as possible.
+#
+# Many stations can share the same Location entity (for example several
+# sensor Things at one site), so each Location is only downloaded and
+# stored once, no matter how many Things link to it.
+#
+# There are two ways of resolving the links:
+#
+# "expand": Ask for only the Location IDs with '$expand' on the Things
+# query, then download each unique Location once with a '$filter' on
+# the Locations collection.
+#
+# "filter": Ask for the Things without any '$expand' (for servers where
+# joins are slow), then download the Locations for a batch of Things at
+# a time, filtered on the Things they belong to.
+#
+# '$expand' usage: http://docs.opengeospatial.org/is/15-078r6/15-078r6.html#47
+# '$filter' usage: http://docs.opengeospatial.org/is/15-078r6/15-078r6.html#54
+import requests
+import json
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# "expand" or "filter", see above.
+RESOLVE_MODE = "expand"
+# Number of IDs to put in each '$filter'. Very long filters can go over
+# the URL length limit of the server or proxy.
+BATCH_SIZE = 50
+
+
+def format_id(entity_id):
+	# IDs can be numbers or strings, depending on the server. Strings
+	# must be single-quoted in '$filter'.
+	if isinstance(entity_id, str):
+		return "'" + entity_id.replace("'", "''") + "'"
+	return str(entity_id)
+
+
+def batches(items, size):
+	for i in range(0, len(items), size):
+		yield items[i:i + size]
+
+
+class LocationResolver:
+	# Collects the Things from every page of a Things query, then resolves
+	# all of their Locations at once.
+	#
+	# Keeps track of how many requests were made, compared to the "n + 1"
+	# method in #01, which would make one Things request per page and
+	# then one Locations request per Thing.
+
+	def __init__(self, session, mode=RESOLVE_MODE, batch_size=BATCH_SIZE):
+		self.session = session
+		self.mode = mode
+		self.batch_size = batch_size
+		self.things = []
+		# Location entities by ID, each stored once.
+		self.locations = {}
+		# Location IDs for each Thing ID, in the server's order.
+		self.thing_locations = {}
+		self.requests_made = 0
+		self.thing_pages = 0
+
+	def get(self, url, params=None):
+		self.requests_made += 1
+		response = self.session.get(url, params=params)
+		response.raise_for_status()
+		return response.json()
+
+	def thing_params(self):
+		if self.mode == "expand":
+			# Only the Location IDs are embedded, so a Location shared by
+			# many Things is not repeated in full on every Thing.
+			return [('$expand', 'Locations($select=id)')]
+		return []
+
+	def add_things(self, things):
+		# Collect the Location links from one page of Things.
+		for thing in things:
+			self.things.append(thing)
+			if self.mode == "expand":
+				self.thing_locations[thing['@iot.id']] = [location['@iot.id'] for location in thing['Locations']]
+
+	def load_things(self, things_url):
+		# Follow every page of the Things collection.
+		download_url = things_url
+		params = self.thing_params()
+
+		while download_url is not None:
+			thing_entities = self.get(download_url, params)
+			self.thing_pages += 1
+			self.add_things(thing_entities['value'])
+			download_url = thing_entities.get('@iot.nextLink')
+			# The nextLink already includes our query options.
+			params = None
+
+	def get_all(self, params):
+		# Download every page of a Locations query.
+		entities = []
+		download_url = f'{STA_URL}/Locations'
+
+		while download_url is not None:
+			location_entities = self.get(download_url, params)
+			entities += location_entities['value']
+			download_url = location_entities.get('@iot.nextLink')
+			params = None
+
+		return entities
+
+	def resolve(self):
+		if self.mode == "expand":
+			# Each unique Location ID is downloaded once.
+			location_ids = list(dict.fromkeys(
+				location_id
+				for location_ids in self.thing_locations.values()
+				for location_id in location_ids
+			))
+			for batch in batches(location_ids, self.batch_size):
+				id_filter = ' or '.join(f'id eq {format_id(location_id)}' for location_id in batch)
+				for location in self.get_all([('$filter', id_filter)]):
+					self.locations[location['@iot.id']] = location
+		else:
+			# Ask for the Locations of a batch of Things, and include the
+			# IDs of their Things to match them back up. A Location that
+			# belongs to several Things in the batch is only returned once.
+			thing_ids = [thing['@iot.id'] for thing in self.things]
+			for thing_id in thing_ids:
+				self.thing_locations[thing_id] = []
+			for batch in batches(thing_ids, self.batch_size):
+				thing_filter = ' or '.join(f'Things/id eq {format_id(thing_id)}' for thing_id in batch)
+				for location in self.get_all([
+					('$filter', thing_filter),
+					('$expand', 'Things($select=id)')
+				]):
+					linked_things = location.pop('Things')
+					self.locations.setdefault(location['@iot.id'], location)
+					for thing in linked_things:
+						if thing['@iot.id'] in self.thing_locations:
+							self.thing_locations[thing['@iot.id']].append(location['@iot.id'])
+
+	def locations_for(self, thing):
+		return [self.locations[location_id] for location_id in self.thing_locations.get(thing['@iot.id'], [])]
+
+	def requests_saved(self):
+		# Requests the "n + 1" method would have needed, minus what we used.
+		return (self.thing_pages + len(self.things)) - self.requests_made
+
+
+session = requests.Session()
+resolver = LocationResolver(session)
+resolver.load_things(f'{STA_URL}/Things')
+resolver.resolve()
+
+print(f'Found {len(resolver.things)} Things with {len(resolver.locations)} unique Locations.')
+
+# Loop through the Thing entities and print some information
+for thing in resolver.things:
+	print(f'Thing: {thing["name"]}')
+	print(thing['description'])
+
+	locations = resolver.locations_for(thing)
+	if len(locations) == 0:
+		print('No Location')
+		print()
+		continue
+
+	# Auto-select first Location
+	last_location = locations[0]
+	coords = last_location['location']['coordinates']
+
+	# Print some info about this place. The 'location' should contain
+	# valid GeoJSON. We assume it is a point.
+	print(f'Located at: {coords[1]}˚ N, {coords[0]}˚ E')
+	print()
+
+print(f'Used {resolver.requests_made} HTTP requests, saving {resolver.requests_saved()} compared to #01.')
@@ -0,0 +1,150 @@
+# Like #03 and #04, this retrieves Observation data for a Datastream in
+# a time interval, but keeps a local copy of the Observations in an
+# SQLite database file so they do not have to be downloaded again.
+#
+# Observations for a Datastream are usually only ever added at the end
+# (the most recent time). The database remembers the latest
+# 'phenomenonTime' that has been downloaded for each Datastream (the
+# "watermark"), and on the next run only asks the server for
+# Observations after that time. The requested time interval is then
+# read from the local database.
+#
+# If older data is added to the server later ("backfilling"), the
+# watermark will not notice it. In that case the cached Observations
+# after a given time must be invalidated, so they are downloaded again.
+#
+# SQLite is included with Python, so nothing extra needs installing.
+import requests
+import json
+import sqlite3
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Local database file, created if it does not exist.
+CACHE_FILE = "observations.sqlite"
+
+# Dates for filters must be in ISO8601 format. See #04.
+INTERVAL_START = "2020-09-14T19:00:00.000Z"
+INTERVAL_END = "2020-09-14T21:00:00.000Z"
+
+
+class ObservationCache:
+	# Local copy of Observations, keyed by the Datastream URL.
+	#
+	# Times are stored as the strings the server sends. FROST always
+	# returns them in UTC with a "Z" and milliseconds, so comparing the
+	# strings gives the same order as comparing the times.
+
+	def __init__(self, path, session=None):
+		self.db = sqlite3.connect(path)
+		self.session = session or requests.Session()
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS observations (
+				datastream_url TEXT NOT NULL,
+				phenomenon_time TEXT NOT NULL,
+				result TEXT,
+				PRIMARY KEY (datastream_url, phenomenon_time)
+			) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS watermarks (
+				datastream_url TEXT PRIMARY KEY,
+				phenomenon_time TEXT NOT NULL
+			);
+		''')
+
+	def watermark(self, datastream_url):
+		row = self.db.execute(
+			'SELECT phenomenon_time FROM watermarks WHERE datastream_url = ?',
+			(datastream_url,)
+		).fetchone()
+		return row[0] if row else None
+
+	def store(self, datastream_url, observations):
+		# The primary key is the Datastream and 'phenomenonTime', so there
+		# can only be one Observation for each time. If the server has
+		# duplicates (see #03), only the first one is kept.
+		with self.db:
+			self.db.executemany(
+				'INSERT OR IGNORE INTO observations VALUES (?, ?, ?)',
+				[(datastream_url, observation['phenomenonTime'], json.dumps(observation['result'])) for observation in observations]
+			)
+			if len(observations) > 0:
+				self.db.execute(
+					'INSERT INTO watermarks VALUES (?, ?) ON CONFLICT (datastream_url) '
+					'DO UPDATE SET phenomenon_time = max(phenomenon_time, excluded.phenomenon_time)',
+					(datastream_url, max(observation['phenomenonTime'] for observation in observations))
+				)
+
+	def sync(self, datastream_url):
+		# Download only the Observations after the watermark, sorted by
+		# time ascending, following '@iot.nextLink' to the end.
+		#
+		# Returns the number of Observations downloaded.
+		params = [
+			('$orderby', 'phenomenonTime asc'),
+			('$select', 'phenomenonTime,result')
+		]
+		watermark = self.watermark(datastream_url)
+		if watermark is not None:
+			params.append(('$filter', f'phenomenonTime gt {watermark}'))
+
+		download_url = f'{datastream_url}/Observations'
+		downloaded = 0
+
+		while download_url is not None:
+			response = self.session.get(download_url, params=params)
+			response.raise_for_status()
+			observation_entities = response.json()
+			entities = observation_entities['value']
+			# Store each page as it arrives, so an interrupted sync keeps
+			# what it already has.
+			self.store(datastream_url, entities)
+			downloaded += len(entities)
+			download_url = observation_entities.get('@iot.nextLink')
+			params = None
+
+		return downloaded
+
+	def query(self, datastream_url, start, end):
+		# Bring the cache up to date, then return the (phenomenonTime,
+		# result) pairs in the interval, inclusive, sorted by time.
+		downloaded = self.sync(datastream_url)
+		print(f'Downloaded {downloaded} new Observations for {datastream_url}')
+
+		rows = self.db.execute(
+			'SELECT phenomenon_time, result FROM observations '
+			'WHERE datastream_url = ? AND phenomenon_time >= ? AND phenomenon_time <= ? '
+			'ORDER BY phenomenon_time',
+			(datastream_url, start, end)
+		)
+		return [(phenomenon_time, json.loads(result)) for phenomenon_time, result in rows]
+
+	def invalidate(self, datastream_url, since=None):
+		# Forget cached Observations from 'since' onwards (or all of them),
+		# and move the watermark back so the next sync downloads them
+		# again. Use this when older data has been backfilled on the
+		# server.
+		with self.db:
+			if since is None:
+				self.db.execute('DELETE FROM observations WHERE datastream_url = ?', (datastream_url,))
+			else:
+				self.db.execute(
+					'DELETE FROM observations WHERE datastream_url = ? AND phenomenon_time >= ?',
+					(datastream_url, since)
+				)
+			self.db.execute('DELETE FROM watermarks WHERE datastream_url = ?', (datastream_url,))
+			self.db.execute(
+				'INSERT INTO watermarks SELECT datastream_url, max(phenomenon_time) FROM observations '
+				'WHERE datastream_url = ? GROUP BY datastream_url',
+				(datastream_url,)
+			)
+
+
+cache = ObservationCache(CACHE_FILE)
+data = cache.query(DATASTREAM_URL, INTERVAL_START, INTERVAL_END)
+
+# Do something with Observation data
+print(f'Found {len(data)} Observations between {INTERVAL_START} and {INTERVAL_END}')
+
+# If the station data was corrected on the server for a time range, the
+# cache can be cleared from that time and downloaded again:
+# cache.invalidate(DATASTREAM_URL, since="2020-09-01T00:00:00.000Z")
@@ -0,0 +1,186 @@
+# This downloads Observations like #03 and #05, but without loading each
+# whole page of JSON into memory at once.
+#
+# 'response.json()' reads the entire response body, and then builds a
+# dictionary for every Observation with every attribute, even the ones
+# we will never use. With large pages (a big '$top') and embedded
+# entities ('$expand=FeatureOfInterest'), that can use a lot of memory.
+#
+# Instead we read the response body in chunks as it arrives, and decode
+# the 'value' array one Observation at a time. Only the attributes we
+# want are kept, in a small tuple, and the rest is thrown away straight
+# away. The memory used then depends on the size of one Observation, not
+# the size of the page.
+#
+# The '@iot.count' and '@iot.nextLink' attributes are picked up as they
+# are passed, which may be before or after the 'value' array.
+import requests
+import json
+import codecs
+import math
+from collections import namedtuple
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Use server-side paging to download more data until this number is
+# reached.
+OBSERVATION_LIMIT = 500
+# Attributes to keep from each Observation. Nested attributes of
+# expanded entities are separated with "/", like in '$select'.
+FIELDS = ['phenomenonTime', 'result', 'FeatureOfInterest/feature/coordinates']
+# Number of bytes to read from the response at a time.
+CHUNK_SIZE = 16 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+
+class PageReader:
+	# Reads one page of a collection response, a JSON object like:
+	#
+	# { "@iot.count": 1000, "@iot.nextLink": "...", "value": [ ... ] }
+	#
+	# Iterating over the reader returns a record for each entity in
+	# 'value'. After iterating, 'count' and 'next_link' are set if the
+	# server sent them.
+
+	def __init__(self, chunks, fields):
+		self.chunks = iter(chunks)
+		self.decoder = json.JSONDecoder()
+		self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+		self.buffer = ''
+		self.position = 0
+		self.finished = False
+		self.paths = [field.split('/') for field in fields]
+		self.Record = namedtuple('Record', [field.replace('/', '_') for field in fields])
+		self.count = None
+		self.next_link = None
+		self.bytes_read = 0
+
+	def read_more(self):
+		# Drop the part of the buffer we have already decoded, and add the
+		# next chunk from the response.
+		if self.finished:
+			raise ValueError('Response body ended before the JSON was complete')
+		try:
+			chunk = next(self.chunks)
+			self.bytes_read += len(chunk)
+			text = self.text_decoder.decode(chunk)
+		except StopIteration:
+			self.finished = True
+			text = self.text_decoder.decode(b'', final=True)
+		self.buffer = self.buffer[self.position:] + text
+		self.position = 0
+
+	def next_char(self):
+		# Skip whitespace and return the next character, without using it.
+		while True:
+			while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+				self.position += 1
+			if self.position < len(self.buffer):
+				return self.buffer[self.position]
+			self.read_more()
+
+	def expect(self, chars):
+		char = self.next_char()
+		if char not in chars:
+			raise ValueError(f'Expected one of {chars!r} in JSON, found {char!r}')
+		self.position += 1
+		return char
+
+	def decode_value(self):
+		# Decode one complete JSON value. If the buffer ends in the middle
+		# of it, read more and try again.
+		self.next_char()
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(self.buffer, self.position)
+			except json.JSONDecodeError:
+				if self.finished:
+					raise
+				self.read_more()
+				continue
+			# A number at the very end of the buffer could still continue in
+			# the next chunk.
+			if end == len(self.buffer) and not self.finished:
+				self.read_more()
+				continue
+			self.position = end
+			return value
+
+	def pick(self, entity):
+		values = []
+		for path in self.paths:
+			value = entity
+			for key in path:
+				value = value.get(key) if isinstance(value, dict) else None
+			values.append(value)
+		return self.Record(*values)
+
+	def __iter__(self):
+		self.expect('{')
+		if self.next_char() == '}':
+			return
+
+		while True:
+			key = self.decode_value()
+			self.expect(':')
+
+			if key == 'value':
+				self.expect('[')
+				if self.next_char() == ']':
+					self.position += 1
+				else:
+					while True:
+						yield self.pick(self.decode_value())
+						if self.expect(',]') == ']':
+							break
+			else:
+				value = self.decode_value()
+				if key == '@iot.count':
+					self.count = value
+				elif key == '@iot.nextLink':
+					self.next_link = value
+
+			if self.expect(',}') == '}':
+				return
+
+
+more_results = True
+download_url = f'{DATASTREAM_URL}/Observations'
+params = [
+	('$orderby', 'phenomenonTime asc'),
+	('$select', 'phenomenonTime,result'),
+	('$expand', 'FeatureOfInterest($select=feature)')
+]
+observations = []
+total_downloaded_bytes = 0
+
+session = requests.Session()
+
+while(more_results and len(observations) < OBSERVATION_LIMIT):
+	# 'stream=True' means the body is not downloaded until we read it.
+	with session.get(download_url, params=params, stream=True) as response:
+		response.raise_for_status()
+		page = PageReader(response.iter_content(CHUNK_SIZE), FIELDS)
+		entities = 0
+		for record in page:
+			observations.append(record)
+			entities += 1
+
+	total_downloaded_bytes += page.bytes_read
+	print(f'Downloaded {entities} entities: {download_url}')
+
+	# If the '@iot.nextLink' key is in the response, there is more data
+	# on the server. Otherwise, we are at the end of the collection.
+	more_results = page.next_link is not None
+	download_url = page.next_link
+	# The nextLink already includes our query options.
+	params = None
+
+print(f'Downloaded {len(observations)} Observations in total, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
+
+# Each record is a tuple, with the attributes in the same order as
+# FIELDS. They can also be read by name:
+for observation in observations[:5]:
+	coords = observation.FeatureOfInterest_feature_coordinates
+	print(f'{observation.phenomenonTime}, {observation.result}, {coords}')
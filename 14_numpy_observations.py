@@ -0,0 +1,162 @@
+# This downloads Observations like #03, and then does the sorting and
+# duplicate removal that #03 leaves as a TODO.
+#
+# Instead of a Python list of tuples, the Observations are stored in
+# NumPy arrays: one array of times and one array of results. Sorting,
+# removing duplicates and slicing by time can then be done on the whole
+# array at once, which is much faster than looping over Python
+# dictionaries for Datastreams with a lot of data.
+#
+# Requires NumPy: https://numpy.org
+import requests
+import json
+import math
+import numpy as np
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Use server-side paging to download more data until this number is
+# reached.
+OBSERVATION_LIMIT = 500
+
+# Dates for filters must be in ISO8601 format. See #04.
+INTERVAL_START = "2020-09-14T19:00:00.000Z"
+INTERVAL_END = "2020-09-14T21:00:00.000Z"
+
+
+def parse_times(phenomenon_times):
+	# Convert ISO8601 strings to 'datetime64[ms]'.
+	#
+	# NumPy does not accept the "Z" time zone, so it is removed; FROST
+	# returns all times in UTC. A 'phenomenonTime' may also be an
+	# interval ("start/end"), in which case the start is used.
+	return np.array(
+		[phenomenon_time.split('/')[0].rstrip('Z') for phenomenon_time in phenomenon_times],
+		dtype='datetime64[ms]'
+	)
+
+
+def parse_results(results):
+	# Convert results to 'float64'. Results that are not numbers (null,
+	# strings, objects; see the "observationType" notes in #03) are stored
+	# as NaN, with False in the returned mask.
+	numeric = np.array(
+		[isinstance(result, (int, float)) and not isinstance(result, bool) for result in results],
+		dtype=bool
+	)
+	values = np.array(
+		[result if is_number else math.nan for result, is_number in zip(results, numeric)],
+		dtype='float64'
+	)
+	return values, numeric
+
+
+class ObservationArray:
+	# Column-based storage of (phenomenonTime, result) pairs.
+	#
+	# Pages are added as they are downloaded, and joined into single
+	# arrays the first time the data is used.
+
+	def __init__(self, times=None, values=None, numeric=None):
+		self.pages = []
+		self.times = times if times is not None else np.empty(0, dtype='datetime64[ms]')
+		self.values = values if values is not None else np.empty(0, dtype='float64')
+		self.numeric = numeric if numeric is not None else np.empty(0, dtype=bool)
+
+	def add_page(self, entities):
+		times = parse_times([entity['phenomenonTime'] for entity in entities])
+		values, numeric = parse_results([entity['result'] for entity in entities])
+		self.pages.append((times, values, numeric))
+
+	def join_pages(self):
+		if len(self.pages) == 0:
+			return
+		pages = [(self.times, self.values, self.numeric)] + self.pages
+		self.times = np.concatenate([page[0] for page in pages])
+		self.values = np.concatenate([page[1] for page in pages])
+		self.numeric = np.concatenate([page[2] for page in pages])
+		self.pages = []
+
+	def __len__(self):
+		self.join_pages()
+		return len(self.times)
+
+	def take(self, index):
+		self.times = self.times[index]
+		self.values = self.values[index]
+		self.numeric = self.numeric[index]
+
+	def sort(self):
+		# Sort by time. A "stable" sort keeps Observations with the same
+		# time in the order they were downloaded, which 'unique' relies on.
+		# Pages that are each already sorted (but out of order with each
+		# other) are merged quickly by this kind of sort.
+		self.join_pages()
+		if np.all(self.times[1:] >= self.times[:-1]):
+			return
+		self.take(np.argsort(self.times, kind='stable'))
+
+	def unique(self, keep='first'):
+		# Remove Observations with the same time as another, keeping the
+		# 'first' or 'last' one downloaded for each time.
+		self.sort()
+		if len(self.times) == 0:
+			return
+		different = self.times[1:] != self.times[:-1]
+		if keep == 'first':
+			mask = np.concatenate(([True], different))
+		elif keep == 'last':
+			mask = np.concatenate((different, [True]))
+		else:
+			raise ValueError(f'keep must be "first" or "last", not {keep!r}')
+		self.take(mask)
+
+	def between(self, start, end):
+		# Return a new ObservationArray for the times from 'start' to 'end',
+		# inclusive. Must be sorted first.
+		self.join_pages()
+		bounds = parse_times([start, end])
+		start_index = np.searchsorted(self.times, bounds[0], side='left')
+		end_index = np.searchsorted(self.times, bounds[1], side='right')
+		return ObservationArray(
+			self.times[start_index:end_index],
+			self.values[start_index:end_index],
+			self.numeric[start_index:end_index]
+		)
+
+
+more_results = True
+download_url = f'{DATASTREAM_URL}/Observations'
+params = [
+	('$orderby', 'phenomenonTime asc'),
+	('$select', 'phenomenonTime,result')
+]
+observations = ObservationArray()
+total_downloaded_bytes = 0
+
+while(more_results and len(observations) < OBSERVATION_LIMIT):
+	response = requests.get(download_url, params=params)
+	total_downloaded_bytes += len(response.content)
+	observation_entities = response.json()
+	entities = observation_entities["value"]
+	print(f'Downloaded {len(entities)} entities: {download_url}')
+	observations.add_page(entities)
+
+	# If the '@iot.nextLink' key is in the response, there is more data
+	# on the server. Otherwise, we are at the end of the collection.
+	more_results = ('@iot.nextLink' in observation_entities)
+	download_url = observation_entities.get('@iot.nextLink')
+	# The nextLink already includes our query options.
+	params = None
+
+print(f'Downloaded {len(observations)} Observations in total, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
+
+# Sort by time, and remove any Observations with the same time. See the
+# notes at the end of #03 for why this matters for charts.
+observations.unique(keep='first')
+
+print(f'{len(observations)} unique Observations, {np.count_nonzero(~observations.numeric)} without a numeric result.')
+
+# Get only the Observations in a time interval, inclusive.
+interval = observations.between(INTERVAL_START, INTERVAL_END)
+print(f'{len(interval)} Observations between {INTERVAL_START} and {INTERVAL_END}')
@@ -0,0 +1,174 @@
+# This compares the ways of downloading Observations from #06, and
+# decodes each of them into NumPy arrays of times and results (like in
+# #14), so they can be used directly.
+#
+# OGC SensorThings API has two compact result formats, on top of the
+# normal JSON:
+#
+# "CSV": one line per Observation, with a header line of column names.
+# Not part of the specification, but supported by FROST. As there is no
+# place for '@iot.nextLink' in CSV, the server may send the next page
+# URL in the HTTP "Link" header. If it does not, we use '$skip'.
+#
+# "dataArray": JSON, but each Observation is an array of values instead
+# of an object, so the attribute names are only sent once per page. The
+# '@iot.nextLink' is included like in normal JSON.
+#
+# For each format the number of bytes and the time spent decoding are
+# printed, so you can pick the best format for your server.
+#
+# '$resultFormat' usage: http://docs.opengeospatial.org/is/15-078r6/15-078r6.html#dataarray-extension
+#
+# Requires NumPy: https://numpy.org
+import requests
+import json
+import csv
+import io
+import math
+import time
+import numpy as np
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Use server-side paging to download more data until this number is
+# reached.
+OBSERVATION_LIMIT = 500
+
+
+def parse_times(phenomenon_times):
+	# Convert ISO8601 strings to 'datetime64[ms]', as in #14.
+	return np.array(
+		[phenomenon_time.split('/')[0].rstrip('Z') for phenomenon_time in phenomenon_times],
+		dtype='datetime64[ms]'
+	)
+
+
+def parse_results(results):
+	# Convert results to 'float64', with NaN and False in the mask for
+	# results that are not numbers, as in #14.
+	numeric = np.array(
+		[isinstance(result, (int, float)) and not isinstance(result, bool) for result in results],
+		dtype=bool
+	)
+	values = np.array(
+		[result if is_number else math.nan for result, is_number in zip(results, numeric)],
+		dtype='float64'
+	)
+	return values, numeric
+
+
+def parse_csv_results(results):
+	# In CSV every result is a string. NumPy converts a whole column of
+	# numbers at once. Only a page that also has other results (or empty
+	# cells, which are null results) is converted one cell at a time.
+	try:
+		values = np.array(results, dtype='float64')
+	except ValueError:
+		values = np.full(len(results), math.nan)
+		for i, result in enumerate(results):
+			try:
+				values[i] = float(result)
+			except ValueError:
+				pass
+	# "nan" and "inf" are valid for 'float', but they are text results.
+	numeric = np.isfinite(values)
+	return values, numeric
+
+
+def decode_json(response):
+	observation_entities = response.json()
+	entities = observation_entities['value']
+	times = parse_times([entity['phenomenonTime'] for entity in entities])
+	values, numeric = parse_results([entity['result'] for entity in entities])
+	return times, values, numeric, observation_entities.get('@iot.nextLink')
+
+
+def decode_data_array(response):
+	# The 'value' array has one item per Datastream (here only one), with
+	# the 'components' listing what is in each row of 'dataArray'.
+	observation_entities = response.json()
+	times = []
+	results = []
+	for group in observation_entities['value']:
+		time_index = group['components'].index('phenomenonTime')
+		result_index = group['components'].index('result')
+		for row in group['dataArray']:
+			times.append(row[time_index])
+			results.append(row[result_index])
+	values, numeric = parse_results(results)
+	return parse_times(times), values, numeric, observation_entities.get('@iot.nextLink')
+
+
+def decode_csv(response):
+	# Use the 'csv' module rather than splitting on commas, as text
+	# results may be quoted and contain commas or line breaks.
+	next_link = response.links.get('next', {}).get('url')
+	# Blank lines are skipped.
+	rows = [row for row in csv.reader(io.StringIO(response.text, newline='')) if row]
+	if len(rows) < 2:
+		return parse_times([]), np.empty(0), np.empty(0, dtype=bool), next_link
+	time_index = rows[0].index('phenomenonTime')
+	result_index = rows[0].index('result')
+	times = parse_times([row[time_index] for row in rows[1:]])
+	values, numeric = parse_csv_results([row[result_index] for row in rows[1:]])
+	return times, values, numeric, next_link
+
+
+FORMATS = {
+	'JSON': (None, decode_json),
+	'dataArray': ('dataArray', decode_data_array),
+	'CSV': ('CSV', decode_csv)
+}
+
+
+def download(session, result_format, limit=OBSERVATION_LIMIT):
+	# Download Observations in one of the FORMATS, following the paging
+	# links. Returns the arrays and the bytes and decode time used.
+	format_option, decode = FORMATS[result_format]
+	params = [
+		('$orderby', 'phenomenonTime desc'),
+		('$select', 'phenomenonTime,result')
+	]
+	if format_option is not None:
+		params.append(('$resultFormat', format_option))
+
+	download_url = f'{DATASTREAM_URL}/Observations'
+	query = params
+	pages = []
+	downloaded = 0
+	total_downloaded_bytes = 0
+	decode_seconds = 0
+
+	while download_url is not None and downloaded < limit:
+		response = session.get(download_url, params=query)
+		response.raise_for_status()
+		total_downloaded_bytes += len(response.content)
+
+		start = time.perf_counter()
+		times, values, numeric, next_link = decode(response)
+		decode_seconds += time.perf_counter() - start
+
+		pages.append((times, values, numeric))
+		downloaded += len(times)
+
+		if next_link is not None:
+			download_url = next_link
+			query = None
+		elif result_format == 'CSV' and len(times) > 0:
+			# No "Link" header, so ask for the next page with '$skip'.
+			download_url = f'{DATASTREAM_URL}/Observations'
+			query = params + [('$skip', downloaded)]
+		else:
+			download_url = None
+
+	times = np.concatenate([page[0] for page in pages])[:limit]
+	values = np.concatenate([page[1] for page in pages])[:limit]
+	numeric = np.concatenate([page[2] for page in pages])[:limit]
+	return times, values, numeric, total_downloaded_bytes, decode_seconds
+
+
+session = requests.Session()
+
+for result_format in FORMATS:
+	times, values, numeric, total_downloaded_bytes, decode_seconds = download(session, result_format)
+	print(f'{result_format}: {len(times)} Observations, {math.ceil(total_downloaded_bytes / 1000)} kilobytes, {decode_seconds * 1000:.1f} ms decoding')
@@ -0,0 +1,170 @@
+# The bandwidth numbers in #06 do not include HTTP compression, and none
+# of the examples re-use what they downloaded before. Metadata such as
+# the Things (#01, #02, #07) or Observed Properties (#08) rarely
+# changes, but it is downloaded in full every time.
+#
+# This example makes a 'requests' Session that can be used for all of
+# the queries in the other examples, and that:
+#
+# * Always asks the server to compress responses (gzip, and Brotli if
+#   the 'brotli' package is installed so the response can be decoded).
+# * Keeps each response with its "ETag" and "Last-Modified" headers.
+#   The next time the same URL is requested, these are sent back to the
+#   server, which can reply "304 Not Modified" with an empty body
+#   instead of sending the same data again.
+# * If the server says a response can be re-used for some time with
+#   "Cache-Control: max-age", it is not requested again until then.
+#
+# The cache can be kept in a file with 'shelve', so it is re-used by
+# the next run of the script.
+#
+# HTTP caching: https://developer.mozilla.org/en-US/docs/Web/HTTP/Caching
+import requests
+import json
+import math
+import re
+import shelve
+import time
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# File to keep cached responses in between runs. Use None to only cache
+# in memory.
+CACHE_FILE = "http_cache"
+
+# 'requests' can only decompress Brotli when the 'brotli' package is
+# installed, so it is only asked for then. The import is just that
+# check; the package is used by 'requests', not here.
+try:
+	import brotli
+	ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+	ACCEPT_ENCODING = 'gzip, deflate'
+
+# Headers that describe the compressed body from the server, which do
+# not apply to the decompressed body we keep in the cache.
+SKIP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+
+def wire_bytes(response):
+	# The number of body bytes read from the connection, before
+	# decompression. Only known once the body has been read (so not for
+	# 'stream=True' until then).
+	return response.raw.tell()
+
+
+class CachingSession(requests.Session):
+
+	def __init__(self, cache_file=CACHE_FILE):
+		super().__init__()
+		self.headers['Accept-Encoding'] = ACCEPT_ENCODING
+		self.cache = shelve.open(cache_file) if cache_file is not None else {}
+		# Counters:
+		# hits: served from the cache without asking the server
+		# revalidations: server replied "304 Not Modified"
+		# misses: downloaded in full
+		self.hits = 0
+		self.revalidations = 0
+		self.misses = 0
+		# Body bytes that did not have to be downloaded because of the cache
+		self.cache_saved_bytes = 0
+		# Bytes actually received from the server, and the size after
+		# decompressing them. The bodies of "304 Not Modified" responses
+		# are counted separately, as they have nothing to decompress.
+		self.wire_bytes = 0
+		self.decoded_bytes = 0
+		self.not_modified_bytes = 0
+
+	def close(self):
+		super().close()
+		if hasattr(self.cache, 'close'):
+			self.cache.close()
+
+	def cached_response(self, request, entry):
+		# Build a Response from a cache entry, as if the server had sent it.
+		response = requests.Response()
+		response.status_code = 200
+		response.reason = 'OK'
+		response.url = request.url
+		response.request = request
+		response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+		response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+		response._content = entry['content']
+		self.cache_saved_bytes += len(entry['content'])
+		return response
+
+	def store(self, url, response):
+		headers = {key: value for key, value in response.headers.items() if key.lower() not in SKIP_HEADERS}
+		if 'ETag' not in headers and 'Last-Modified' not in headers and max_age(headers) == 0:
+			return
+		self.cache[url] = {
+			'headers': headers,
+			'content': response.content,
+			'stored_at': time.time()
+		}
+
+	def send(self, request, **kwargs):
+		# Only complete GET responses are cached. Streamed responses (see
+		# #13) are passed through untouched.
+		if request.method != 'GET' or kwargs.get('stream'):
+			return super().send(request, **kwargs)
+
+		entry = self.cache.get(request.url)
+
+		if entry is not None:
+			if time.time() - entry['stored_at'] < max_age(entry['headers']):
+				self.hits += 1
+				return self.cached_response(request, entry)
+
+			if 'ETag' in entry['headers']:
+				request.headers['If-None-Match'] = entry['headers']['ETag']
+			if 'Last-Modified' in entry['headers']:
+				request.headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+
+		response = super().send(request, **kwargs)
+
+		if response.status_code == 304 and entry is not None:
+			self.revalidations += 1
+			self.not_modified_bytes += wire_bytes(response)
+			# Keep any updated headers (like a new "max-age") from the server.
+			entry['headers'].update({key: value for key, value in response.headers.items() if key.lower() not in SKIP_HEADERS})
+			entry['stored_at'] = time.time()
+			self.cache[request.url] = entry
+			return self.cached_response(request, entry)
+
+		self.misses += 1
+		self.wire_bytes += wire_bytes(response)
+		self.decoded_bytes += len(response.content)
+		if response.status_code == 200:
+			self.store(request.url, response)
+		return response
+
+	def report(self):
+		compression_saved_bytes = self.decoded_bytes - self.wire_bytes
+		print(f'{self.hits} hits, {self.revalidations} revalidated, {self.misses} misses')
+		print(f'Received {math.ceil((self.wire_bytes + self.not_modified_bytes) / 1000)} kilobytes, saved {math.ceil(compression_saved_bytes / 1000)} kilobytes by compression and {math.ceil(self.cache_saved_bytes / 1000)} kilobytes by caching.')
+
+
+def max_age(headers):
+	# Seconds the response may be re-used for without asking the server.
+	cache_control = headers.get('Cache-Control', '')
+	if 'no-cache' in cache_control or 'no-store' in cache_control:
+		return 0
+	match = re.search(r'max-age=(\d+)', cache_control)
+	return int(match.group(1)) if match else 0
+
+
+session = CachingSession()
+
+# Run the metadata queries from the other examples twice. The second
+# time, unchanged collections should only cost a "304 Not Modified".
+for run in range(2):
+	things = session.get(f'{STA_URL}/Things', params=[('$expand', 'Locations')]).json()
+	obs_props = session.get(
+		f'{STA_URL}/ObservedProperties',
+		params=[('$filter', "name eq 'Air Temperature'")]
+	).json()
+	print(f'Found {len(things["value"])} Things and {len(obs_props["value"])} Observed Properties.')
+
+session.report()
+session.close()
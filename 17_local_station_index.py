@@ -0,0 +1,331 @@
+# Like #07, this finds the stations (Things) in a bounding box or
+# polygon, but the search is done locally instead of on the server.
+#
+# A map that searches for stations every time it is moved or zoomed
+# will send a lot of 'geo.intersects' queries to the server, and each
+# one has to wait for a response. Station locations do not change often,
+# so here we download all of the Things with their Locations once, and
+# put them in a simple grid index: the world is split into cells, and
+# each cell has a list of the stations inside it. A search only has to
+# check the stations in the cells that the polygon covers.
+#
+# The local copy is refreshed in the background:
+#
+# * New Things are found by asking for IDs higher than the highest one
+#   we have (FROST gives new entities increasing IDs).
+# * Things that have moved are found from their "HistoricalLocation"
+#   entities, which are created every time a Thing's Location changes.
+# * Every so often everything is downloaded again, to remove deleted
+#   Things.
+#
+# If the local copy is too old, searches are sent to the server with the
+# same filter as #07 until the refresh has finished.
+#
+# Note: the server uses "geography" calculations on a sphere, and here
+# we use flat latitude/longitude. For station-sized areas the results
+# are the same, but very large polygons could differ near the edges.
+import requests
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# I picked this polygon to narrow down 3 results to 1.
+FILTER_GEOM = "POLYGON ((-106 68, -106 70, -105 70, -105 68, -106 68))"
+# Size of each grid cell, in degrees.
+CELL_DEGREES = 1.0
+# Seconds before the local copy is refreshed with only the changes, and
+# before it is too old to be used at all.
+REFRESH_SECONDS = 60
+STALE_SECONDS = 600
+# Seconds between downloading everything again.
+FULL_REFRESH_SECONDS = 24 * 60 * 60
+
+
+def parse_wkt_polygon(wkt):
+	# Return the rings of a WKT POLYGON as lists of (lon, lat). The first
+	# ring is the outside, any others are holes.
+	match = re.fullmatch(r'\s*POLYGON\s*\((.*)\)\s*', wkt, re.IGNORECASE)
+	if match is None:
+		raise ValueError(f'Only WKT POLYGON is supported, not {wkt!r}')
+	rings = []
+	for ring in re.findall(r'\(([^()]*)\)', match.group(1)):
+		rings.append([tuple(float(number) for number in point.split()[:2]) for point in ring.split(',')])
+	return rings
+
+
+def bbox_to_wkt(min_lon, min_lat, max_lon, max_lat):
+	return f'POLYGON (({min_lon} {min_lat}, {min_lon} {max_lat}, {max_lon} {max_lat}, {max_lon} {min_lat}, {min_lon} {min_lat}))'
+
+
+def point_in_ring(point, ring):
+	# Ray casting: count how many edges a line going right from the point
+	# crosses. An odd number means the point is inside.
+	x, y = point
+	inside = False
+	for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+		if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+			inside = not inside
+	return inside
+
+
+def point_on_segment(point, segment):
+	(x, y), ((x1, y1), (x2, y2)) = point, segment
+	return (
+		(x2 - x1) * (y - y1) == (y2 - y1) * (x - x1)
+		and min(x1, x2) <= x <= max(x1, x2)
+		and min(y1, y2) <= y <= max(y1, y2)
+	)
+
+
+def point_in_polygon(point, rings):
+	# Points on the edge count as inside, like 'geo.intersects'.
+	if any(point_on_segment(point, segment) for segment in ring_segments(rings)):
+		return True
+	return point_in_ring(point, rings[0]) and not any(point_in_ring(point, hole) for hole in rings[1:])
+
+
+def segments_intersect(a, b):
+	def side(p, q, r):
+		value = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+		return (value > 0) - (value < 0)
+	(p1, p2), (p3, p4) = a, b
+	d1, d2, d3, d4 = side(p3, p4, p1), side(p3, p4, p2), side(p1, p2, p3), side(p1, p2, p4)
+	if d1 != d2 and d3 != d4:
+		return True
+	return any([
+		d1 == 0 and point_on_segment(p1, b),
+		d2 == 0 and point_on_segment(p2, b),
+		d3 == 0 and point_on_segment(p3, a),
+		d4 == 0 and point_on_segment(p4, a)
+	])
+
+
+def ring_segments(rings):
+	return [segment for ring in rings for segment in zip(ring, ring[1:] + ring[:1])]
+
+
+def geojson_parts(geometry):
+	# Split a GeoJSON geometry into its points, line segments and
+	# polygons (as lists of rings).
+	geometry_type = geometry['type']
+	coordinates = geometry.get('coordinates')
+	if geometry_type == 'Point':
+		return [tuple(coordinates[:2])], [], []
+	if geometry_type == 'MultiPoint':
+		return [tuple(point[:2]) for point in coordinates], [], []
+	if geometry_type in ('LineString', 'MultiLineString'):
+		lines = [coordinates] if geometry_type == 'LineString' else coordinates
+		points = [tuple(point[:2]) for line in lines for point in line]
+		segments = [(tuple(a[:2]), tuple(b[:2])) for line in lines for a, b in zip(line, line[1:])]
+		return points, segments, []
+	if geometry_type in ('Polygon', 'MultiPolygon'):
+		polygons = [coordinates] if geometry_type == 'Polygon' else coordinates
+		polygons = [[[tuple(point[:2]) for point in ring] for ring in polygon] for polygon in polygons]
+		points = [point for polygon in polygons for ring in polygon for point in ring]
+		segments = [segment for polygon in polygons for segment in ring_segments(polygon)]
+		return points, segments, polygons
+	if geometry_type == 'GeometryCollection':
+		parts = [geojson_parts(part) for part in geometry['geometries']]
+		return tuple(sum((part[i] for part in parts), []) for i in range(3))
+	raise ValueError(f'Unhandled GeoJSON type: {geometry_type}')
+
+
+def geometry_intersects(geometry, rings):
+	# True if a GeoJSON geometry touches or overlaps the polygon 'rings'.
+	points, segments, polygons = geojson_parts(geometry)
+	if any(point_in_polygon(point, rings) for point in points):
+		return True
+	polygon_segments = ring_segments(rings)
+	if any(segments_intersect(a, b) for a in segments for b in polygon_segments):
+		return True
+	# The search polygon could be completely inside a Location polygon.
+	return any(point_in_polygon(rings[0][0], polygon) for polygon in polygons)
+
+
+def geometry_bounds(geometry):
+	points = geojson_parts(geometry)[0]
+	lons = [point[0] for point in points]
+	lats = [point[1] for point in points]
+	return min(lons), min(lats), max(lons), max(lats)
+
+
+def format_time(timestamp):
+	return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class StationIndex:
+	# A local copy of all Things and their Locations, with a grid index
+	# for searching by polygon.
+
+	def __init__(self, session, cell_degrees=CELL_DEGREES):
+		self.session = session
+		self.cell_degrees = cell_degrees
+		self.things = {}
+		self.cells = {}
+		self.thing_cells = {}
+		self.lock = threading.Lock()
+		self.refreshing = False
+		self.updated_at = None
+		self.full_refresh_at = None
+
+	def get_all(self, url, params):
+		entities = []
+		while url is not None:
+			response = self.session.get(url, params=params)
+			response.raise_for_status()
+			collection = response.json()
+			entities += collection['value']
+			url = collection.get('@iot.nextLink')
+			params = None
+		return entities
+
+	def cell_range(self, bounds):
+		min_lon, min_lat, max_lon, max_lat = bounds
+		for x in range(math.floor(min_lon / self.cell_degrees), math.floor(max_lon / self.cell_degrees) + 1):
+			for y in range(math.floor(min_lat / self.cell_degrees), math.floor(max_lat / self.cell_degrees) + 1):
+				yield (x, y)
+
+	def remove(self, thing_id):
+		self.things.pop(thing_id, None)
+		for cell in self.thing_cells.pop(thing_id, []):
+			self.cells[cell].discard(thing_id)
+
+	def add(self, thing):
+		# Index a Thing under every cell its first Location covers. (As in
+		# #07, the first Location is the current one.)
+		self.remove(thing['@iot.id'])
+		self.things[thing['@iot.id']] = thing
+		if len(thing['Locations']) == 0:
+			return
+		cells = list(self.cell_range(geometry_bounds(thing['Locations'][0]['location'])))
+		self.thing_cells[thing['@iot.id']] = cells
+		for cell in cells:
+			self.cells.setdefault(cell, set()).add(thing['@iot.id'])
+
+	def full_refresh(self):
+		started_at = time.time()
+		things = self.get_all(f'{STA_URL}/Things', [('$expand', 'Locations')])
+		with self.lock:
+			self.things = {}
+			self.cells = {}
+			self.thing_cells = {}
+			for thing in things:
+				self.add(thing)
+			self.updated_at = started_at
+			self.full_refresh_at = started_at
+
+	def incremental_refresh(self):
+		started_at = time.time()
+		changed_ids = set()
+
+		# Things that moved since the last refresh.
+		moves = self.get_all(f'{STA_URL}/HistoricalLocations', [
+			('$filter', f'time gt {format_time(self.updated_at)}'),
+			('$expand', 'Thing($select=id)')
+		])
+		changed_ids.update(move['Thing']['@iot.id'] for move in moves)
+
+		# New Things.
+		max_id = max((thing_id for thing_id in self.things if isinstance(thing_id, int)), default=0)
+		things = self.get_all(f'{STA_URL}/Things', [
+			('$expand', 'Locations'),
+			('$filter', f'id gt {max_id}')
+		])
+
+		known_ids = changed_ids - {thing['@iot.id'] for thing in things}
+		for thing_id in known_ids:
+			response = self.session.get(f'{STA_URL}/Things({thing_id})', params=[('$expand', 'Locations')])
+			if response.status_code == 404:
+				with self.lock:
+					self.remove(thing_id)
+				continue
+			response.raise_for_status()
+			things.append(response.json())
+
+		with self.lock:
+			for thing in things:
+				self.add(thing)
+			self.updated_at = started_at
+
+	def refresh(self):
+		try:
+			if self.full_refresh_at is None or time.time() - self.full_refresh_at > FULL_REFRESH_SECONDS:
+				self.full_refresh()
+			else:
+				self.incremental_refresh()
+		finally:
+			self.refreshing = False
+
+	def refresh_in_background(self):
+		if self.refreshing:
+			return
+		self.refreshing = True
+		threading.Thread(target=self.refresh, daemon=True).start()
+
+	def age(self):
+		return math.inf if self.updated_at is None else time.time() - self.updated_at
+
+	def search_local(self, wkt):
+		rings = parse_wkt_polygon(wkt)
+		outer = rings[0]
+		bounds = (
+			min(point[0] for point in outer), min(point[1] for point in outer),
+			max(point[0] for point in outer), max(point[1] for point in outer)
+		)
+		with self.lock:
+			candidates = set()
+			for cell in self.cell_range(bounds):
+				candidates.update(self.cells.get(cell, ()))
+			return [
+				self.things[thing_id] for thing_id in sorted(candidates)
+				if geometry_intersects(self.things[thing_id]['Locations'][0]['location'], rings)
+			]
+
+	def search_server(self, wkt):
+		# The same query as #07.
+		return self.get_all(f'{STA_URL}/Things', [
+			('$expand', 'Locations'),
+			('$filter', f"geo.intersects(Locations/location, geography'{wkt}')")
+		])
+
+	def search(self, wkt):
+		# Return the Things with a Location that intersects a WKT polygon.
+		age = self.age()
+		if age > REFRESH_SECONDS:
+			self.refresh_in_background()
+		if age > STALE_SECONDS:
+			return self.search_server(wkt)
+		return self.search_local(wkt)
+
+
+session = requests.Session()
+index = StationIndex(session)
+index.refresh()
+
+print(f'Indexed {len(index.things)} Things.')
+
+start = time.perf_counter()
+things = index.search(FILTER_GEOM)
+print(f'Found {len(things)} entities in {(time.perf_counter() - start) * 1e6:.0f} microseconds:')
+
+# Loop through the Thing entities and print some information
+for thing in things:
+	print(f'Thing: {thing["name"]}')
+	print(thing['description'])
+
+	# Auto-select first Location
+	last_location = thing['Locations'][0]
+	coords = last_location['location']['coordinates']
+
+	# Print some info about this place. The 'location' should contain
+	# valid GeoJSON. We assume it is a point.
+	print(f'Located at: {coords[1]}˚ N, {coords[0]}˚ E')
+	print()
+
+# A bounding box works the same way:
+# index.search(bbox_to_wkt(-106, 68, -105, 70))
@@ -0,0 +1,160 @@
+# Like #05, this retrieves the Observations for a moving sensor along
+# with where each one happened, but without downloading the same
+# "Feature of Interest" over and over.
+#
+# As mentioned in #05, consecutive Observations of a moving sensor often
+# share the same Feature of Interest. With '$expand=FeatureOfInterest'
+# its full GeoJSON is repeated in every one of those Observations. Here
+# we only '$expand' the ID of the Feature of Interest, and download each
+# different Feature of Interest once, a batch at a time. A limited
+# number of them are remembered (the least recently used are forgotten
+# first), so a very long track does not fill up memory.
+#
+# The result is a "trajectory": NumPy arrays of time, longitude,
+# latitude and result, with one item per Observation, instead of a list
+# of nested dictionaries.
+#
+# Requires NumPy: https://numpy.org
+import requests
+import json
+import math
+from collections import OrderedDict
+import numpy as np
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# Direct link to Datastream entity. See the note in #05 about moving
+# Datastreams.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Use server-side paging to download more data until this number is
+# reached.
+OBSERVATION_LIMIT = 500
+# Maximum number of Features of Interest to remember.
+FOI_CACHE_SIZE = 10000
+# Number of Feature of Interest IDs to put in each '$filter'.
+BATCH_SIZE = 50
+
+
+def format_id(entity_id):
+	# IDs can be numbers or strings, depending on the server. Strings
+	# must be single-quoted in '$filter'.
+	if isinstance(entity_id, str):
+		return "'" + entity_id.replace("'", "''") + "'"
+	return str(entity_id)
+
+
+def feature_point(feature):
+	# Return (lon, lat) for a GeoJSON feature. As in #05, the feature is
+	# almost always a Point; for anything else the first coordinate is
+	# used.
+	if feature['type'] != 'Point':
+		print(f"Warning: unhandled GeoJSON type: {feature['type']}")
+		coordinates = feature['coordinates']
+		while isinstance(coordinates[0], list):
+			coordinates = coordinates[0]
+		return coordinates[0], coordinates[1]
+	return feature['coordinates'][0], feature['coordinates'][1]
+
+
+class FeatureCache:
+	# Remembers the (lon, lat) of up to 'size' Features of Interest by ID,
+	# downloading the ones it does not have.
+
+	def __init__(self, session, size=FOI_CACHE_SIZE, batch_size=BATCH_SIZE):
+		self.session = session
+		self.size = size
+		self.batch_size = batch_size
+		self.points = OrderedDict()
+		self.downloaded = 0
+
+	def resolve(self, foi_ids):
+		# Return a dictionary of ID to (lon, lat) for all the IDs.
+		found = {}
+		missing = []
+		for foi_id in dict.fromkeys(foi_ids):
+			if foi_id in self.points:
+				self.points.move_to_end(foi_id)
+				found[foi_id] = self.points[foi_id]
+			else:
+				missing.append(foi_id)
+
+		for i in range(0, len(missing), self.batch_size):
+			batch = missing[i:i + self.batch_size]
+			download_url = f'{STA_URL}/FeaturesOfInterest'
+			params = [
+				('$filter', ' or '.join(f'id eq {format_id(foi_id)}' for foi_id in batch)),
+				('$select', 'id,feature')
+			]
+			while download_url is not None:
+				response = self.session.get(download_url, params=params)
+				response.raise_for_status()
+				foi_entities = response.json()
+				for foi in foi_entities['value']:
+					found[foi['@iot.id']] = self.points[foi['@iot.id']] = feature_point(foi['feature'])
+					self.downloaded += 1
+				download_url = foi_entities.get('@iot.nextLink')
+				params = None
+
+		while len(self.points) > self.size:
+			self.points.popitem(last=False)
+
+		return found
+
+
+more_results = True
+download_url = f'{DATASTREAM_URL}/Observations'
+params = [
+	('$orderby', 'phenomenonTime asc'),
+	('$select', 'phenomenonTime,result'),
+	('$expand', 'FeatureOfInterest($select=id)')
+]
+pages = []
+downloaded = 0
+total_downloaded_bytes = 0
+
+session = requests.Session()
+features = FeatureCache(session)
+
+while(more_results and downloaded < OBSERVATION_LIMIT):
+	response = session.get(download_url, params=params)
+	response.raise_for_status()
+	total_downloaded_bytes += len(response.content)
+	observation_entities = response.json()
+	entities = observation_entities['value']
+	print(f'Downloaded {len(entities)} entities: {download_url}')
+
+	foi_ids = [(entity.get('FeatureOfInterest') or {}).get('@iot.id') for entity in entities]
+	points = features.resolve([foi_id for foi_id in foi_ids if foi_id is not None])
+	# A Feature of Interest that is missing or could not be downloaded
+	# (for example, deleted since) has no position, so its Observations
+	# are left out.
+	located = [(entity, foi_id) for entity, foi_id in zip(entities, foi_ids) if foi_id in points]
+	if len(located) < len(entities):
+		print(f'Skipped {len(entities) - len(located)} Observations with a missing Feature of Interest')
+
+	# Convert the page to arrays straight away, so the dictionaries can
+	# be thrown away. As in #14, results that are not numbers (including
+	# true and false) are stored as NaN.
+	pages.append((
+		np.array([entity['phenomenonTime'].split('/')[0].rstrip('Z') for entity, foi_id in located], dtype='datetime64[ms]'),
+		np.array([points[foi_id][0] for entity, foi_id in located], dtype='float64'),
+		np.array([points[foi_id][1] for entity, foi_id in located], dtype='float64'),
+		np.array([entity['result'] if isinstance(entity['result'], (int, float)) and not isinstance(entity['result'], bool) else math.nan for entity, foi_id in located], dtype='float64')
+	))
+	downloaded += len(entities)
+
+	# If the '@iot.nextLink' key is in the response, there is more data
+	# on the server. Otherwise, we are at the end of the collection.
+	more_results = ('@iot.nextLink' in observation_entities)
+	download_url = observation_entities.get('@iot.nextLink')
+	# The nextLink already includes our query options.
+	params = None
+
+times, lons, lats, results = (np.concatenate(column)[:OBSERVATION_LIMIT] for column in zip(*pages))
+
+print(f'Downloaded {len(times)} Observations and {features.downloaded} Features of Interest, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
+print(f'Trajectory uses {math.ceil((times.nbytes + lons.nbytes + lats.nbytes + results.nbytes) / 1000)} kilobytes of memory.')
+
+# Print out the first few points of the trajectory
+for timestamp, lon, lat, result in list(zip(times, lons, lats, results))[:5]:
+	print(f"{timestamp}, {result}, {lat} N, {lon} E")
@@ -0,0 +1,130 @@
+# Like #04, this retrieves the Observations for a Datastream in a time
+# interval, but for intervals too long to fit in one page.
+#
+# #04 only reads the first page, so a wide interval is cut short. Paging
+# with '@iot.nextLink' (like #03) would get everything, but one page at a
+# time. Instead, the interval is split into smaller time windows that are
+# each downloaded (with paging) at the same time, and then joined back
+# together in time order.
+#
+# The number of windows is chosen from '@iot.count', the number of
+# Observations in the whole interval, assuming they are spread evenly
+# over time. If they are not, some windows just take more pages.
+#
+# Like #04, each window includes both its start and end time. An
+# Observation exactly on the time between two windows is returned in
+# both, so when joining we skip any Observation in a window that has
+# the same '@iot.id' as one in the window before. Comparing the IDs
+# works no matter how the server writes the times.
+import requests
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+
+# Dates for filters must be in ISO8601 format. See #04.
+INTERVAL_START = "2020-09-01T00:00:00.000Z"
+INTERVAL_END = "2020-09-30T00:00:00.000Z"
+
+# Aim for about this many Observations in each window.
+WINDOW_SIZE = 1000
+# Never split into more windows than this.
+MAX_WINDOWS = 64
+# Number of windows being downloaded at the same time.
+CONCURRENCY = 4
+
+
+def parse_time(timestamp):
+	return datetime.strptime(timestamp.replace('Z', '+00:00'), '%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+def format_time(moment):
+	return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def time_filter(start, end):
+	return f'phenomenonTime ge {start} and phenomenonTime le {end}'
+
+
+def count_observations(session, start, end):
+	# '$top=0' returns no Observations, only '@iot.count'.
+	response = session.get(
+		f'{DATASTREAM_URL}/Observations',
+		params=[
+			('$filter', time_filter(start, end)),
+			('$count', 'true'),
+			('$top', 0)
+		]
+	)
+	response.raise_for_status()
+	return response.json()['@iot.count']
+
+
+def plan_windows(start, end, count):
+	# Split the interval into equal lengths of time, with the edges
+	# rounded to milliseconds (the precision of 'phenomenonTime').
+	windows = max(1, min(MAX_WINDOWS, math.ceil(count / WINDOW_SIZE)))
+	start_time = parse_time(start)
+	step = (parse_time(end) - start_time) / windows
+	edges = [start] + [format_time(start_time + step * i) for i in range(1, windows)] + [end]
+	# Rounding can make two edges the same for very short intervals.
+	edges = list(dict.fromkeys(edges))
+	return list(zip(edges, edges[1:])) or [(start, end)]
+
+
+def download_window(session, window):
+	# Download every page of Observations in one window.
+	start, end = window
+	observations = []
+	download_url = f'{DATASTREAM_URL}/Observations'
+	params = [
+		('$orderby', 'phenomenonTime asc'),
+		('$select', 'id,phenomenonTime,result'),
+		('$filter', time_filter(start, end))
+	]
+
+	while download_url is not None:
+		response = session.get(download_url, params=params)
+		response.raise_for_status()
+		observation_entities = response.json()
+		observations += observation_entities['value']
+		download_url = observation_entities.get('@iot.nextLink')
+		# The nextLink already includes our query options.
+		params = None
+
+	print(f'Downloaded {len(observations)} Observations from {start} to {end}')
+	return observations
+
+
+def interval_observations(session, start, end, concurrency=CONCURRENCY):
+	# Yield every Observation in the interval, in time order. Windows are
+	# downloaded at the same time, but returned in order as they finish.
+	count = count_observations(session, start, end)
+	windows = plan_windows(start, end, count)
+	print(f'Downloading {count} Observations in {len(windows)} windows')
+
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		previous_ids = set()
+		for observations in executor.map(lambda window: download_window(session, window), windows):
+			for observation in observations:
+				# Already returned at the end of the previous window.
+				if observation['@iot.id'] in previous_ids:
+					continue
+				yield observation
+			previous_ids = {observation['@iot.id'] for observation in observations}
+
+
+# Keep connections open between requests, with one for each window
+# being downloaded. See #09.
+session = requests.Session()
+adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=CONCURRENCY)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+data = [(observation['phenomenonTime'], observation['result']) for observation in interval_observations(session, INTERVAL_START, INTERVAL_END)]
+
+# Do something with Observation data
+print(f'Found {len(data)} Observations between {INTERVAL_START} and {INTERVAL_END}')
@@ -0,0 +1,217 @@
+# The only measurements in the other examples are the downloaded bytes
+# printed by #03 and #06. This example wraps every request in a
+# 'requests' Session that records:
+#
+# * the URL "template", with IDs replaced, like
+#   "/Datastreams({id})/Observations", so similar queries are grouped
+# * the '$expand', '$filter', '$select', '$top' (and other) options
+# * the HTTP status
+# * time to first byte (until the response headers arrived) and total
+#   time (until the whole body arrived)
+# * bytes received (compressed) and after decompressing
+# * number of entities in the response, and time spent parsing JSON
+#
+# Functions can be added as "hooks" to receive each measurement as it
+# happens, for example to log slow pages. At the end, all of the
+# measurements can be saved as JSON Lines (one JSON object per request),
+# or as a summary in the Prometheus text format, with histograms of the
+# request times per URL template.
+#
+# To measure the number of entities and the parse time before the hooks
+# are called, JSON responses are parsed straight away, and
+# 'response.json()' then returns that result without parsing again.
+# Streamed responses ('stream=True', see #13) are read by the caller,
+# so their bytes, entities and parse time are left empty.
+#
+# Prometheus text format: https://prometheus.io/docs/instrumenting/exposition_formats/
+import requests
+import json
+import math
+import re
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Files to save the measurements to.
+JSONL_FILE = "metrics.jsonl"
+PROMETHEUS_FILE = "metrics.prom"
+# Upper bounds of the histogram buckets, in seconds.
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# Query options recorded for each request.
+QUERY_OPTIONS = ['$expand', '$filter', '$select', '$top', '$skip', '$orderby', '$count', '$resultFormat']
+
+
+def url_template(url):
+	# "https://.../v1.0/Datastreams(46)/Observations" becomes
+	# "/Datastreams({id})/Observations".
+	path = urlsplit(url).path
+	root = urlsplit(STA_URL).path
+	if path.startswith(root):
+		path = path[len(root):]
+	return re.sub(r'\([^)]*\)', '({id})', path)
+
+
+def count_entities(document):
+	if not isinstance(document, dict):
+		return 0
+	if 'value' not in document:
+		return 1
+	# "dataArray" responses (see #15) have the entities in groups.
+	if document['value'] and isinstance(document['value'][0], dict) and 'dataArray' in document['value'][0]:
+		return sum(len(group['dataArray']) for group in document['value'])
+	return len(document['value'])
+
+
+def escape_label(value):
+	# Label values are quoted, so backslashes, quotes and line breaks must
+	# be escaped.
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class InstrumentedSession(requests.Session):
+
+	def __init__(self):
+		super().__init__()
+		self.records = []
+		self.metric_hooks = []
+
+	def add_hook(self, hook):
+		# 'hook' is called with the measurement dictionary of each request.
+		self.metric_hooks.append(hook)
+
+	def send(self, request, **kwargs):
+		start = time.perf_counter()
+		response = super().send(request, **kwargs)
+		total_seconds = time.perf_counter() - start
+
+		url = urlsplit(request.url)
+		options = dict(parse_qsl(url.query))
+		record = {
+			'time': time.time(),
+			'method': request.method,
+			'template': url_template(request.url),
+			'options': {key: options[key] for key in QUERY_OPTIONS if key in options},
+			'status': response.status_code,
+			# 'elapsed' is the time until the response headers were read.
+			'ttfb_seconds': response.elapsed.total_seconds(),
+			'total_seconds': total_seconds,
+			'wire_bytes': None,
+			'decoded_bytes': None,
+			'entities': None,
+			'parse_seconds': None
+		}
+		if not kwargs.get('stream'):
+			# 'raw.tell()' is the number of bytes read from the connection,
+			# before decompression, as in #16.
+			record['wire_bytes'] = response.raw.tell()
+			record['decoded_bytes'] = len(response.content)
+			if 'json' in response.headers.get('Content-Type', ''):
+				parse_start = time.perf_counter()
+				try:
+					document = response.json()
+				except ValueError:
+					pass
+				else:
+					record['parse_seconds'] = time.perf_counter() - parse_start
+					record['entities'] = count_entities(document)
+					response.json = lambda **json_kwargs: document
+		self.records.append(record)
+
+		for hook in self.metric_hooks:
+			hook(record)
+		return response
+
+	def write_jsonl(self, path):
+		with open(path, 'w') as file:
+			for record in self.records:
+				file.write(json.dumps(record) + '\n')
+
+	def prometheus_text(self):
+		# Summarize the records by URL template, as Prometheus metrics.
+		lines = []
+		groups = {}
+		for record in self.records:
+			groups.setdefault(record['template'], []).append(record)
+
+		def label(template, **extra):
+			labels = {'template': template, **extra}
+			return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+		def histogram(name, help_text, key):
+			lines.append(f'# HELP {name} {help_text}')
+			lines.append(f'# TYPE {name} histogram')
+			for template, records in groups.items():
+				values = [record[key] for record in records if record[key] is not None]
+				for bucket in LATENCY_BUCKETS:
+					lines.append(f'{name}_bucket{label(template, le=bucket)} {sum(1 for value in values if value <= bucket)}')
+				lines.append(f'{name}_bucket{label(template, le="+Inf")} {len(values)}')
+				lines.append(f'{name}_sum{label(template)} {sum(values)}')
+				lines.append(f'{name}_count{label(template)} {len(values)}')
+
+		def counter(name, help_text, values):
+			lines.append(f'# HELP {name} {help_text}')
+			lines.append(f'# TYPE {name} counter')
+			for labels, value in values:
+				lines.append(f'{name}{labels} {value}')
+
+		histogram('sta_request_duration_seconds', 'Time until the whole response body arrived.', 'total_seconds')
+		histogram('sta_request_ttfb_seconds', 'Time until the response headers arrived.', 'ttfb_seconds')
+
+		statuses = {}
+		for record in self.records:
+			key = (record['template'], record['status'])
+			statuses[key] = statuses.get(key, 0) + 1
+		counter('sta_requests_total', 'Requests by URL template and HTTP status.', [
+			(label(template, status=status), count) for (template, status), count in statuses.items()
+		])
+		counter('sta_response_bytes_total', 'Response body bytes, as received and after decompressing.', [
+			(label(template, encoding=encoding), sum(record[key] or 0 for record in records))
+			for template, records in groups.items()
+			for encoding, key in [('wire', 'wire_bytes'), ('decoded', 'decoded_bytes')]
+		])
+		counter('sta_entities_total', 'Entities in the parsed responses.', [
+			(label(template), sum(record['entities'] or 0 for record in records)) for template, records in groups.items()
+		])
+		counter('sta_json_parse_seconds_total', 'Time spent parsing JSON responses.', [
+			(label(template), sum(record['parse_seconds'] or 0 for record in records)) for template, records in groups.items()
+		])
+		return '\n'.join(lines) + '\n'
+
+	def write_prometheus(self, path):
+		with open(path, 'w') as file:
+			file.write(self.prometheus_text())
+
+
+def print_slow_pages(record):
+	# An example hook: print any request that took longer than a second.
+	if record['total_seconds'] > 1:
+		print(f'Slow request: {record["template"]} {record["options"]} took {record["total_seconds"]:.2f} s')
+
+
+session = InstrumentedSession()
+session.add_hook(print_slow_pages)
+
+# Some of the queries from the other examples, through the session.
+session.get(f'{STA_URL}/Things', params=[('$expand', 'Locations')]).json()
+session.get(f'{STA_URL}/ObservedProperties', params=[('$filter', "name eq 'Air Temperature'")]).json()
+
+download_url = f'{DATASTREAM_URL}/Observations'
+params = [
+	('$orderby', 'phenomenonTime asc'),
+	('$select', 'phenomenonTime,result')
+]
+for page in range(5):
+	observation_entities = session.get(download_url, params=params).json()
+	download_url = observation_entities.get('@iot.nextLink')
+	params = None
+	if download_url is None:
+		break
+
+session.write_jsonl(JSONL_FILE)
+session.write_prometheus(PROMETHEUS_FILE)
+
+for record in session.records:
+	print(f'{record["status"]} {record["template"]}: {record["entities"]} entities, {record["total_seconds"] * 1000:.0f} ms, {math.ceil((record["wire_bytes"] or 0) / 1000)} kilobytes')
@@ -0,0 +1,165 @@
+# #01 makes one request per Thing to get its Location, and #08 (with
+# #10) makes at least one request per Datastream. Each of these is small,
+# so most of the time is spent on the round trip to the server, not on
+# the server's work or the download.
+#
+# OGC SensorThings API version 1.1 can accept a "batch" of requests in
+# one HTTP POST to '$batch', and sends all the responses back together.
+# The server still runs each request separately, so unlike '$expand'
+# (see the warning at the end of #08) this does not ask the server for
+# an expensive joined query; it only saves the round trips.
+#
+# Here requests are collected in a BatchClient, and sent in batches of
+# up to BATCH_SIZE. Each added request gets a "Future" that receives its
+# own response when the batch comes back. If the server does not
+# support '$batch', the requests are sent one at a time instead.
+#
+# This uses the JSON batch format, which FROST only accepts on its
+# "v1.1" URL, so the batches are sent there even though the other
+# requests use "v1.0". The small GET requests here get the same answers
+# from both versions.
+# https://docs.ogc.org/is/18-088/18-088.html#batch-requests
+# http://docs.oasis-open.org/odata/odata-json-format/v4.01/odata-json-format-v4.01.html#sec_BatchRequestsandResponses
+import requests
+import json
+from concurrent.futures import Future
+from urllib.parse import urlencode
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# '$batch' URL of the same service, on "v1.1".
+BATCH_URL = STA_URL.rsplit('/', 1)[0] + '/v1.1/$batch'
+# Maximum number of requests in one batch. Servers limit this, and a
+# very large batch delays all of its responses until the slowest is done.
+BATCH_SIZE = 50
+
+
+class BatchClient:
+
+	def __init__(self, session, service_url=STA_URL, batch_url=BATCH_URL, batch_size=BATCH_SIZE):
+		self.session = session
+		self.service_url = service_url
+		self.batch_url = batch_url
+		self.batch_size = batch_size
+		self.pending = []
+		# None until the first batch is tried.
+		self.supported = None
+		self.http_requests = 0
+
+	def relative_url(self, url, params):
+		# Requests in a batch use URLs relative to the service root.
+		if url.startswith(self.service_url + '/'):
+			url = url[len(self.service_url) + 1:]
+		if params:
+			url += ('&' if '?' in url else '?') + urlencode(params)
+		return url
+
+	def get(self, url, params=None):
+		# Add a GET request to the next batch. Returns a Future for the
+		# decoded JSON response.
+		future = Future()
+		self.pending.append((url, params, future))
+		if len(self.pending) >= self.batch_size:
+			self.flush()
+		return future
+
+	def flush(self):
+		# Send all the pending requests.
+		while len(self.pending) > 0:
+			batch = self.pending[:self.batch_size]
+			self.pending = self.pending[self.batch_size:]
+			if self.supported is not False and self.send_batch(batch):
+				continue
+			self.send_each(batch)
+
+	def send_batch(self, batch):
+		# Returns False if the server does not support '$batch'.
+		body = {
+			'requests': [
+				{'id': str(i), 'method': 'get', 'url': self.relative_url(url, params)}
+				for i, (url, params, future) in enumerate(batch)
+			]
+		}
+		self.http_requests += 1
+		response = self.session.post(
+			self.batch_url,
+			data=json.dumps(body),
+			headers={'Content-Type': 'application/json', 'Accept': 'application/json'}
+		)
+		# Only these mean there is no '$batch' at all. Other errors, like
+		# "400 Bad Request" for a malformed batch, are raised.
+		if response.status_code in (404, 405, 501) and self.supported is None:
+			print(f'Server does not support JSON $batch ({response.status_code}), sending requests one at a time.')
+			self.supported = False
+			return False
+		response.raise_for_status()
+		self.supported = True
+
+		# Responses may come back in any order, so match them by 'id'.
+		futures = {str(i): future for i, (url, params, future) in enumerate(batch)}
+		for item in response.json()['responses']:
+			future = futures.pop(item.get('id'), None)
+			if future is None:
+				print(f'Ignoring a batch response for a request that was not sent: {item.get("id")!r}')
+				continue
+			if item['status'] >= 400:
+				future.set_exception(requests.HTTPError(f'{item["status"]} for batch request {batch[int(item["id"])][0]}: {item.get("body")}'))
+			else:
+				future.set_result(item.get('body'))
+		for future in futures.values():
+			future.set_exception(requests.HTTPError('No response in batch'))
+		return True
+
+	def send_each(self, batch):
+		for url, params, future in batch:
+			self.http_requests += 1
+			try:
+				response = self.session.get(url, params=params)
+				response.raise_for_status()
+				future.set_result(response.json())
+			except Exception as error:
+				future.set_exception(error)
+
+
+session = requests.Session()
+batch = BatchClient(session)
+
+# Get one page of Things, as in #01.
+response = session.get(f'{STA_URL}/Things')
+things = response.json()['value']
+
+# Add a request for the Locations of each Thing. Nothing is sent until
+# there are BATCH_SIZE requests, or 'flush' is called.
+location_futures = [
+	(thing, batch.get(thing['Locations@iot.navigationLink'], [('$select', 'location')]))
+	for thing in things
+]
+
+# The same client can collect other small requests too, like the first
+# page of Observations for the Datastreams found in #08.
+datastream_response = session.get(
+	f'{STA_URL}/ObservedProperties(1)/Datastreams',
+	params=[('$select', 'id,name')]
+)
+observation_futures = [
+	(datastream, batch.get(
+		f'{STA_URL}/Datastreams({datastream["@iot.id"]})/Observations',
+		[('$orderby', 'phenomenonTime desc'), ('$select', 'phenomenonTime,result'), ('$top', 1)]
+	))
+	for datastream in datastream_response.json()['value']
+]
+
+batch.flush()
+
+for thing, future in location_futures:
+	location_entities = future.result()
+	coords = location_entities['value'][0]['location']['coordinates']
+	print(f'Thing: {thing["name"]}, located at: {coords[1]}˚ N, {coords[0]}˚ E')
+
+for datastream, future in observation_futures:
+	latest = future.result()['value']
+	if len(latest) > 0:
+		print(f'Datastream: {datastream["name"]}, latest: {latest[0]["phenomenonTime"]} {latest[0]["result"]}')
+
+individual = len(location_futures) + len(observation_futures)
+print(f'Used {batch.http_requests} HTTP requests for {individual} queries.')
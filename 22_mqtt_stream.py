@@ -0,0 +1,222 @@
+# For a live chart, re-running the query from #03 with
+# '$orderby=phenomenonTime desc' every few seconds downloads the same
+# Observations over and over, and new data still waits until the next
+# query.
+#
+# FROST (and other SensorThings API servers) also publish every new
+# entity over MQTT. Subscribing to the topic
+# "v1.0/Datastreams(46)/Observations" sends each new Observation of
+# that Datastream as soon as the server receives it, with no requests.
+#
+# MQTT does not keep messages for a client while it is disconnected, so
+# after a reconnect any Observations that were missed are downloaded
+# over HTTP, starting after the last one received. The broker may send
+# messages before it confirms the subscription, so all messages on a new
+# connection are held until that download has finished, and any already
+# covered by it are skipped.
+#
+# The Observations are returned as '(phenomenonTime, result)' tuples,
+# the same as the 'data' list in #03.
+#
+# This uses the 'paho-mqtt' package, which is not needed by the other
+# examples:
+#
+#   pip install paho-mqtt
+#
+# To try this without the real server, run the stand-in server with an
+# MQTT broker that publishes a new Observation every 5 seconds:
+#
+#   python mock_sta_server.py --port 8080 --mqtt-port 1883 --publish 46
+#
+# and change the URLs and MQTT_HOST below to "127.0.0.1".
+#
+# MQTT extension: http://docs.opengeospatial.org/is/15-078r6/15-078r6.html#85
+import requests
+import json
+import queue
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Topic for new Observations of the Datastream. This is the Datastream
+# URL path after the service root.
+MQTT_TOPIC = "v1.0/Datastreams(46)/Observations"
+# MQTT broker of the SensorThings API service.
+MQTT_HOST = "arctic-sta.gswlab.ca"
+MQTT_PORT = 1883
+# Seconds between keep-alive messages, so a broken connection is
+# noticed.
+KEEPALIVE = 30
+# Seconds to wait before trying to connect again, doubling up to the
+# maximum.
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+def parse_time(timestamp):
+	# 'phenomenonTime' can be an interval "start/end"; use the start.
+	return datetime.strptime(timestamp.split('/')[0].replace('Z', '+00:00'), '%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+class ObservationStream:
+
+	def __init__(self, session, datastream_url=DATASTREAM_URL, topic=MQTT_TOPIC, host=MQTT_HOST, port=MQTT_PORT):
+		self.session = session
+		self.datastream_url = datastream_url
+		self.topic = topic
+		self.host = host
+		self.port = port
+		# Events from the MQTT thread, read by 'observations()'.
+		self.events = queue.Queue()
+		# Messages received on a new connection before its backfill has
+		# finished.
+		self.held = []
+		self.backfilled_connection = False
+		self.closing = False
+		# Time of the last Observation returned, as a string and parsed.
+		self.last_time = None
+		self.last_parsed = None
+		self.connections = 0
+		self.messages = 0
+		self.skipped = 0
+		self.backfilled = 0
+		self.http_requests = 0
+
+		# paho-mqtt 2.0 changed the arguments of the callbacks.
+		if hasattr(mqtt, 'CallbackAPIVersion'):
+			self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+		else:
+			self.client = mqtt.Client()
+		self.client.on_connect = self.on_connect
+		self.client.on_subscribe = self.on_subscribe
+		self.client.on_message = self.on_message
+		self.client.on_disconnect = self.on_disconnect
+		self.client.reconnect_delay_set(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY)
+
+	# These are called on the MQTT client's thread.
+
+	def on_connect(self, client, userdata, flags, reason_code, properties=None):
+		# Subscribe again after every connect, as the broker does not keep
+		# subscriptions for us.
+		if reason_code == 0:
+			client.subscribe(self.topic)
+
+	def on_subscribe(self, client, userdata, mid, reason_codes, properties=None):
+		self.events.put(('subscribed', None))
+
+	def on_message(self, client, userdata, message):
+		self.events.put(('message', message.payload))
+
+	def on_disconnect(self, client, userdata, *args):
+		# 'close()' disconnects too, which is not a reason to reconnect.
+		if not self.closing:
+			self.events.put(('disconnected', None))
+
+	def http_observations(self, params):
+		# Download every page of Observations for a query, oldest first.
+		download_url = f'{self.datastream_url}/Observations'
+		params = [
+			('$orderby', 'phenomenonTime asc'),
+			('$select', 'phenomenonTime,result')
+		] + params
+
+		while download_url is not None:
+			self.http_requests += 1
+			response = self.session.get(download_url, params=params)
+			response.raise_for_status()
+			observation_entities = response.json()
+			yield from observation_entities['value']
+			download_url = observation_entities.get('@iot.nextLink')
+			# The nextLink already includes our query options.
+			params = None
+
+	def latest(self):
+		# The newest Observation, so the stream starts with the current
+		# value instead of waiting for the next one.
+		self.http_requests += 1
+		response = self.session.get(
+			f'{self.datastream_url}/Observations',
+			params=[
+				('$orderby', 'phenomenonTime desc'),
+				('$select', 'phenomenonTime,result'),
+				('$top', 1)
+			]
+		)
+		response.raise_for_status()
+		return response.json()['value']
+
+	def accept(self, observation):
+		# Returns the record for an Observation, or None if an Observation
+		# at the same time or later was already returned. Each Datastream
+		# has one Observation for each 'phenomenonTime'.
+		parsed = parse_time(observation['phenomenonTime'])
+		if self.last_parsed is not None and parsed <= self.last_parsed:
+			self.skipped += 1
+			return None
+		self.last_time = observation['phenomenonTime']
+		self.last_parsed = parsed
+		return (observation['phenomenonTime'], observation['result'])
+
+	def observations(self):
+		# Yield each Observation as it arrives. Runs until 'close()' is
+		# called.
+		self.client.connect_async(self.host, self.port, KEEPALIVE)
+		self.client.loop_start()
+		try:
+			while True:
+				event, payload = self.events.get()
+				if event == 'closed':
+					return
+				elif event == 'subscribed':
+					# Messages have been held since the connection was lost,
+					# so 'last_time' is still the last Observation before it,
+					# and the download covers the whole gap.
+					self.connections += 1
+					if self.last_time is None:
+						backfill = self.latest()
+					else:
+						backfill = self.http_observations([('$filter', f'phenomenonTime gt {self.last_time}')])
+					for observation in backfill:
+						record = self.accept(observation)
+						if record is not None:
+							if self.connections > 1:
+								self.backfilled += 1
+							yield record
+					self.backfilled_connection = True
+					held, self.held = self.held, []
+					for payload in held:
+						record = self.accept(json.loads(payload))
+						if record is not None:
+							yield record
+				elif event == 'message':
+					self.messages += 1
+					if not self.backfilled_connection:
+						self.held.append(payload)
+						continue
+					record = self.accept(json.loads(payload))
+					if record is not None:
+						yield record
+				elif event == 'disconnected':
+					self.backfilled_connection = False
+					print(f'Disconnected from {self.host}, reconnecting')
+		finally:
+			self.client.loop_stop()
+
+	def close(self):
+		self.closing = True
+		self.client.disconnect()
+		self.events.put(('closed', None))
+
+
+session = requests.Session()
+stream = ObservationStream(session)
+
+try:
+	for phenomenon_time, result in stream.observations():
+		print(f'{phenomenon_time}: {result}')
+except KeyboardInterrupt:
+	stream.close()
+
+print(f'{stream.messages} MQTT messages, {stream.backfilled} Observations downloaded after reconnecting, {stream.http_requests} HTTP requests.')
@@ -0,0 +1,224 @@
+# The notes in #03 mention that its 'data' list is used by JavaScript
+# chart libraries. A chart a few hundred pixels wide cannot show more
+# than a few thousand points anyway, so sending it every Observation of
+# a long Datastream only makes the page slower to load and draw.
+#
+# This downloads Observations like #03, and reduces them to about
+# TARGET_POINTS points for the chart, in one of two ways:
+#
+# * "minmax": split the series into buckets, and keep the lowest and
+#   highest Observation in each bucket. Spikes are never lost, which is
+#   good for finding problems in the data.
+# * "lttb": "Largest-Triangle-Three-Buckets" keeps one Observation in
+#   each bucket, the one that makes the largest triangle with the
+#   Observation kept in the previous bucket and the average of the next
+#   bucket. This keeps the shape of the line as it looks to a person.
+#   https://skemman.is/handle/1946/15343
+#
+# Either way the lowest and highest Observation of the whole series are
+# always kept.
+#
+# The reduction is done while pages are still downloading: a chart-ready
+# series can be drawn after any page, and memory stays the same size
+# however many Observations there are. When too many points have been
+# kept, they are reduced with "minmax" into fewer points, which keeps
+# every extreme value seen so far.
+#
+# Requires NumPy: https://numpy.org
+import requests
+import json
+import math
+import numpy as np
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Use server-side paging to download more data until this number is
+# reached.
+OBSERVATION_LIMIT = 5000
+# Number of points to return for the chart.
+TARGET_POINTS = 500
+# "minmax" or "lttb", see above.
+MODE = "lttb"
+# Points kept while downloading, as a multiple of TARGET_POINTS. When
+# there are more, they are reduced to half this many.
+BUFFER_FACTOR = 8
+
+
+def parse_times(phenomenon_times):
+	# Convert ISO8601 strings to 'datetime64[ms]', as in #14.
+	return np.array(
+		[phenomenon_time.split('/')[0].rstrip('Z') for phenomenon_time in phenomenon_times],
+		dtype='datetime64[ms]'
+	)
+
+
+def format_times(times):
+	# Convert 'datetime64[ms]' back to strings like 'phenomenonTime'.
+	return [f'{time}Z' for time in np.datetime_as_string(times, unit='ms')]
+
+
+def bucket_edges(length, buckets):
+	# Split 'length' points into 'buckets' buckets with (almost) the same
+	# number of points in each. Returns the start of each bucket, and the
+	# end of the last one.
+	return np.linspace(0, length, buckets + 1).astype(np.int64)
+
+
+def extrema_indexes(values):
+	# Index of the lowest and highest value.
+	return np.array([np.argmin(values), np.argmax(values)])
+
+
+def minmax(times, values, target):
+	# Return the indexes of the points to keep, at most 'target' of them,
+	# in time order: the lowest and highest value in each of 'target / 2'
+	# buckets.
+	length = len(values)
+	if length <= target:
+		return np.arange(length)
+
+	edges = bucket_edges(length, max(1, target // 2))
+	bucket = np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+	# Sort by bucket, then by value: the first point of each bucket is
+	# then its lowest, and the last is its highest.
+	order = np.lexsort((values, bucket))
+	lowest = order[edges[:-1]]
+	highest = order[edges[1:] - 1]
+	return np.unique(np.concatenate((lowest, highest)))
+
+
+def lttb(times, values, target):
+	# Return the indexes of the points to keep, in time order. The first
+	# and last points are always kept, and one point from each of
+	# 'target - 2' buckets in between, plus the lowest and highest value
+	# if they were not chosen already.
+	length = len(values)
+	if length <= target or target < 3:
+		return np.arange(length)
+
+	x = (times - times[0]).astype('float64')
+	y = values
+	edges = 1 + bucket_edges(length - 2, target - 2)
+	starts = edges[:-1]
+	sizes = np.diff(edges)
+
+	# Average of each bucket, and of the last point as a bucket of its own.
+	average_x = np.append(np.add.reduceat(x[1:-1], starts - 1) / sizes, x[-1])
+	average_y = np.append(np.add.reduceat(y[1:-1], starts - 1) / sizes, y[-1])
+
+	# The triangle for each point depends on the point chosen in the
+	# previous bucket, so buckets are done one after another. Within a
+	# bucket, every triangle is worked out at once.
+	chosen = np.empty(target, dtype=np.int64)
+	chosen[0] = 0
+	chosen[-1] = length - 1
+	previous = 0
+	for i in range(target - 2):
+		start, end = edges[i], edges[i + 1]
+		area = np.abs(
+			(x[previous] - average_x[i + 1]) * (y[start:end] - y[previous]) -
+			(x[previous] - x[start:end]) * (average_y[i + 1] - y[previous])
+		)
+		previous = start + np.argmax(area)
+		chosen[i + 1] = previous
+
+	return np.unique(np.concatenate((chosen, extrema_indexes(values))))
+
+
+MODES = {'minmax': minmax, 'lttb': lttb}
+
+
+class Downsampler:
+	# Keeps a reduced copy of a time series as pages of it are added, in
+	# time order. 'series()' returns the chart-ready points at any time.
+
+	def __init__(self, target=TARGET_POINTS, mode=MODE, buffer_factor=BUFFER_FACTOR):
+		if mode not in MODES:
+			raise ValueError(f'mode must be one of {", ".join(MODES)}, not {mode!r}')
+		self.target = target
+		self.mode = mode
+		self.buffer_size = max(4, target * buffer_factor)
+		self.times = np.empty(0, dtype='datetime64[ms]')
+		self.values = np.empty(0, dtype='float64')
+		self.added = 0
+
+	def add(self, times, values):
+		# Add a page of points. Results that are not numbers are skipped,
+		# as they cannot be drawn on a line chart.
+		times = np.asarray(times, dtype='datetime64[ms]')
+		values = np.asarray(values, dtype='float64')
+		numeric = ~np.isnan(values)
+		self.times = np.concatenate((self.times, times[numeric]))
+		self.values = np.concatenate((self.values, values[numeric]))
+		self.added += np.count_nonzero(numeric)
+
+		# "minmax" of the kept points keeps the extreme values of every
+		# part of the series, so they are still there for 'series()'.
+		if len(self.values) > self.buffer_size:
+			keep = minmax(self.times, self.values, self.buffer_size // 2)
+			self.times = self.times[keep]
+			self.values = self.values[keep]
+
+	def add_entities(self, entities):
+		# Add a page of Observation entities, as in the 'value' list of a
+		# response.
+		results = [entity['result'] for entity in entities]
+		self.add(
+			parse_times([entity['phenomenonTime'] for entity in entities]),
+			[result if isinstance(result, (int, float)) and not isinstance(result, bool) else math.nan for result in results]
+		)
+
+	def series(self):
+		# Return the reduced (times, values) arrays.
+		if len(self.values) == 0:
+			return self.times, self.values
+		keep = MODES[self.mode](self.times, self.values, self.target)
+		return self.times[keep], self.values[keep]
+
+	def data(self):
+		# Return the reduced series as '(phenomenonTime, result)' tuples,
+		# like the 'data' list in #03.
+		times, values = self.series()
+		return list(zip(format_times(times), values.tolist()))
+
+
+more_results = True
+download_url = f'{DATASTREAM_URL}/Observations'
+params = [
+	('$orderby', 'phenomenonTime asc'),
+	('$select', 'phenomenonTime,result')
+]
+downsampler = Downsampler()
+downloaded = 0
+total_downloaded_bytes = 0
+
+session = requests.Session()
+
+while(more_results and downloaded < OBSERVATION_LIMIT):
+	response = session.get(download_url, params=params)
+	response.raise_for_status()
+	total_downloaded_bytes += len(response.content)
+	observation_entities = response.json()
+	entities = observation_entities['value']
+	downsampler.add_entities(entities)
+	downloaded += len(entities)
+
+	# The chart can be updated now, without waiting for the rest.
+	times, values = downsampler.series()
+	print(f'Downloaded {len(entities)} entities, chart has {len(times)} points: {download_url}')
+
+	# If the '@iot.nextLink' key is in the response, there is more data
+	# on the server. Otherwise, we are at the end of the collection.
+	more_results = ('@iot.nextLink' in observation_entities)
+	download_url = observation_entities.get('@iot.nextLink')
+	# The nextLink already includes our query options.
+	params = None
+
+data = downsampler.data()
+
+print(f'Downloaded {downloaded} Observations in total, {math.ceil(total_downloaded_bytes / 1000)} kilobytes.')
+print(f'Reduced {downsampler.added} numeric Observations to {len(data)} points with "{downsampler.mode}".')
+
+# Print out the first few points for the chart
+for phenomenon_time, result in data[:5]:
+	print(f'{phenomenon_time}, {result}')
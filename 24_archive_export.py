@@ -0,0 +1,360 @@
+# This archives every Observation of every Datastream found by a search
+# like #08 (an Observed Property and a polygon) into Parquet files, one
+# for each Datastream and month:
+#
+#   archive/datastream=46/month=2020-09/part-0.parquet
+#
+# Parquet stores each attribute as a compressed column, so the files
+# are much smaller than JSON and can be read straight into Pandas,
+# Polars, DuckDB or Spark. The folder names ("key=value") are understood
+# by those as columns too.
+#
+# The work is split in two:
+#
+# * Threads download the months, several at the same time. The pages of
+#   one month are requested one after another with '$skip'/'$top'
+#   windows worked out from '$count', as in #09. If the server sends
+#   fewer Observations in the first page than asked for, its maximum page
+#   size is smaller than ours, and the rest of the windows use that size.
+# * A pool of processes decodes the JSON and converts each page into an
+#   Arrow "record batch". Decoding JSON uses a lot of CPU, and separate
+#   processes can do it on every core at once, which threads cannot.
+#
+# Pages that have been downloaded but not yet written use memory, so at
+# most IN_FLIGHT_BATCHES of them are allowed at once. A download waits
+# for a free slot before it starts.
+#
+# A multi-hour export may be stopped part way through. Each month is
+# written to a temporary file that is only renamed when it has as many
+# Observations as '$count' said, and then recorded in a "checkpoint"
+# file. Running the export again
+# skips the months in the checkpoint and continues from there. The
+# current month is not finished yet, so it is not recorded, and is
+# downloaded again on the next run.
+#
+# Requires PyArrow: https://arrow.apache.org/docs/python/
+# (and NumPy, which PyArrow uses)
+import requests
+import json
+import math
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# Observed Property and polygon selected in #08.
+OBSERVED_PROPERTY_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/ObservedProperties(1)"
+FILTER_GEOM = "POLYGON ((-106 68, -106 70, -105 70, -105 68, -106 68))"
+
+# Folder for the Parquet files and the checkpoint. Readers of Parquet
+# folders skip names starting with "_" or ".", so the checkpoint and
+# unfinished files are not mistaken for data.
+OUTPUT_DIR = "archive"
+CHECKPOINT_FILE = "_checkpoint.json"
+# Number of Observations to ask for in each page.
+PAGE_SIZE = 1000
+# Number of pages being downloaded at the same time.
+DOWNLOAD_THREADS = 4
+# Number of processes decoding pages. None uses one for each CPU.
+DECODE_PROCESSES = None
+# Most pages downloaded but not yet written to a file, which limits the
+# memory used.
+IN_FLIGHT_BATCHES = 16
+
+# Columns of the Parquet files. Results that are not numbers (see the
+# "observationType" notes in #03) are kept as JSON text in
+# 'result_json', with 'result' left empty.
+SCHEMA = pa.schema([
+	('phenomenon_time', pa.timestamp('ms', tz='UTC')),
+	('result', pa.float64()),
+	('result_json', pa.string())
+])
+
+
+def format_time(moment):
+	return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def parse_time(timestamp):
+	# 'phenomenonTime' can be an interval "start/end"; use the start.
+	return datetime.strptime(timestamp.split('/')[0].replace('Z', '+00:00'), '%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+def next_month(moment):
+	if moment.month == 12:
+		return moment.replace(year=moment.year + 1, month=1)
+	return moment.replace(month=moment.month + 1)
+
+
+def plan_months(first, last):
+	# Return the (start, end) of every month from the one containing
+	# 'first' to the one containing 'last'.
+	months = []
+	start = first.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+	while start <= last:
+		end = next_month(start)
+		months.append((start, end))
+		start = end
+	return months
+
+
+def decode_page(body):
+	# Runs in a decoding process: convert the JSON body of one page into
+	# an Arrow record batch.
+	entities = json.loads(body)['value']
+	times = np.array(
+		[entity['phenomenonTime'].split('/')[0].rstrip('Z') for entity in entities],
+		dtype='datetime64[ms]'
+	)
+	results = [entity['result'] for entity in entities]
+	numeric = [isinstance(result, (int, float)) and not isinstance(result, bool) for result in results]
+	return pa.record_batch([
+		pa.array(times, type=pa.timestamp('ms', tz='UTC')),
+		pa.array([result if is_number else None for result, is_number in zip(results, numeric)], type=pa.float64()),
+		pa.array([None if is_number else json.dumps(result) for result, is_number in zip(results, numeric)], type=pa.string())
+	], schema=SCHEMA)
+
+
+def get_datastreams(session):
+	# The same query as #08, following '@iot.nextLink' in case there are
+	# more Datastreams than fit in one page.
+	datastreams = []
+	download_url = f'{OBSERVED_PROPERTY_URL}/Datastreams'
+	params = [
+		('$filter', f"geo.intersects(observedArea, geography'{FILTER_GEOM}')"),
+		('$select', 'id,name,phenomenonTime')
+	]
+
+	while download_url is not None:
+		response = session.get(download_url, params=params)
+		response.raise_for_status()
+		datastream_entities = response.json()
+		datastreams += datastream_entities['value']
+		download_url = datastream_entities.get('@iot.nextLink')
+		# The nextLink already includes our query options.
+		params = None
+
+	return datastreams
+
+
+class Checkpoint:
+	# The months already written for each Datastream, saved in a JSON file
+	# after every month.
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.done = {}
+		if os.path.exists(path):
+			with open(path) as file:
+				self.done = {key: set(months) for key, months in json.load(file).items()}
+
+	def contains(self, datastream_id, month):
+		with self.lock:
+			return month in self.done.get(str(datastream_id), ())
+
+	def add(self, datastream_id, month):
+		with self.lock:
+			self.done.setdefault(str(datastream_id), set()).add(month)
+			# Write a new file and then replace the old one, so a crash
+			# cannot leave half a checkpoint.
+			with open(self.path + '.tmp', 'w') as file:
+				json.dump({key: sorted(months) for key, months in self.done.items()}, file, indent=1)
+			os.replace(self.path + '.tmp', self.path)
+
+
+class ArchiveExporter:
+
+	def __init__(self, session, output_dir=OUTPUT_DIR, page_size=PAGE_SIZE, in_flight_batches=IN_FLIGHT_BATCHES):
+		self.session = session
+		self.output_dir = output_dir
+		self.page_size = page_size
+		self.in_flight = threading.Semaphore(in_flight_batches)
+		os.makedirs(output_dir, exist_ok=True)
+		self.checkpoint = Checkpoint(os.path.join(output_dir, CHECKPOINT_FILE))
+		self.decoders = None
+		self.lock = threading.Lock()
+		self.rows = 0
+		self.partitions = 0
+		self.skipped = 0
+		self.downloaded_bytes = 0
+
+	def time_range(self, datastream):
+		# First and last 'phenomenonTime' of a Datastream. FROST fills in
+		# the Datastream's 'phenomenonTime' from its Observations, but other
+		# servers may not, so then the first and last Observations are
+		# downloaded.
+		if datastream.get('phenomenonTime'):
+			first, last = datastream['phenomenonTime'].split('/')
+			return parse_time(first), parse_time(last)
+
+		times = []
+		for order in ('asc', 'desc'):
+			response = self.session.get(
+				f'{STA_URL}/Datastreams({datastream["@iot.id"]})/Observations',
+				params=[
+					('$orderby', f'phenomenonTime {order}'),
+					('$select', 'phenomenonTime'),
+					('$top', 1)
+				]
+			)
+			response.raise_for_status()
+			observations = response.json()['value']
+			if len(observations) == 0:
+				return None
+			times.append(parse_time(observations[0]['phenomenonTime']))
+		return times[0], times[1]
+
+	def count(self, observations_url, time_filter):
+		# '$top=0' returns no Observations, only '@iot.count'.
+		response = self.session.get(
+			observations_url,
+			params=[('$filter', time_filter), ('$count', 'true'), ('$top', 0)]
+		)
+		response.raise_for_status()
+		return response.json()['@iot.count']
+
+	def write(self, future, writer, path):
+		# Wait for a page to be decoded, and add it to the month's file.
+		# Returns the writer and the number of Observations written.
+		try:
+			batch = future.result()
+		finally:
+			self.in_flight.release()
+		if writer is None:
+			writer = pq.ParquetWriter(path, SCHEMA, compression='zstd')
+		writer.write_batch(batch)
+		return writer, batch.num_rows
+
+	def export_month(self, datastream_id, start, end, now):
+		month = start.strftime('%Y-%m')
+		if self.checkpoint.contains(datastream_id, month):
+			with self.lock:
+				self.skipped += 1
+			return
+
+		observations_url = f'{STA_URL}/Datastreams({datastream_id})/Observations'
+		time_filter = f'phenomenonTime ge {format_time(start)} and phenomenonTime lt {format_time(end)}'
+		total = self.count(observations_url, time_filter)
+
+		folder = os.path.join(self.output_dir, f'datastream={datastream_id}', f'month={month}')
+		path = os.path.join(folder, 'part-0.parquet')
+		temporary_path = os.path.join(folder, '.part-0.parquet.tmp')
+		os.makedirs(folder, exist_ok=True)
+
+		# Pages sent to the decoding processes, in order. They are written
+		# in the same order, so each file is sorted by time.
+		pending = deque()
+		writer = None
+		rows = 0
+		page_size = self.page_size
+		try:
+			skip = 0
+			while skip < total:
+				# If there is no free slot, write our own oldest page to make
+				# one, instead of waiting for other threads.
+				while pending and not self.in_flight.acquire(blocking=False):
+					writer, written = self.write(pending.popleft(), writer, temporary_path)
+					rows += written
+				if not pending:
+					self.in_flight.acquire()
+				try:
+					response = self.session.get(
+						observations_url,
+						params=[
+							('$filter', time_filter),
+							('$orderby', 'phenomenonTime asc'),
+							('$select', 'phenomenonTime,result'),
+							('$count', 'false'),
+							('$skip', skip),
+							('$top', min(page_size, total - skip))
+						]
+					)
+					response.raise_for_status()
+				except Exception:
+					self.in_flight.release()
+					raise
+				with self.lock:
+					self.downloaded_bytes += len(response.content)
+				pending.append(self.decoders.submit(decode_page, response.content))
+
+				if skip == 0:
+					# As in #09: a short first page means the server's maximum
+					# page size is smaller than ours.
+					first_page_size = pending[-1].result().num_rows
+					if first_page_size == 0:
+						break
+					page_size = min(page_size, first_page_size)
+				skip += page_size
+
+			while pending:
+				writer, written = self.write(pending.popleft(), writer, temporary_path)
+				rows += written
+		finally:
+			# After an error, give back the slots of pages not written.
+			for future in pending:
+				future.cancel()
+				self.in_flight.release()
+			if writer is not None:
+				writer.close()
+
+		if rows != total:
+			# Observations were missed (or added or deleted while
+			# downloading), so the month is not finished. It is downloaded
+			# again on the next run.
+			if writer is not None:
+				os.remove(temporary_path)
+			print(f'Expected {total} Observations but got {rows}, not saving: {path}')
+			return
+
+		with self.lock:
+			self.rows += rows
+		if writer is not None:
+			os.replace(temporary_path, path)
+			print(f'Wrote {total} Observations: {path}')
+			with self.lock:
+				self.partitions += 1
+		# The current month will have more Observations later.
+		if end <= now:
+			self.checkpoint.add(datastream_id, month)
+
+	def run(self, datastreams, download_threads=DOWNLOAD_THREADS, decode_processes=DECODE_PROCESSES):
+		now = datetime.now(timezone.utc)
+		months = []
+		for datastream in datastreams:
+			time_range = self.time_range(datastream)
+			if time_range is not None:
+				months += [(datastream['@iot.id'], start, end) for start, end in plan_months(*time_range)]
+		print(f'Exporting {len(months)} months of {len(datastreams)} Datastreams')
+
+		with ProcessPoolExecutor(max_workers=decode_processes) as self.decoders:
+			with ThreadPoolExecutor(max_workers=download_threads) as downloads:
+				futures = [downloads.submit(self.export_month, datastream_id, start, end, now) for datastream_id, start, end in months]
+				for future in futures:
+					# Raises the first error, if any.
+					future.result()
+
+
+# The decoding processes load this file again on some systems (Windows
+# and macOS), so the export must only start in the main process.
+if __name__ == '__main__':
+	# As in #09, the session keeps connections open between requests. The
+	# pool is sized to the number of download threads.
+	session = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=DOWNLOAD_THREADS)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+
+	datastreams = get_datastreams(session)
+	print(f'Found {len(datastreams)} Datastreams')
+
+	exporter = ArchiveExporter(session)
+	exporter.run(datastreams)
+
+	print(f'Wrote {exporter.rows} Observations in {exporter.partitions} months, skipped {exporter.skipped} months already in the checkpoint, downloaded {math.ceil(exporter.downloaded_bytes / 1000)} kilobytes.')
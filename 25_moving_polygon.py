@@ -0,0 +1,303 @@
+# For a moving sensor (see #05 and #18), get only the Observations that
+# happened inside a polygon.
+#
+# A ship's track may cross the region we care about for a few hours out
+# of years of data. Downloading the whole history with every Feature of
+# Interest and then testing each one would mostly download data we throw
+# away. Instead this works in three steps:
+#
+# 1. The Datastream's 'observedArea' covers every Feature of Interest it
+#    has ever had (see #08). If it does not reach the polygon, no
+#    Observation can be inside, and nothing more is downloaded.
+#
+# 2. The history is split into time windows, and the position at the
+#    edge of each window is downloaded (one Observation each). A sensor
+#    can only move so fast, so if both edges of a window are too far
+#    from the polygon to get there and back within the window, the whole
+#    window is skipped.
+#
+# 3. The remaining windows are downloaded. If the server can filter on
+#    the Feature of Interest:
+#
+#      geo.intersects(FeatureOfInterest/feature, geography'POLYGON (...)')
+#
+#    then it only sends the Observations inside. Not every server
+#    supports that, so one quick query is tried first. If it fails, the
+#    Observations are downloaded with their Feature of Interest, and
+#    each page is tested against the polygon with NumPy as it arrives.
+#    Either way, Observations exactly on the edge of the polygon are
+#    included.
+#
+# The result is a trajectory of NumPy arrays, like in #18.
+#
+# Requires NumPy: https://numpy.org
+import requests
+import json
+import math
+import re
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# Direct link to Datastream entity. See the note in #05 about moving
+# Datastreams.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Region of interest, with longitude first as in #08. Holes (more rings)
+# are allowed.
+FILTER_GEOM = "POLYGON ((-106 68, -106 70, -105 70, -105 68, -106 68))"
+# The fastest the sensor can move, in kilometres per hour, for skipping
+# windows. A ship is rarely faster than 60 km/h. Use None to not skip
+# any windows.
+MAX_SPEED = 60
+# Number of time windows to split the history into.
+WINDOWS = 32
+# Number of Observations to ask for in each page.
+PAGE_SIZE = 1000
+
+# Kilometres in one degree of latitude, and of longitude at the equator.
+KM_PER_DEGREE = 111.2
+
+
+def format_time(moment):
+	return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def parse_time(timestamp):
+	# 'phenomenonTime' can be an interval "start/end"; use the start.
+	return datetime.strptime(timestamp.split('/')[0].replace('Z', '+00:00'), '%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+def parse_polygon(wkt):
+	# Return the rings of a WKT POLYGON as a list of (n, 2) arrays.
+	match = re.fullmatch(r'\s*POLYGON\s*\((.*)\)\s*', wkt, re.IGNORECASE)
+	if match is None:
+		raise ValueError(f'Only WKT POLYGON is supported, not {wkt!r}')
+	return [
+		np.array([[float(number) for number in point.split()] for point in ring.split(',')])
+		for ring in re.findall(r'\(([^()]*)\)', match.group(1))
+	]
+
+
+def feature_points(feature):
+	# Return (lon, lat) for a GeoJSON feature, using the first coordinate
+	# of anything that is not a Point, as in #18.
+	coordinates = feature['coordinates']
+	while isinstance(coordinates[0], list):
+		coordinates = coordinates[0]
+	return coordinates[0], coordinates[1]
+
+
+def geometry_bounds(geometry):
+	# Return (west, south, east, north) of a GeoJSON geometry.
+	coordinates = np.array(flatten_coordinates(geometry['coordinates'])).reshape(-1, 2)
+	return (*coordinates.min(axis=0), *coordinates.max(axis=0))
+
+
+def flatten_coordinates(coordinates):
+	if not isinstance(coordinates[0], list):
+		return coordinates[:2]
+	return [number for part in coordinates for number in flatten_coordinates(part)]
+
+
+def points_in_polygon(lons, lats, rings):
+	# Return a boolean array, True for each point inside the polygon.
+	#
+	# This is the "ray casting" test: a point is inside if a line from it
+	# going east crosses the edges an odd number of times. Each edge is
+	# tested against every point at once. Edges of holes count the same
+	# way, so points in a hole are outside. Points on an edge (of the
+	# outside or of a hole) count as inside, like 'geo.intersects', as in
+	# #17.
+	inside = np.zeros(len(lons), dtype=bool)
+	outer = rings[0]
+	# Points outside the bounding box cannot be inside.
+	candidates = np.flatnonzero(
+		(lons >= outer[:, 0].min()) & (lons <= outer[:, 0].max()) &
+		(lats >= outer[:, 1].min()) & (lats <= outer[:, 1].max())
+	)
+	x, y = lons[candidates], lats[candidates]
+	crossings = np.zeros(len(candidates), dtype=bool)
+	on_edge = np.zeros(len(candidates), dtype=bool)
+	for ring in rings:
+		for (x1, y1), (x2, y2) in zip(ring, np.roll(ring, -1, axis=0)):
+			on_edge |= (
+				((x2 - x1) * (y - y1) == (y2 - y1) * (x - x1)) &
+				(x >= min(x1, x2)) & (x <= max(x1, x2)) &
+				(y >= min(y1, y2)) & (y <= max(y1, y2))
+			)
+			if y1 == y2:
+				continue
+			crosses = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+			crossings ^= crosses
+	inside[candidates] = crossings | on_edge
+	return inside
+
+
+def distance_to_bounds(lon, lat, bounds):
+	# Kilometres from a point to the nearest part of a bounding box, or 0
+	# if it is inside. Close enough for deciding which windows to skip.
+	west, south, east, north = bounds
+	dx = (lon - min(max(lon, west), east)) * KM_PER_DEGREE * math.cos(math.radians(lat))
+	dy = (lat - min(max(lat, south), north)) * KM_PER_DEGREE
+	return math.hypot(dx, dy)
+
+
+class PolygonQuery:
+
+	def __init__(self, session, datastream_url=DATASTREAM_URL, polygon=FILTER_GEOM):
+		self.session = session
+		self.observations_url = f'{datastream_url}/Observations'
+		self.datastream_url = datastream_url
+		self.polygon = polygon
+		self.rings = parse_polygon(polygon)
+		self.bounds = (*self.rings[0].min(axis=0), *self.rings[0].max(axis=0))
+		self.geo_filter = f"geo.intersects(FeatureOfInterest/feature, geography'{polygon}')"
+		self.requests = 0
+		self.downloaded = 0
+		self.downloaded_bytes = 0
+
+	def get(self, url, params):
+		self.requests += 1
+		response = self.session.get(url, params=params)
+		self.downloaded_bytes += len(response.content)
+		return response
+
+	def server_filters(self):
+		# Try the Feature of Interest filter on one Observation. A server
+		# that does not support it answers with an error.
+		response = self.get(self.observations_url, [
+			('$filter', self.geo_filter),
+			('$select', 'phenomenonTime'),
+			('$count', 'false'),
+			('$top', 1)
+		])
+		return response.ok
+
+	def reaches_polygon(self, datastream):
+		# Step 1: does the 'observedArea' overlap the polygon's bounding box?
+		observed_area = datastream.get('observedArea')
+		if observed_area is None:
+			return True
+		west, south, east, north = geometry_bounds(observed_area)
+		return not (east < self.bounds[0] or west > self.bounds[2] or north < self.bounds[1] or south > self.bounds[3])
+
+	def position_after(self, moment):
+		# The first Observation at or after a time, with its position, or
+		# None if there are none.
+		response = self.get(self.observations_url, [
+			('$filter', f'phenomenonTime ge {format_time(moment)}'),
+			('$orderby', 'phenomenonTime asc'),
+			('$select', 'phenomenonTime'),
+			('$expand', 'FeatureOfInterest($select=feature)'),
+			('$count', 'false'),
+			('$top', 1)
+		])
+		response.raise_for_status()
+		observations = response.json()['value']
+		if len(observations) == 0:
+			return None
+		lon, lat = feature_points(observations[0]['FeatureOfInterest']['feature'])
+		return parse_time(observations[0]['phenomenonTime']), lon, lat
+
+	def plan_windows(self, datastream, windows=WINDOWS, max_speed=MAX_SPEED):
+		# Step 2: return the (start, end) time windows that may have
+		# Observations in the polygon, with neighbouring windows joined.
+		first, last = (parse_time(time) for time in datastream['phenomenonTime'].split('/'))
+		# The end is exclusive, so move it just past the last Observation.
+		last += timedelta(milliseconds=1)
+		step = (last - first) / windows
+		edges = [first + step * i for i in range(windows)] + [last]
+		if max_speed is None:
+			return [(first, last)]
+
+		positions = [self.position_after(edge) for edge in edges[:-1]] + [None]
+		kept = []
+		for start, end, position, next_position in zip(edges, edges[1:], positions, positions[1:]):
+			if position is None or position[0] >= end:
+				# No Observations in this window.
+				continue
+			if next_position is not None:
+				# Every Observation in the window is between these two, in
+				# time and along the track.
+				hours = (next_position[0] - position[0]).total_seconds() / 3600
+				distance = distance_to_bounds(position[1], position[2], self.bounds) + distance_to_bounds(next_position[1], next_position[2], self.bounds)
+				if distance > max_speed * hours:
+					continue
+			if kept and kept[-1][1] == start:
+				kept[-1] = (kept[-1][0], end)
+			else:
+				kept.append((start, end))
+		return kept
+
+	def pages(self, start, end, push_down):
+		# Download the Observations in a window, page by page.
+		time_filter = f'phenomenonTime ge {format_time(start)} and phenomenonTime lt {format_time(end)}'
+		download_url = self.observations_url
+		params = [
+			('$filter', f'{time_filter} and {self.geo_filter}' if push_down else time_filter),
+			('$orderby', 'phenomenonTime asc'),
+			('$select', 'phenomenonTime,result'),
+			('$expand', 'FeatureOfInterest($select=feature)'),
+			('$top', PAGE_SIZE)
+		]
+		while download_url is not None:
+			response = self.get(download_url, params)
+			response.raise_for_status()
+			observation_entities = response.json()
+			entities = observation_entities['value']
+			self.downloaded += len(entities)
+			print(f'Downloaded {len(entities)} entities: {download_url}')
+			yield entities
+			download_url = observation_entities.get('@iot.nextLink')
+			# The nextLink already includes our query options.
+			params = None
+
+	def trajectory(self):
+		# Return the (times, lons, lats, results) arrays of the
+		# Observations inside the polygon, sorted by time.
+		response = self.get(self.datastream_url, [('$select', 'observedArea,phenomenonTime')])
+		response.raise_for_status()
+		datastream = response.json()
+
+		columns = [[], [], [], []]
+		if datastream.get('phenomenonTime') is None or not self.reaches_polygon(datastream):
+			print('The Datastream never reaches the polygon')
+			windows = []
+		else:
+			windows = self.plan_windows(datastream)
+			print(f'Downloading {len(windows)} time ranges')
+
+		push_down = len(windows) > 0 and self.server_filters()
+		if windows:
+			print('Filtering on the server' if push_down else 'The server cannot filter on FeatureOfInterest, filtering here')
+
+		for start, end in windows:
+			for entities in self.pages(start, end, push_down):
+				points = [feature_points(entity['FeatureOfInterest']['feature']) for entity in entities]
+				lons = np.array([point[0] for point in points], dtype='float64')
+				lats = np.array([point[1] for point in points], dtype='float64')
+				# Test the points on this page straight away, so only the
+				# Observations inside are kept.
+				if push_down:
+					inside = np.ones(len(entities), dtype=bool)
+				else:
+					inside = points_in_polygon(lons, lats, self.rings)
+				columns[0].append(np.array([entity['phenomenonTime'].split('/')[0].rstrip('Z') for entity in entities], dtype='datetime64[ms]')[inside])
+				columns[1].append(lons[inside])
+				columns[2].append(lats[inside])
+				# As in #14, results that are not numbers (including true and
+				# false) are stored as NaN.
+				columns[3].append(np.array([entity['result'] if isinstance(entity['result'], (int, float)) and not isinstance(entity['result'], bool) else math.nan for entity in entities], dtype='float64')[inside])
+
+		empty = [np.empty(0, dtype='datetime64[ms]')] + [np.empty(0, dtype='float64')] * 3
+		return tuple(np.concatenate([first] + column) for first, column in zip(empty, columns))
+
+
+session = requests.Session()
+query = PolygonQuery(session)
+times, lons, lats, results = query.trajectory()
+
+print(f'Found {len(times)} Observations in the polygon, downloaded {query.downloaded} Observations in {query.requests} requests, {math.ceil(query.downloaded_bytes / 1000)} kilobytes.')
+
+# Print out the first few points of the trajectory
+for timestamp, lon, lat, result in list(zip(times, lons, lats, results))[:5]:
+	print(f"{timestamp}, {result}, {lat} N, {lon} E")
@@ -0,0 +1,299 @@
+# Examples #03 and #05 hard-code the unit ("˚C") because the Datastream
+# metadata "can be cached", and #01, #02 and #08 download the Things,
+# Datastreams and Observed Properties every time they run. A short job
+# that only wants one Datastream's Observations still has to repeat all
+# of that searching first.
+#
+# This keeps a "catalog" of all the metadata entities in one local file:
+# Things, Locations, Datastreams, Observed Properties and Sensors, and
+# which of them are linked to each other. The file is an SQLite
+# database (as in #12) with indexes for the usual lookups, such as an
+# Observed Property by name or definition, or the Datastreams of a
+# Thing. Starting a job is then opening one file, instead of dozens of
+# requests. SQLite reads the file with "mmap", so lookups read straight
+# from the operating system's file cache.
+#
+# While a job runs, a background thread keeps the catalog up to date:
+#
+# * Every REFRESH_INTERVAL it downloads only the entities with a higher
+#   '@iot.id' than the catalog has, which is usually an empty page.
+# * Once the catalog is older than REBUILD_AGE, everything is
+#   downloaded again, which picks up edited and deleted entities too.
+#
+# The catalog is replaced in one transaction, so lookups never see a
+# half-finished update.
+#
+# SQLite is included with Python, so nothing extra needs installing.
+import requests
+import json
+import sqlite3
+import threading
+import time
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# Local catalog file, created if it does not exist.
+CATALOG_FILE = "catalog.sqlite"
+# Seconds between checks for new entities.
+REFRESH_INTERVAL = 60
+# Seconds after which the whole catalog is downloaded again.
+REBUILD_AGE = 24 * 60 * 60
+# Bytes of the file that SQLite may read with "mmap".
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Each collection in the catalog, and the related entities to keep the
+# IDs of (with the collection they are in). Only the IDs are expanded,
+# so the responses stay small.
+COLLECTIONS = {
+	'Things': {'Locations': 'Locations'},
+	'Locations': {},
+	'Datastreams': {'Thing': 'Things', 'ObservedProperty': 'ObservedProperties', 'Sensor': 'Sensors'},
+	'ObservedProperties': {},
+	'Sensors': {}
+}
+
+SCHEMA = '''
+	CREATE TABLE IF NOT EXISTS entities (
+		collection TEXT NOT NULL,
+		id NOT NULL,
+		name TEXT,
+		definition TEXT,
+		body TEXT NOT NULL,
+		PRIMARY KEY (collection, id)
+	) WITHOUT ROWID;
+	CREATE INDEX IF NOT EXISTS entities_name ON entities (collection, name);
+	CREATE INDEX IF NOT EXISTS entities_definition ON entities (collection, definition);
+	CREATE TABLE IF NOT EXISTS links (
+		collection TEXT NOT NULL,
+		id NOT NULL,
+		relation TEXT NOT NULL,
+		related_id NOT NULL,
+		PRIMARY KEY (collection, id, relation, related_id)
+	) WITHOUT ROWID;
+	CREATE INDEX IF NOT EXISTS links_related ON links (relation, related_id, collection);
+	CREATE TABLE IF NOT EXISTS info (
+		key TEXT PRIMARY KEY,
+		value
+	);
+'''
+
+
+def format_id(entity_id):
+	# IDs can be numbers or strings, depending on the server. Strings
+	# must be single-quoted in '$filter'.
+	if isinstance(entity_id, str):
+		return "'" + entity_id.replace("'", "''") + "'"
+	return str(entity_id)
+
+
+def compact(entity, relations):
+	# Drop the links that can be made from the ID, and the expanded
+	# relations, which are kept in the 'links' table instead.
+	return {
+		key: value for key, value in entity.items()
+		if key not in relations and not key.endswith('@iot.navigationLink') and key != '@iot.selfLink'
+	}
+
+
+def related_ids(entity, relation):
+	related = entity.get(relation)
+	if related is None:
+		return []
+	if isinstance(related, dict):
+		return [related['@iot.id']]
+	return [item['@iot.id'] for item in related]
+
+
+class Catalog:
+
+	def __init__(self, path=CATALOG_FILE, session=None):
+		self.path = path
+		self.session = session or requests.Session()
+		self.db = self.connect()
+		self.db.executescript(SCHEMA)
+		self.requests = 0
+		self.stopping = threading.Event()
+		self.thread = None
+
+	def connect(self):
+		# Each thread needs its own connection. "WAL" lets lookups keep
+		# reading while the background thread writes.
+		db = sqlite3.connect(self.path, timeout=30)
+		db.execute('PRAGMA journal_mode = WAL')
+		db.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+		return db
+
+	def info(self, key, db=None):
+		row = (db or self.db).execute('SELECT value FROM info WHERE key = ?', (key,)).fetchone()
+		return row[0] if row else None
+
+	# Downloading
+
+	def download(self, collection, since_id=None):
+		# Download every entity in a collection, or only the ones with a
+		# higher ID than 'since_id', following '@iot.nextLink'.
+		relations = COLLECTIONS[collection]
+		params = [('$orderby', 'id asc')]
+		if relations:
+			params.append(('$expand', ','.join(f'{relation}($select=id)' for relation in relations)))
+		if since_id is not None:
+			params.append(('$filter', f'id gt {format_id(since_id)}'))
+
+		entities = []
+		download_url = f'{STA_URL}/{collection}'
+		while download_url is not None:
+			self.requests += 1
+			response = self.session.get(download_url, params=params)
+			response.raise_for_status()
+			collection_entities = response.json()
+			entities += collection_entities['value']
+			download_url = collection_entities.get('@iot.nextLink')
+			# The nextLink already includes our query options.
+			params = None
+		return entities
+
+	def store(self, db, collection, entities):
+		relations = COLLECTIONS[collection]
+		db.executemany(
+			'INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?)',
+			[(
+				collection,
+				entity['@iot.id'],
+				entity.get('name'),
+				entity.get('definition'),
+				json.dumps(compact(entity, relations), separators=(',', ':'))
+			) for entity in entities]
+		)
+		db.executemany(
+			'INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)',
+			[
+				(collection, entity['@iot.id'], relation, related_id)
+				for entity in entities
+				for relation in relations
+				for related_id in related_ids(entity, relation)
+			]
+		)
+
+	def rebuild(self, db=None):
+		# Download everything, and replace the whole catalog at once.
+		db = db or self.db
+		downloaded = {collection: self.download(collection) for collection in COLLECTIONS}
+		now = time.time()
+		with db:
+			db.execute('DELETE FROM entities')
+			db.execute('DELETE FROM links')
+			for collection, entities in downloaded.items():
+				self.store(db, collection, entities)
+			db.execute("INSERT OR REPLACE INTO info VALUES ('built_at', ?)", (now,))
+			db.execute("INSERT OR REPLACE INTO info VALUES ('refreshed_at', ?)", (now,))
+		print(f'Catalog built with {sum(len(entities) for entities in downloaded.values())} entities')
+
+	def refresh(self, db=None):
+		# Add the entities created since the last refresh. Returns the
+		# number added.
+		db = db or self.db
+		built_at = self.info('built_at', db)
+		if built_at is None or time.time() - built_at > REBUILD_AGE:
+			self.rebuild(db)
+			return None
+
+		added = 0
+		for collection in COLLECTIONS:
+			row = db.execute('SELECT max(id) FROM entities WHERE collection = ?', (collection,)).fetchone()
+			entities = self.download(collection, since_id=row[0])
+			if entities:
+				with db:
+					self.store(db, collection, entities)
+				added += len(entities)
+		with db:
+			db.execute("INSERT OR REPLACE INTO info VALUES ('refreshed_at', ?)", (time.time(),))
+		return added
+
+	def open(self):
+		# Make sure there is a catalog to use, then keep it up to date in
+		# the background. Only the first run has to wait for downloads.
+		if self.info('built_at') is None:
+			self.rebuild()
+		self.thread = threading.Thread(target=self.run_refresh, daemon=True)
+		self.thread.start()
+		return self
+
+	def run_refresh(self):
+		db = self.connect()
+		try:
+			while not self.stopping.wait(REFRESH_INTERVAL):
+				try:
+					added = self.refresh(db)
+					if added:
+						print(f'Catalog refreshed, {added} new entities')
+				except requests.RequestException as error:
+					# Keep using the catalog we have, and try again later.
+					print(f'Catalog refresh failed: {error}')
+		finally:
+			db.close()
+
+	def close(self):
+		self.stopping.set()
+		if self.thread is not None:
+			self.thread.join()
+		self.db.close()
+
+	# Lookups
+
+	def entities(self, sql, params):
+		return [json.loads(body) for (body,) in self.db.execute(sql, params)]
+
+	def get(self, collection, entity_id):
+		found = self.entities('SELECT body FROM entities WHERE collection = ? AND id = ?', (collection, entity_id))
+		return found[0] if found else None
+
+	def find(self, collection, name=None, definition=None):
+		# Entities by name and/or definition, using the indexes.
+		sql = 'SELECT body FROM entities WHERE collection = ?'
+		params = [collection]
+		if name is not None:
+			sql += ' AND name = ?'
+			params.append(name)
+		if definition is not None:
+			sql += ' AND definition = ?'
+			params.append(definition)
+		return self.entities(sql + ' ORDER BY id', params)
+
+	def related(self, collection, entity_id, relation):
+		# Entities linked from an entity, such as the Thing of a Datastream
+		# ('Datastreams', 46, 'Thing') or the Locations of a Thing.
+		return self.entities(
+			'SELECT entities.body FROM links JOIN entities '
+			'ON entities.collection = ? AND entities.id = links.related_id '
+			'WHERE links.collection = ? AND links.id = ? AND links.relation = ? ORDER BY links.related_id',
+			(COLLECTIONS[collection][relation], collection, entity_id, relation)
+		)
+
+	def linked(self, collection, relation, related_id):
+		# Entities that link to an entity, such as the Datastreams of an
+		# Observed Property ('Datastreams', 'ObservedProperty', 1).
+		return self.entities(
+			'SELECT entities.body FROM links JOIN entities '
+			'ON entities.collection = links.collection AND entities.id = links.id '
+			'WHERE links.relation = ? AND links.related_id = ? AND links.collection = ? ORDER BY links.id',
+			(relation, related_id, collection)
+		)
+
+
+started = time.perf_counter()
+catalog = Catalog().open()
+
+# The search in #08, and the unit that #03 and #05 hard-code, without
+# any requests once the catalog has been built.
+for observed_property in catalog.find('ObservedProperties', name='Air Temperature'):
+	datastreams = catalog.linked('Datastreams', 'ObservedProperty', observed_property['@iot.id'])
+	print(f'Observed Property: {observed_property["name"]}, {observed_property["definition"]}, {len(datastreams)} Datastreams')
+	for datastream in datastreams[:5]:
+		thing = catalog.related('Datastreams', datastream['@iot.id'], 'Thing')[0]
+		location = catalog.related('Things', thing['@iot.id'], 'Locations')[0]
+		unit = datastream['unitOfMeasurement']['symbol']
+		print(f'\t{datastream["name"]} ({unit}) at {thing["name"]}, {location["location"]["coordinates"]}')
+
+print(f'Ready in {(time.perf_counter() - started) * 1000:.1f} ms with {catalog.requests} requests.')
+
+catalog.close()
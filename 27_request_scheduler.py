@@ -0,0 +1,281 @@
+# The other examples call 'requests.get' directly: with no timeout, no
+# retries, and no idea of what else is being downloaded. That is fine
+# for one script, but when several harvesters (#10, #19, #24) run in one
+# process they can open more connections than the server can answer,
+# or a map query (#07) can wait behind hundreds of bulk pages (#03).
+#
+# This example makes one "scheduler" that every request goes through,
+# using a 'requests' Session like #16 and #20. The scheduler:
+#
+# * Allows at most HOST_LIMIT requests to each server at the same time.
+#   The others wait in a queue.
+# * Takes requests from the queue by priority class first, so an
+#   INTERACTIVE request (a map waiting for #07's stations) goes before
+#   any waiting BULK request (a #03-style download). Requests already
+#   sent are not interrupted, so it still waits for the first free slot.
+# * Retries "429 Too Many Requests" and "503 Service Unavailable"
+#   responses, and requests that time out or lose their connection. It
+#   waits for as long as the server's "Retry-After" header says, or
+#   otherwise a random time up to a limit that doubles with each retry
+#   ("jittered backoff", so clients that failed together do not all
+#   retry together). While waiting, no new requests are sent to that
+#   server at all, as it has said it is overloaded.
+# * Gives every request a timeout.
+# * Measures, for each priority class, how long requests waited in the
+#   queue and how long the server took to answer ("service time").
+#
+# The measurements show how to set HOST_LIMIT: if requests wait much
+# longer than they take, a higher limit would help, as long as the
+# service time stays the same. If the service time grows when the limit
+# is raised, the server is already as busy as it can be, and the limit
+# should go back down.
+#
+# Each part of a program uses its own session with its own priority,
+# all sharing the one scheduler.
+#
+# Retry-After: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Retry-After
+import requests
+import json
+import heapq
+import itertools
+import math
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Root of SensorThings API Service (exclude trailing slash)
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+
+# Most requests in progress to one server at the same time.
+HOST_LIMIT = 4
+# Seconds to wait for a connection, and for the server to answer.
+TIMEOUT = (5, 60)
+# Retries of a request before giving up and returning the last response
+# (or raising the last error).
+MAX_RETRIES = 5
+# Backoff after the first failure, doubling each time up to the
+# maximum, in seconds.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+# Responses that mean "try again later".
+RETRY_STATUSES = {429, 503}
+
+# Priority classes; lower numbers go first.
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BULK: 'bulk'}
+
+
+def retry_after(response):
+	# Seconds from a "Retry-After" header, which is either a number of
+	# seconds or a date. None if there is no header.
+	value = response.headers.get('Retry-After')
+	if value is None:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+
+class Host:
+	# Queue and counters for one server.
+
+	def __init__(self, limit):
+		self.limit = limit
+		self.active = 0
+		# Waiting requests, as (priority, order) tickets, so the same
+		# priority is first come, first served.
+		self.waiting = []
+		# No requests are started before this time (from 'time.monotonic').
+		self.paused_until = 0
+
+
+class RequestScheduler:
+
+	def __init__(self, host_limit=HOST_LIMIT):
+		self.host_limit = host_limit
+		self.hosts = {}
+		self.condition = threading.Condition()
+		self.order = itertools.count()
+		# Measurements for each priority class: lists of seconds.
+		self.queue_waits = {}
+		self.service_times = {}
+		self.retries = 0
+
+	def host(self, name):
+		if name not in self.hosts:
+			self.hosts[name] = Host(self.host_limit)
+		return self.hosts[name]
+
+	def acquire(self, name, priority):
+		# Wait for a free slot on a server. Returns the seconds waited.
+		start = time.perf_counter()
+		with self.condition:
+			host = self.host(name)
+			ticket = (priority, next(self.order))
+			heapq.heappush(host.waiting, ticket)
+			while True:
+				pause = host.paused_until - time.monotonic()
+				if host.waiting[0] == ticket and host.active < host.limit and pause <= 0:
+					break
+				self.condition.wait(pause if pause > 0 else None)
+			heapq.heappop(host.waiting)
+			host.active += 1
+			# The next request in the queue may be able to start too.
+			self.condition.notify_all()
+		return time.perf_counter() - start
+
+	def release(self, name):
+		with self.condition:
+			self.hosts[name].active -= 1
+			self.condition.notify_all()
+
+	def pause(self, name, seconds):
+		# Do not start any requests to a server for some time.
+		with self.condition:
+			host = self.host(name)
+			host.paused_until = max(host.paused_until, time.monotonic() + seconds)
+			self.retries += 1
+
+	def record(self, priority, queue_wait, service_time):
+		with self.condition:
+			self.queue_waits.setdefault(priority, []).append(queue_wait)
+			self.service_times.setdefault(priority, []).append(service_time)
+
+	def report(self):
+		for priority in sorted(self.service_times):
+			waits = sorted(self.queue_waits[priority])
+			services = sorted(self.service_times[priority])
+			p95 = lambda values: values[min(len(values) - 1, math.ceil(len(values) * 0.95) - 1)]
+			print(
+				f'{PRIORITY_NAMES.get(priority, priority)}: {len(services)} requests, '
+				f'queue wait median {statistics.median(waits) * 1000:.0f} ms (95% {p95(waits) * 1000:.0f} ms), '
+				f'service median {statistics.median(services) * 1000:.0f} ms (95% {p95(services) * 1000:.0f} ms)'
+			)
+		print(f'{self.retries} retries')
+
+
+class ScheduledSession(requests.Session):
+	# A Session that sends every request through a shared scheduler, at
+	# one priority.
+
+	def __init__(self, scheduler, priority=NORMAL, timeout=TIMEOUT, max_retries=MAX_RETRIES):
+		super().__init__()
+		self.scheduler = scheduler
+		self.priority = priority
+		self.timeout = timeout
+		self.max_retries = max_retries
+		# Keep as many connections open as the scheduler allows.
+		adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=scheduler.host_limit)
+		self.mount('http://', adapter)
+		self.mount('https://', adapter)
+
+	def backoff(self, attempt):
+		# "Full jitter": a random time up to the doubled limit.
+		return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+	def send(self, request, **kwargs):
+		if kwargs.get('timeout') is None:
+			kwargs['timeout'] = self.timeout
+		# Redirects are followed below, after the slot is given back. If
+		# 'requests' followed them inside 'super().send', each redirect
+		# would wait for a second slot while holding the first, and with
+		# every slot held that way no request could ever start.
+		allow_redirects = kwargs.pop('allow_redirects', True)
+		host = urlsplit(request.url).netloc
+
+		for attempt in range(self.max_retries + 1):
+			queue_wait = self.scheduler.acquire(host, self.priority)
+			start = time.perf_counter()
+			try:
+				# With 'stream=True' only the headers have been read here, so
+				# the slot is given back before the body is downloaded.
+				response = super().send(request, allow_redirects=False, **kwargs)
+			except (requests.ConnectionError, requests.Timeout):
+				if attempt == self.max_retries:
+					raise
+				self.scheduler.pause(host, self.backoff(attempt))
+				continue
+			finally:
+				self.scheduler.release(host)
+				self.scheduler.record(self.priority, queue_wait, time.perf_counter() - start)
+
+			if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+				break
+			delay = retry_after(response)
+			self.scheduler.pause(host, min(BACKOFF_MAX, delay) if delay is not None else self.backoff(attempt))
+			response.close()
+
+		if allow_redirects and response.is_redirect:
+			# Each redirect is sent with 'send' again, so it queues for a
+			# slot of its own, as 'requests' would otherwise do.
+			history = [response] + list(self.resolve_redirects(response, request, **kwargs))
+			response = history.pop()
+			response.history = history
+		return response
+
+
+def bulk_download(session, datastream_url, pages=10):
+	# Like #03: follow '@iot.nextLink' for some pages of Observations.
+	download_url = f'{datastream_url}/Observations'
+	params = [
+		('$orderby', 'phenomenonTime asc'),
+		('$select', 'phenomenonTime,result')
+	]
+	observations = 0
+	for page in range(pages):
+		response = session.get(download_url, params=params)
+		response.raise_for_status()
+		observation_entities = response.json()
+		observations += len(observation_entities['value'])
+		download_url = observation_entities.get('@iot.nextLink')
+		params = None
+		if download_url is None:
+			break
+	return observations
+
+
+def map_query(session):
+	# Like #07: the stations in a bounding box, for a map.
+	bounds = "POLYGON ((-106 68, -106 70, -105 70, -105 68, -106 68))"
+	response = session.get(
+		f'{STA_URL}/Things',
+		params=[
+			('$filter', f"geo.intersects(Locations/location, geography'{bounds}')"),
+			('$expand', 'Locations($select=location)')
+		]
+	)
+	response.raise_for_status()
+	return len(response.json()['value'])
+
+
+scheduler = RequestScheduler()
+bulk_session = ScheduledSession(scheduler, priority=BULK)
+map_session = ScheduledSession(scheduler, priority=INTERACTIVE)
+
+# Several bulk downloads at once, with map queries arriving while they
+# run. The map queries should not wait behind the bulk pages.
+datastream_urls = [DATASTREAM_URL.replace('(46)', f'({datastream_id})') for datastream_id in range(40, 52)]
+with ThreadPoolExecutor(max_workers=len(datastream_urls) + 1) as executor:
+	downloads = [executor.submit(bulk_download, bulk_session, url) for url in datastream_urls]
+	for query in range(5):
+		time.sleep(0.1)
+		started = time.perf_counter()
+		stations = map_query(map_session)
+		print(f'Map query found {stations} stations in {(time.perf_counter() - started) * 1000:.0f} ms')
+	observations = sum(download.result() for download in downloads)
+
+print(f'Downloaded {observations} Observations from {len(datastream_urls)} Datastreams')
+scheduler.report()
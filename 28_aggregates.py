@@ -0,0 +1,252 @@
+# Most uses of a temperature Datastream need hourly or daily values (the
+# mean, lowest and highest), not every 10-minute Observation. Getting
+# those with #03 means downloading every Observation and adding them up
+# ourselves, again each time someone asks.
+#
+# This returns "rollups": the mean, min, max and number of Observations
+# for each hour or day in an interval.
+#
+# * If the server supports the OData '$apply' option, it is asked to
+#   group and aggregate the Observations itself, so only one row per
+#   hour or day is downloaded:
+#
+#     $apply=filter(...)/compute(hour(phenomenonTime) as hour, ...)
+#       /groupby((year, month, day, hour), aggregate(result with average as mean, ...))
+#
+#   FROST does not support '$apply' (yet), and answers "400 Bad Request".
+# * Otherwise the Observations are downloaded as in #03, and each page is
+#   added into the rollups with NumPy as it arrives, so only the rollups
+#   are kept in memory, not the Observations.
+#
+# The rollups are saved in an SQLite file (as in #12). When a later
+# request overlaps hours or days that were already worked out, only the
+# missing ones at the edges are asked for. Hours and days that have not
+# ended yet are not saved, as more Observations may still arrive.
+#
+# OData '$apply': https://docs.oasis-open.org/odata/odata-data-aggregation-ext/v4.0/odata-data-aggregation-ext-v4.0.html
+#
+# Requires NumPy: https://numpy.org
+import requests
+import json
+import sqlite3
+import numpy as np
+
+# Direct link to Datastream entity.
+DATASTREAM_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0/Datastreams(46)"
+# Local database file, created if it does not exist.
+CACHE_FILE = "aggregates.sqlite"
+
+# Dates for filters must be in ISO8601 format. See #04.
+INTERVAL_START = "2020-01-05T00:00:00.000Z"
+INTERVAL_END = "2020-01-12T00:00:00.000Z"
+
+# Rollup sizes, as NumPy time units.
+BUCKETS = {'hour': 'h', 'day': 'D'}
+# The parts of 'phenomenonTime' that the server groups by for each size.
+GROUP_BY = {'hour': ['year', 'month', 'day', 'hour'], 'day': ['year', 'month', 'day']}
+# Responses that mean the server does not support '$apply'.
+UNSUPPORTED_STATUSES = {400, 501}
+
+
+def to_time(timestamp, unit='ms'):
+	# Convert an ISO8601 string to 'datetime64'. As in #14, the "Z" is
+	# removed, and the start of an interval is used.
+	return np.datetime64(timestamp.split('/')[0].rstrip('Z'), unit)
+
+
+def format_time(moment):
+	return f"{np.datetime_as_string(moment.astype('datetime64[ms]'), unit='ms')}Z"
+
+
+def empty_rollups(length):
+	return {
+		'sum': np.zeros(length),
+		'min': np.full(length, np.inf),
+		'max': np.full(length, -np.inf),
+		'count': np.zeros(length, dtype=np.int64)
+	}
+
+
+class AggregateCache:
+
+	def __init__(self, path, session=None):
+		self.db = sqlite3.connect(path)
+		self.session = session or requests.Session()
+		self.server_apply = None
+		self.requests = 0
+		self.computed = 0
+		self.cached = 0
+		# Empty hours and days are saved too (with a count of 0), so they
+		# are known to be empty.
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS rollups (
+				datastream_url TEXT NOT NULL,
+				size TEXT NOT NULL,
+				start TEXT NOT NULL,
+				mean REAL,
+				min REAL,
+				max REAL,
+				count INTEGER NOT NULL,
+				PRIMARY KEY (datastream_url, size, start)
+			) WITHOUT ROWID;
+		''')
+
+	def get(self, url, params):
+		self.requests += 1
+		return self.session.get(url, params=params)
+
+	def server_rollups(self, datastream_url, size, starts, start, end):
+		# Ask the server to aggregate. Returns the rollups as arrays, or
+		# None if the server does not support '$apply'.
+		parts = GROUP_BY[size]
+		apply = (
+			f'filter(phenomenonTime ge {format_time(start)} and phenomenonTime lt {format_time(end)})'
+			f'/compute({",".join(f"{part}(phenomenonTime) as {part}" for part in parts)})'
+			f'/groupby(({",".join(parts)}),aggregate(result with average as mean,result with min as min,result with max as max,$count as count))'
+		)
+		rollups = empty_rollups(len(starts))
+		download_url = f'{datastream_url}/Observations'
+		params = [('$apply', apply)]
+		while download_url is not None:
+			response = self.get(download_url, params)
+			# A server without '$apply' answers "400 Bad Request" (FROST) or
+			# "501 Not Implemented". Any other error, such as a busy server,
+			# is raised instead of giving up on '$apply' for good.
+			if params is not None and response.status_code in UNSUPPORTED_STATUSES:
+				return None
+			response.raise_for_status()
+			rollup_entities = response.json()
+			rows = rollup_entities['value']
+			if params is not None and rows and 'count' not in rows[0]:
+				# The server ignored '$apply' and sent Observations.
+				return None
+
+			for row in rows:
+				moment = np.datetime64(f"{row['year']:04}-{row['month']:02}-{row['day']:02}" + (f"T{row['hour']:02}" if size == 'hour' else ''), BUCKETS[size])
+				index = np.searchsorted(starts, moment)
+				# 'mean' is null when none of the results are numbers.
+				if index >= len(starts) or starts[index] != moment or row['mean'] is None:
+					continue
+				rollups['count'][index] = row['count']
+				rollups['sum'][index] = row['mean'] * row['count']
+				rollups['min'][index] = row['min']
+				rollups['max'][index] = row['max']
+
+			# The rows are paged like Observations.
+			download_url = rollup_entities.get('@iot.nextLink')
+			# The nextLink already includes our query options.
+			params = None
+		return rollups
+
+	def client_rollups(self, datastream_url, size, starts, start, end):
+		# Download the Observations and add each page into the rollups.
+		rollups = empty_rollups(len(starts))
+		download_url = f'{datastream_url}/Observations'
+		params = [
+			('$orderby', 'phenomenonTime asc'),
+			('$select', 'phenomenonTime,result'),
+			('$filter', f'phenomenonTime ge {format_time(start)} and phenomenonTime lt {format_time(end)}'),
+			('$top', 1000)
+		]
+		while download_url is not None:
+			response = self.get(download_url, params)
+			response.raise_for_status()
+			observation_entities = response.json()
+			entities = observation_entities['value']
+
+			# Results that are not numbers are left out, as in #14.
+			numeric = [entity for entity in entities if isinstance(entity['result'], (int, float)) and not isinstance(entity['result'], bool)]
+			times = np.array([entity['phenomenonTime'].split('/')[0].rstrip('Z') for entity in numeric], dtype='datetime64[ms]')
+			values = np.array([entity['result'] for entity in numeric], dtype='float64')
+			index = np.searchsorted(starts, times.astype(f'datetime64[{BUCKETS[size]}]'))
+
+			rollups['sum'] += np.bincount(index, weights=values, minlength=len(starts))
+			rollups['count'] += np.bincount(index, minlength=len(starts))
+			np.minimum.at(rollups['min'], index, values)
+			np.maximum.at(rollups['max'], index, values)
+
+			download_url = observation_entities.get('@iot.nextLink')
+			# The nextLink already includes our query options.
+			params = None
+		return rollups
+
+	def compute(self, datastream_url, size, starts):
+		# Work out the rollups for a run of consecutive hours or days.
+		unit = BUCKETS[size]
+		start, end = starts[0], starts[-1] + np.timedelta64(1, unit)
+		rollups = None
+		if self.server_apply is not False:
+			rollups = self.server_rollups(datastream_url, size, starts, start, end)
+			self.server_apply = rollups is not None
+		if rollups is None:
+			rollups = self.client_rollups(datastream_url, size, starts, start, end)
+		self.computed += len(starts)
+
+		rows = []
+		for i, moment in enumerate(starts):
+			count = int(rollups['count'][i])
+			if count == 0:
+				rows.append((format_time(moment), None, None, None, 0))
+			else:
+				rows.append((format_time(moment), float(rollups['sum'][i] / count), float(rollups['min'][i]), float(rollups['max'][i]), count))
+		return rows
+
+	def rollup(self, datastream_url, start, end, size='hour'):
+		# Return (start, mean, min, max, count) for every hour or day that
+		# overlaps the interval, sorted by time. 'mean', 'min' and 'max' are
+		# None when there are no Observations.
+		unit = BUCKETS[size]
+		first = to_time(start, unit)
+		last = to_time(end, unit)
+		# Include the hour or day the interval ends in, unless it ends
+		# exactly where that one starts.
+		if to_time(end) > last.astype('datetime64[ms]'):
+			last += np.timedelta64(1, unit)
+		starts = np.arange(first, last, np.timedelta64(1, unit))
+
+		cached = {
+			row[0]: row for row in self.db.execute(
+				'SELECT start, mean, min, max, count FROM rollups '
+				'WHERE datastream_url = ? AND size = ? AND start >= ? AND start < ?',
+				(datastream_url, size, format_time(first), format_time(last))
+			)
+		}
+		self.cached += len(cached)
+		missing = np.array([format_time(moment) not in cached for moment in starts], dtype=bool)
+
+		# Group the missing ones into runs of consecutive hours or days, so
+		# each run is one query.
+		results = dict(cached)
+		now = np.datetime64('now', unit)
+		edges = np.flatnonzero(np.diff(np.concatenate(([False], missing, [False])).astype(np.int8)))
+		for run_start, run_end in zip(edges[::2], edges[1::2]):
+			rows = self.compute(datastream_url, size, starts[run_start:run_end])
+			with self.db:
+				self.db.executemany(
+					'INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?)',
+					# Hours or days that have not ended yet are not saved.
+					[(datastream_url, size) + row for row, moment in zip(rows, starts[run_start:run_end]) if moment < now]
+				)
+			results.update((row[0], row) for row in rows)
+
+		return [results[format_time(moment)] for moment in starts]
+
+
+cache = AggregateCache(CACHE_FILE)
+
+hourly = cache.rollup(DATASTREAM_URL, INTERVAL_START, INTERVAL_END, 'hour')
+print(f'{len(hourly)} hours: {cache.computed} worked out, {cache.cached} from the cache, {cache.requests} requests')
+
+# An overlapping interval only works out the hours that were not already
+# saved.
+cache.computed = cache.cached = cache.requests = 0
+hourly = cache.rollup(DATASTREAM_URL, "2020-01-10T00:00:00.000Z", "2020-01-14T00:00:00.000Z", 'hour')
+print(f'{len(hourly)} hours: {cache.computed} worked out, {cache.cached} from the cache, {cache.requests} requests')
+
+daily = cache.rollup(DATASTREAM_URL, INTERVAL_START, INTERVAL_END, 'day')
+
+for start, mean, low, high, count in daily:
+	if count:
+		print(f'{start}: mean {mean:.2f}, min {low}, max {high}, {count} Observations')
+	else:
+		print(f'{start}: no Observations')
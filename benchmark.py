@@ -0,0 +1,227 @@
+# Re-measures the examples against the stand-in server in
+# 'mock_sta_server.py', so the numbers in the README ("1 HTTP request",
+# "250 KB vs 41 KB vs 18 KB") can be checked, and so changes to the
+# examples can be compared without using the real server.
+#
+# Each example is run as-is, with its URLs pointed at the stand-in
+# server, in a separate Python process so memory use is measured for
+# that example alone. For each one this prints:
+#
+# * requests: number of HTTP requests the server answered
+# * KB: bytes the server sent (after gzip, if '--compress' is used)
+# * wall ms: time to run the example, after Python has started
+# * peak RSS MB: the most memory the process used
+# * parse ms: time spent in 'response.json()'
+#
+# Usage:
+#
+#   python benchmark.py
+#   python benchmark.py --latency 80 --jitter 20 --things 200
+#   python benchmark.py --save baseline.json
+#   python benchmark.py --compare baseline.json
+#
+# With '--compare', any example that makes more requests, downloads more
+# bytes, or is more than '--tolerance' slower than the saved run is
+# reported, and the exit status is 1.
+#
+# Peak memory is read with the 'resource' module, which is not
+# available on Windows.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from mock_sta_server import MockServer
+
+# The URL used in the examples, replaced by the stand-in server's URL.
+STA_URL = "https://arctic-sta.gswlab.ca/FROST-Server/v1.0"
+# Where the CSV part of #06 starts.
+CSV_MARKER = "# Alternatively, we can download CSV data directly"
+
+
+def json_part(source):
+	return source.split(CSV_MARKER)[0]
+
+
+def csv_part(source):
+	# Keep the imports and settings from the top, and skip the JSON part.
+	before, after = source.split(CSV_MARKER)
+	header = before.split('more_results = True')[0]
+	return header + CSV_MARKER + after
+
+
+# Name, example file, and optionally a function to run only part of it.
+STRATEGIES = [
+	('01 n + 1 Locations', '01_list_things.py', None),
+	('02 $expand Locations', '02_list_things_smart.py', None),
+	('03 nextLink paging', '03_basic_data_query.py', None),
+	('05 $expand FOI', '05_moving_features.py', None),
+	('06 $select JSON', '06_minimize_bandwidth.py', json_part),
+	('06 $select CSV', '06_minimize_bandwidth.py', csv_part),
+	('07 bbox filter', '07_stations_bounds.py', None),
+	('08 phenomena search', '08_phenomena_search.py', None)
+]
+
+COLUMNS = [
+	('requests', 'requests', '{:.0f}'),
+	('kilobytes', 'KB', '{:.1f}'),
+	('wall_ms', 'wall ms', '{:.1f}'),
+	('peak_rss_mb', 'peak RSS MB', '{:.1f}'),
+	('parse_ms', 'parse ms', '{:.1f}')
+]
+
+
+def run_child(path, part, url):
+	# Runs inside the separate process: load the example, point it at the
+	# stand-in server, time it, and print the measurements as JSON.
+	import contextlib
+	import io
+	import resource
+	import requests
+
+	parse_seconds = [0]
+	original_json = requests.models.Response.json
+
+	def timed_json(self, **kwargs):
+		start = time.perf_counter()
+		try:
+			return original_json(self, **kwargs)
+		finally:
+			parse_seconds[0] += time.perf_counter() - start
+
+	requests.models.Response.json = timed_json
+
+	with open(path, encoding='utf-8') as file:
+		source = file.read()
+	if part == 'json':
+		source = json_part(source)
+	elif part == 'csv':
+		source = csv_part(source)
+	source = source.replace(STA_URL, url)
+
+	start = time.perf_counter()
+	with contextlib.redirect_stdout(io.StringIO()):
+		exec(compile(source, path, 'exec'), {'__name__': '__main__', '__file__': path})
+	wall_seconds = time.perf_counter() - start
+
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, macOS reports bytes.
+	peak_rss_mb = peak_rss / 1e6 if sys.platform == 'darwin' else peak_rss / 1e3
+
+	print(json.dumps({
+		'wall_ms': wall_seconds * 1000,
+		'peak_rss_mb': peak_rss_mb,
+		'parse_ms': parse_seconds[0] * 1000
+	}))
+
+
+def run_strategy(server, file_name, part_function):
+	part = {json_part: 'json', csv_part: 'csv'}.get(part_function, '')
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+	server.reset_counters()
+	completed = subprocess.run(
+		[sys.executable, os.path.abspath(__file__), '--child', path, part, server.url],
+		stdout=subprocess.PIPE,
+		stderr=subprocess.PIPE,
+		universal_newlines=True
+	)
+	if completed.returncode != 0:
+		raise RuntimeError(f'{file_name} failed:\n{completed.stderr}')
+	result = json.loads(completed.stdout.strip().splitlines()[-1])
+	result['requests'] = server.requests
+	result['kilobytes'] = server.bytes_sent / 1000
+	return result
+
+
+def run_all(server, repeat):
+	# Run every strategy 'repeat' times, and keep the median of each
+	# measurement. The first run is not counted, as the server creates
+	# its Observations the first time they are asked for.
+	results = {}
+	for name, file_name, part_function in STRATEGIES:
+		run_strategy(server, file_name, part_function)
+		runs = [run_strategy(server, file_name, part_function) for i in range(repeat)]
+		results[name] = {key: statistics.median(run[key] for run in runs) for key, title, number_format in COLUMNS}
+	return results
+
+
+def print_table(results):
+	name_width = max(len(name) for name in results)
+	widths = [max(len(title), 9) for key, title, number_format in COLUMNS]
+	print(' ' * name_width + '  ' + '  '.join(title.rjust(width) for (key, title, number_format), width in zip(COLUMNS, widths)))
+	for name, result in results.items():
+		cells = [number_format.format(result[key]).rjust(width) for (key, title, number_format), width in zip(COLUMNS, widths)]
+		print(name.ljust(name_width) + '  ' + '  '.join(cells))
+
+
+def compare(results, baseline, tolerance):
+	# Return a list of regressions compared to a saved run.
+	regressions = []
+	for name, result in results.items():
+		if name not in baseline:
+			continue
+		before = baseline[name]
+		if result['requests'] > before['requests']:
+			regressions.append(f'{name}: {before["requests"]:.0f} -> {result["requests"]:.0f} requests')
+		if result['kilobytes'] > before['kilobytes'] * 1.01:
+			regressions.append(f'{name}: {before["kilobytes"]:.1f} -> {result["kilobytes"]:.1f} KB')
+		if result['wall_ms'] > before['wall_ms'] * (1 + tolerance):
+			regressions.append(f'{name}: {before["wall_ms"]:.1f} -> {result["wall_ms"]:.1f} wall ms')
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the examples against a stand-in SensorThings API server.')
+	parser.add_argument('--things', type=int, default=50, help='number of Things (each has 3 Datastreams)')
+	parser.add_argument('--observations', type=int, default=5000, help='number of Observations in each Datastream')
+	parser.add_argument('--latency', type=float, default=0, help='milliseconds the server waits before each response')
+	parser.add_argument('--jitter', type=float, default=0, help='random +/- milliseconds added to the latency')
+	parser.add_argument('--compress', action='store_true', help='server uses gzip when the client asks')
+	parser.add_argument('--repeat', type=int, default=3, help='runs of each example; the median is reported')
+	parser.add_argument('--only', action='append', help='only run strategies whose name contains this')
+	parser.add_argument('--save', help='save the results as JSON to this file')
+	parser.add_argument('--compare', help='compare with results saved by --save')
+	parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown with --compare, as a fraction')
+	args = parser.parse_args()
+
+	global STRATEGIES
+	if args.only:
+		STRATEGIES = [strategy for strategy in STRATEGIES if any(text in strategy[0] for text in args.only)]
+
+	server = MockServer(
+		things=args.things,
+		observations=args.observations,
+		latency=args.latency / 1000,
+		jitter=args.jitter / 1000,
+		compress=args.compress
+	).start()
+
+	try:
+		results = run_all(server, args.repeat)
+	finally:
+		server.stop()
+
+	print(f'{args.things} Things, {args.observations} Observations per Datastream, {args.latency:.0f} ± {args.jitter:.0f} ms latency{", gzip" if args.compress else ""}')
+	print_table(results)
+
+	if args.save:
+		with open(args.save, 'w') as file:
+			json.dump(results, file, indent=2)
+
+	if args.compare:
+		with open(args.compare) as file:
+			regressions = compare(results, json.load(file), args.tolerance)
+		for regression in regressions:
+			print(f'Regression: {regression}')
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) == 5 and sys.argv[1] == '--child':
+		run_child(sys.argv[2], sys.argv[3], sys.argv[4])
+	else:
+		main()
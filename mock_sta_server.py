@@ -0,0 +1,1233 @@
+# A small stand-in for a FROST SensorThings API server, for testing and
+# benchmarking the examples without using the real service.
+#
+# It serves made-up Things, Locations, Datastreams, Observed Properties,
+# Observations and Features of Interest, and supports the parts of the
+# API used in the examples:
+#
+# * '$top', '$skip', '$count' and '@iot.nextLink' paging
+# * '$orderby', '$select' and '$expand' (with nested '$select')
+# * '$filter' with 'eq', 'ne', 'gt', 'ge', 'lt', 'le', 'and', 'or',
+#   'not', and 'geo.intersects' with a WKT POLYGON
+# * '$resultFormat=CSV' and '$resultFormat=dataArray'
+# * "ETag"/"Last-Modified" revalidation and gzip compression
+# * JSON '$batch' of GET requests, on the "v1.1" URL
+# * '$apply' with filter/compute/groupby/aggregate, for #28 (only with
+#   '--apply', as FROST does not support it)
+# * an MQTT broker, for subscribing to new Observations (see #22)
+#
+# A delay can be added to every response to act like a server that is
+# further away or busy.
+#
+# It can be started on its own:
+#
+#   python mock_sta_server.py --port 8080 --latency 50
+#
+# and then the examples can be pointed at
+# "http://127.0.0.1:8080/FROST-Server/v1.0" instead of the real server.
+#
+# To also publish a new Observation for Datastream 46 every 5 seconds
+# over MQTT:
+#
+#   python mock_sta_server.py --port 8080 --mqtt-port 1883 --publish 46
+#
+# Or started from Python, as in 'benchmark.py':
+#
+#   server = MockServer(things=50, latency=0.05)
+#   server.start()
+#   print(server.url)
+#   server.stop()
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import random
+import re
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit
+
+# Path of the service on the server, the same as FROST.
+SERVICE_PATH = "/FROST-Server/v1.0"
+# Like FROST, JSON '$batch' is only answered on the "v1.1" URL.
+BATCH_PATH = "/FROST-Server/v1.1/$batch"
+# Page size when '$top' is not given, and the largest allowed.
+DEFAULT_TOP = 100
+MAX_TOP = 10000
+# Time of the first Observation in each Datastream, and the time
+# between Observations.
+START_TIME = datetime(2020, 1, 1, tzinfo=timezone.utc)
+OBSERVATION_STEP = timedelta(minutes=10)
+# Number of consecutive Observations that share a Feature of Interest,
+# like a moving sensor that reports several times at each place.
+OBSERVATIONS_PER_FEATURE = 5
+OBSERVED_PROPERTIES = ['Air Temperature', 'Relative Humidity', 'Wind Speed']
+
+
+def format_time(moment):
+	return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def parse_time(timestamp):
+	return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+# Filters
+#
+# '$filter' expressions are parsed into nested tuples, and then run on
+# each entity. Values on the left side of a comparison are "paths" like
+# 'name' or 'Locations/location'. If a path goes through a relation with
+# more than one entity, the comparison is true if any of them match.
+
+TOKEN = re.compile(r"""
+	\s*(?:
+		(?P<geography>geography'[^']*')
+		| (?P<string>'(?:[^']|'')*')
+		| (?P<time>\d{4}-\d\d-\d\dT[\d:.]+(?:Z|[+-]\d\d:\d\d))
+		| (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+		| (?P<symbol>[(),])
+		| (?P<name>[A-Za-z_@][\w./@]*)
+	)""", re.VERBOSE)
+
+COMPARISONS = {
+	'eq': lambda a, b: a == b,
+	'ne': lambda a, b: a != b,
+	'gt': lambda a, b: a is not None and a > b,
+	'ge': lambda a, b: a is not None and a >= b,
+	'lt': lambda a, b: a is not None and a < b,
+	'le': lambda a, b: a is not None and a <= b
+}
+
+
+def tokenize(text):
+	tokens = []
+	position = 0
+	text = text.strip()
+	while position < len(text):
+		match = TOKEN.match(text, position)
+		if match is None:
+			raise ValueError(f'Cannot parse $filter at: {text[position:]!r}')
+		kind = match.lastgroup
+		tokens.append((kind, match.group(kind)))
+		position = match.end()
+	return tokens
+
+
+class FilterParser:
+
+	def __init__(self, text):
+		self.tokens = tokenize(text)
+		self.position = 0
+
+	def peek(self):
+		return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+	def take(self, value=None):
+		token = self.peek()
+		if token[0] is None or (value is not None and token[1] != value):
+			raise ValueError(f'Expected {value!r} in $filter, found {token[1]!r}')
+		self.position += 1
+		return token
+
+	def parse(self):
+		expression = self.parse_or()
+		if self.position != len(self.tokens):
+			raise ValueError(f'Unexpected {self.peek()[1]!r} in $filter')
+		return expression
+
+	def parse_or(self):
+		expression = self.parse_and()
+		while self.peek() == ('name', 'or'):
+			self.take()
+			expression = ('or', expression, self.parse_and())
+		return expression
+
+	def parse_and(self):
+		expression = self.parse_not()
+		while self.peek() == ('name', 'and'):
+			self.take()
+			expression = ('and', expression, self.parse_not())
+		return expression
+
+	def parse_not(self):
+		if self.peek() == ('name', 'not'):
+			self.take()
+			return ('not', self.parse_not())
+		left = self.parse_value()
+		kind, value = self.peek()
+		if kind == 'name' and value in COMPARISONS:
+			self.take()
+			return ('compare', value, left, self.parse_value())
+		return left
+
+	def parse_value(self):
+		kind, value = self.take()
+		if kind == 'symbol' and value == '(':
+			expression = self.parse_or()
+			self.take(')')
+			return expression
+		if kind == 'geography':
+			return ('literal', parse_wkt(value[len("geography'"):-1]))
+		if kind == 'string':
+			return ('literal', value[1:-1].replace("''", "'"))
+		if kind == 'time':
+			return ('literal', parse_time(value))
+		if kind == 'number':
+			return ('literal', float(value) if re.search(r'[.eE]', value) else int(value))
+		if kind == 'name':
+			if value in ('true', 'false'):
+				return ('literal', value == 'true')
+			if value == 'null':
+				return ('literal', None)
+			if self.peek() == ('symbol', '('):
+				self.take('(')
+				arguments = [self.parse_or()]
+				while self.peek() == ('symbol', ','):
+					self.take()
+					arguments.append(self.parse_or())
+				self.take(')')
+				return ('function', value, arguments)
+			return ('path', value.split('/'))
+		raise ValueError(f'Unexpected {value!r} in $filter')
+
+
+# Geometry
+#
+# Only enough to answer 'geo.intersects' for points, lines and polygons,
+# using flat latitude/longitude.
+
+def parse_wkt(wkt):
+	match = re.fullmatch(r'\s*(POINT|POLYGON)\s*\((.*)\)\s*', wkt, re.IGNORECASE)
+	if match is None:
+		raise ValueError(f'Only WKT POINT and POLYGON are supported, not {wkt!r}')
+	if match.group(1).upper() == 'POINT':
+		return {'type': 'Point', 'coordinates': [float(number) for number in match.group(2).split()]}
+	rings = [
+		[[float(number) for number in point.split()] for point in ring.split(',')]
+		for ring in re.findall(r'\(([^()]*)\)', match.group(2))
+	]
+	return {'type': 'Polygon', 'coordinates': rings}
+
+
+def geometry_points(geometry):
+	coordinates = geometry['coordinates']
+	if geometry['type'] == 'Point':
+		return [coordinates]
+	if geometry['type'] in ('MultiPoint', 'LineString'):
+		return coordinates
+	if geometry['type'] in ('MultiLineString', 'Polygon'):
+		return [point for part in coordinates for point in part]
+	if geometry['type'] == 'MultiPolygon':
+		return [point for polygon in coordinates for ring in polygon for point in ring]
+	raise ValueError(f'Unhandled GeoJSON type: {geometry["type"]}')
+
+
+def point_in_polygon(point, polygon):
+	# Points on an edge count as inside, like 'geo.intersects' in FROST.
+	x, y = point[0], point[1]
+	for ring in polygon['coordinates']:
+		for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+			if (x2 - x1) * (y - y1) == (y2 - y1) * (x - x1) and min(x1, x2) <= x <= max(x1, x2) and min(y1, y2) <= y <= max(y1, y2):
+				return True
+	inside = False
+	for ring in polygon['coordinates']:
+		for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+			if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+				inside = not inside
+	return inside
+
+
+def intersects(a, b):
+	# Close enough for the mock server: true if a point of one geometry is
+	# inside the other polygon, or the points are the same.
+	if a is None or b is None:
+		return False
+	if b['type'] == 'Polygon' and any(point_in_polygon(point, b) for point in geometry_points(a)):
+		return True
+	if a['type'] == 'Polygon' and any(point_in_polygon(point, a) for point in geometry_points(b)):
+		return True
+	return any(point_a[:2] == point_b[:2] for point_a in geometry_points(a) for point_b in geometry_points(b))
+
+
+# Entities
+#
+# Each entity is a dictionary with its attributes. The "_" keys are
+# only used by the server, and are never sent.
+
+RELATIONS = {
+	'Things': {'Locations': 'Locations', 'Datastreams': 'Datastreams', 'HistoricalLocations': 'HistoricalLocations'},
+	'Locations': {'Things': 'Things', 'HistoricalLocations': 'HistoricalLocations'},
+	'HistoricalLocations': {'Thing': 'Things', 'Locations': 'Locations'},
+	'Datastreams': {'Thing': 'Things', 'ObservedProperty': 'ObservedProperties', 'Sensor': 'Sensors', 'Observations': 'Observations'},
+	'Sensors': {'Datastreams': 'Datastreams'},
+	'ObservedProperties': {'Datastreams': 'Datastreams'},
+	'Observations': {'Datastream': 'Datastreams', 'FeatureOfInterest': 'FeaturesOfInterest'},
+	'FeaturesOfInterest': {'Observations': 'Observations'}
+}
+
+
+SINGULAR = {
+	'Things': 'Thing',
+	'Locations': 'Location',
+	'HistoricalLocations': 'HistoricalLocation',
+	'Datastreams': 'Datastream',
+	'Sensors': 'Sensor',
+	'ObservedProperties': 'ObservedProperty',
+	'Observations': 'Observation',
+	'FeaturesOfInterest': 'FeatureOfInterest'
+}
+
+
+class Store:
+	# The made-up data. Observations and Features of Interest are only
+	# created when a Datastream is first asked for, as there can be a lot.
+
+	def __init__(self, things=50, observations=5000, seed=1):
+		self.observation_count = observations
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.collections = {name: {} for name in RELATIONS}
+		self.observations_by_datastream = {}
+		self.features = {}
+		self.features_by_datastream = {}
+		self.generators = {}
+		self.build(things)
+
+	def add(self, collection, entity):
+		self.collections[collection][entity['@iot.id']] = entity
+		return entity
+
+	def build(self, thing_count):
+		for i, name in enumerate(OBSERVED_PROPERTIES, start=1):
+			self.add('ObservedProperties', {
+				'@iot.id': i,
+				'name': name,
+				'description': f'{name} measured at the station',
+				'definition': f'http://vocab.example.org/{name.replace(" ", "")}'
+			})
+			self.add('Sensors', {
+				'@iot.id': i,
+				'name': f'{name} Sensor',
+				'description': f'Sensor for {name}',
+				'encodingType': 'application/pdf',
+				'metadata': 'http://example.org/datasheet.pdf'
+			})
+
+		# Every two Things share a Location, like two stations at one site.
+		# The first few are inside the polygon used in #07 and #08.
+		location_count = math.ceil(thing_count / 2)
+		for i in range(1, location_count + 1):
+			if i <= 3:
+				coordinates = [-105.5 + 0.1 * i, 68.5 + 0.3 * i]
+			else:
+				coordinates = [round(self.random.uniform(-140, -60), 4), round(self.random.uniform(55, 80), 4)]
+			self.add('Locations', {
+				'@iot.id': i,
+				'name': f'Site {i}',
+				'description': f'Site number {i}',
+				'encodingType': 'application/vnd.geo+json',
+				'location': {'type': 'Point', 'coordinates': coordinates}
+			})
+
+		datastream_id = 1
+		for i in range(1, thing_count + 1):
+			location = self.collections['Locations'][(i - 1) // 2 + 1]
+			self.add('Things', {
+				'@iot.id': i,
+				'name': f'Station {i}',
+				'description': f'Weather station number {i}',
+				'properties': {},
+				'_Locations': [location['@iot.id']]
+			})
+			self.add('HistoricalLocations', {
+				'@iot.id': i,
+				'time': format_time(START_TIME),
+				'_time': START_TIME,
+				'_Thing': i,
+				'_Locations': [location['@iot.id']]
+			})
+			for observed_property in self.collections['ObservedProperties'].values():
+				self.add('Datastreams', {
+					'@iot.id': datastream_id,
+					'name': f'Station {i} {observed_property["name"]}',
+					'description': f'{observed_property["name"]} at station {i}',
+					'unitOfMeasurement': {'name': 'Degree Celsius', 'symbol': '˚C', 'definition': 'http://unitsofmeasure.org/ucum.html#para-30'},
+					'observationType': 'http://www.opengis.net/def/observationType/OGC-OM/2.0/OM_Measurement',
+					'observedArea': location['location'],
+					'phenomenonTime': None,
+					'_origin': location['location']['coordinates'],
+					'resultTime': None,
+					'_Thing': i,
+					'_ObservedProperty': observed_property['@iot.id'],
+					'_Sensor': observed_property['@iot.id']
+				})
+				datastream_id += 1
+
+	def datastream_observations(self, datastream_id):
+		# Create the Observations of a Datastream the first time they are
+		# needed.
+		with self.lock:
+			if datastream_id not in self.observations_by_datastream:
+				self.observations_by_datastream[datastream_id] = []
+				self.features_by_datastream[datastream_id] = []
+				self.generators[datastream_id] = random.Random(datastream_id)
+				for k in range(self.observation_count):
+					self.new_observation(datastream_id)
+			return self.observations_by_datastream[datastream_id]
+
+	def add_observation(self, datastream_id, result=None):
+		# Add one more Observation at the end of a Datastream, like a sensor
+		# sending new data.
+		self.datastream_observations(datastream_id)
+		with self.lock:
+			return self.new_observation(datastream_id, result)
+
+	def new_observation(self, datastream_id, result=None):
+		# The sensor drifts slowly away from its station, so each group of
+		# Observations has a different Feature of Interest.
+		datastream = self.collections['Datastreams'][datastream_id]
+		observations = self.observations_by_datastream[datastream_id]
+		features = self.features_by_datastream[datastream_id]
+		k = len(observations)
+		if k % OBSERVATIONS_PER_FEATURE == 0:
+			step = k // OBSERVATIONS_PER_FEATURE
+			origin = datastream['_origin']
+			feature = {
+				'@iot.id': datastream_id * 10000000 + step + 1,
+				'name': f'Position {step + 1} of Datastream {datastream_id}',
+				'description': '',
+				'encodingType': 'application/vnd.geo+json',
+				'feature': {'type': 'Point', 'coordinates': [round(origin[0] + 0.001 * step, 5), round(origin[1] + 0.0005 * step, 5)]},
+				'_Observations': []
+			}
+			features.append(feature)
+			self.features[feature['@iot.id']] = feature
+			# Like FROST, 'observedArea' covers every Feature of Interest so
+			# far; here as a bounding box.
+			first, last = features[0]['feature']['coordinates'], feature['feature']['coordinates']
+			if first != last:
+				west, east = sorted([first[0], last[0]])
+				south, north = sorted([first[1], last[1]])
+				datastream['observedArea'] = {'type': 'Polygon', 'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]}
+		feature = features[-1]
+		if result is None:
+			result = round(5 + 10 * math.sin(k / 72) + self.generators[datastream_id].gauss(0, 1), 3)
+		moment = START_TIME + OBSERVATION_STEP * k
+		observation = {
+			'@iot.id': datastream_id * 10000000 + k + 1,
+			'phenomenonTime': format_time(moment),
+			'resultTime': format_time(moment),
+			'result': result,
+			'resultQuality': None,
+			'validTime': None,
+			'parameters': None,
+			'_time': moment,
+			'_Datastream': datastream_id,
+			'_FeatureOfInterest': feature['@iot.id']
+		}
+		feature['_Observations'].append(observation['@iot.id'])
+		observations.append(observation)
+		datastream['phenomenonTime'] = f'{observations[0]["phenomenonTime"]}/{observation["phenomenonTime"]}'
+		return observation
+
+	def get(self, collection, entity_id):
+		if collection == 'Observations':
+			observations = self.datastream_observations(entity_id // 10000000)
+			index = entity_id % 10000000 - 1
+			return observations[index] if 0 <= index < len(observations) else None
+		if collection == 'FeaturesOfInterest':
+			self.datastream_observations(entity_id // 10000000)
+			return self.features.get(entity_id)
+		return self.collections[collection].get(entity_id)
+
+	def all(self, collection):
+		if collection == 'Observations':
+			return [observation for datastream_id in self.collections['Datastreams'] for observation in self.datastream_observations(datastream_id)]
+		if collection == 'FeaturesOfInterest':
+			for datastream_id in self.collections['Datastreams']:
+				self.datastream_observations(datastream_id)
+			return [feature for datastream_id in self.collections['Datastreams'] for feature in self.features_by_datastream[datastream_id]]
+		return list(self.collections[collection].values())
+
+	def related(self, collection, entity, relation):
+		# Return the related entities, and their collection name.
+		target = RELATIONS[collection][relation]
+		if collection == 'Datastreams' and relation == 'Observations':
+			return target, self.datastream_observations(entity['@iot.id'])
+		if '_' + relation in entity:
+			ids = entity['_' + relation]
+			ids = ids if isinstance(ids, list) else [ids]
+			return target, [self.get(target, related_id) for related_id in ids]
+		# The other side of a relation, found by searching.
+		singular = SINGULAR[collection]
+		found = []
+		for item in self.all(target):
+			link = item.get('_' + singular, item.get('_' + collection))
+			if link == entity['@iot.id'] or (isinstance(link, list) and entity['@iot.id'] in link):
+				found.append(item)
+		return target, found
+
+
+# Queries
+
+def split_options(text, separator=','):
+	# Split "a,b($select=c,d),e" on the commas that are not in brackets.
+	parts = []
+	depth = 0
+	current = ''
+	for char in text:
+		if char == separator and depth == 0:
+			parts.append(current.strip())
+			current = ''
+			continue
+		depth += {'(': 1, ')': -1}.get(char, 0)
+		current += char
+	if current.strip():
+		parts.append(current.strip())
+	return parts
+
+
+# Functions and aggregation methods for '$apply'.
+APPLY_FUNCTIONS = {
+	'year': lambda moment: moment.year,
+	'month': lambda moment: moment.month,
+	'day': lambda moment: moment.day,
+	'hour': lambda moment: moment.hour
+}
+AGGREGATE_METHODS = {
+	'average': lambda values: sum(values) / len(values),
+	'min': min,
+	'max': max,
+	'sum': sum
+}
+
+
+def parse_expand(text):
+	# Return {relation: {option: value}} for '$expand', with any nested
+	# options like "Locations($select=id)".
+	expands = {}
+	for part in split_options(text):
+		match = re.fullmatch(r'([\w/]+)(?:\((.*)\))?', part)
+		if match is None:
+			raise ValueError(f'Cannot parse $expand: {part!r}')
+		options = {}
+		if match.group(2):
+			for option in re.split(r';(?![^(]*\))', match.group(2)):
+				key, _, value = option.partition('=')
+				options[key.strip()] = value.strip()
+		path = match.group(1).split('/')
+		nested = expands.setdefault(path[0], {})
+		if len(path) > 1:
+			nested.setdefault('$expand', '')
+			nested['$expand'] = ','.join(filter(None, [nested['$expand'], '/'.join(path[1:])]))
+		nested.update(options)
+	return expands
+
+
+class Query:
+
+	def __init__(self, server, collection, options):
+		self.server = server
+		self.store = server.store
+		self.collection = collection
+		self.options = options
+
+	def resolve(self, collection, entity, path):
+		# Return all the values for a path like 'Locations/location'.
+		values = [(collection, entity)]
+		for key in path:
+			next_values = []
+			for value_collection, value in values:
+				if value_collection is not None and key in RELATIONS[value_collection]:
+					target, related = self.store.related(value_collection, value, key)
+					next_values += [(target, item) for item in related if item is not None]
+				elif value_collection is not None and key in ('id', '@iot.id'):
+					next_values.append((None, value['@iot.id']))
+				elif value_collection is not None and key in ('phenomenonTime', 'time') and '_time' in value:
+					next_values.append((None, value['_time']))
+				elif isinstance(value, dict):
+					next_values.append((None, value.get(key)))
+			values = next_values
+		return [value for value_collection, value in values]
+
+	def evaluate(self, expression, collection, entity):
+		kind = expression[0]
+		if kind == 'or':
+			return self.evaluate(expression[1], collection, entity) or self.evaluate(expression[2], collection, entity)
+		if kind == 'and':
+			return self.evaluate(expression[1], collection, entity) and self.evaluate(expression[2], collection, entity)
+		if kind == 'not':
+			return not self.evaluate(expression[1], collection, entity)
+		if kind == 'literal':
+			return [expression[1]]
+		if kind == 'path':
+			return self.resolve(collection, entity, expression[1])
+		if kind == 'compare':
+			compare = COMPARISONS[expression[1]]
+			lefts = self.values(expression[2], collection, entity)
+			rights = self.values(expression[3], collection, entity)
+			for left in lefts:
+				for right in rights:
+					try:
+						if compare(left, right):
+							return True
+					except TypeError:
+						pass
+			return False
+		if kind == 'function':
+			name, arguments = expression[1], expression[2]
+			if name in ('geo.intersects', 'st_intersects'):
+				if not self.server.foi_geo and any(argument[0] == 'path' and 'FeatureOfInterest' in argument[1] for argument in arguments):
+					raise ValueError('geo.intersects is not supported on FeatureOfInterest')
+				lefts = self.values(arguments[0], collection, entity)
+				rights = self.values(arguments[1], collection, entity)
+				return any(intersects(left, right) for left in lefts for right in rights)
+			raise ValueError(f'Unsupported $filter function: {name}')
+		raise ValueError(f'Unsupported $filter expression: {kind}')
+
+	def values(self, expression, collection, entity):
+		result = self.evaluate(expression, collection, entity)
+		return result if isinstance(result, list) else [result]
+
+	def filter(self, collection, entities, text):
+		if not text:
+			return entities
+		expression = FilterParser(text).parse()
+		return [entity for entity in entities if self.evaluate(expression, collection, entity) is True]
+
+	def order(self, collection, entities, text):
+		if not text:
+			return entities
+		for part in reversed(split_options(text)):
+			pieces = part.split()
+			path = pieces[0].split('/')
+			descending = len(pieces) > 1 and pieces[1].lower() == 'desc'
+
+			def key(entity):
+				values = self.resolve(collection, entity, path)
+				value = values[0] if values else None
+				return (value is None, value)
+			entities = sorted(entities, key=key, reverse=descending)
+		return entities
+
+	def apply(self, collection, entities, text):
+		# Only enough of OData '$apply' for the rollups in #28, steps
+		# separated by "/":
+		#
+		#   filter(<$filter expression>)
+		#   compute(hour(phenomenonTime) as h, ...)
+		#   groupby((h, ...), aggregate(result with average as mean, ..., $count as count))
+		if not self.server.apply:
+			raise ValueError('$apply is not supported')
+		rows = [(entity, {}) for entity in entities]
+		for step in split_options(text, '/'):
+			match = re.fullmatch(r'(\w+)\((.*)\)', step, re.DOTALL)
+			if match is None:
+				raise ValueError(f'Cannot parse $apply step: {step!r}')
+			name, argument = match.groups()
+			if name == 'filter':
+				expression = FilterParser(argument).parse()
+				rows = [(entity, computed) for entity, computed in rows if self.evaluate(expression, collection, entity) is True]
+			elif name == 'compute':
+				for item in split_options(argument):
+					compute = re.fullmatch(r'(\w+)\(([\w/]+)\)\s+as\s+(\w+)', item)
+					if compute is None or compute.group(1) not in APPLY_FUNCTIONS:
+						raise ValueError(f'Unsupported $apply compute: {item!r}')
+					function, path, alias = APPLY_FUNCTIONS[compute.group(1)], compute.group(2).split('/'), compute.group(3)
+					for entity, computed in rows:
+						computed[alias] = function(self.resolve(collection, entity, path)[0])
+			elif name == 'groupby':
+				group = re.fullmatch(r'\(([^)]*)\)\s*,\s*aggregate\((.*)\)', argument, re.DOTALL)
+				if group is None:
+					raise ValueError(f'Cannot parse $apply groupby: {argument!r}')
+				keys = [key.strip() for key in group.group(1).split(',')]
+				groups = {}
+				for entity, computed in rows:
+					groups.setdefault(tuple(computed.get(key, entity.get(key)) for key in keys), []).append(entity)
+				aggregates = []
+				for item in split_options(group.group(2)):
+					aggregate = re.fullmatch(r'(?:([\w/]+)\s+with\s+(\w+)|\$count)\s+as\s+(\w+)', item)
+					if aggregate is None or (aggregate.group(2) is not None and aggregate.group(2) not in AGGREGATE_METHODS):
+						raise ValueError(f'Unsupported $apply aggregate: {item!r}')
+					aggregates.append(aggregate.groups())
+				result = []
+				for key_values, members in sorted(groups.items()):
+					row = dict(zip(keys, key_values))
+					for path, method, alias in aggregates:
+						if path is None:
+							row[alias] = len(members)
+							continue
+						values = [value for entity in members for value in self.resolve(collection, entity, path.split('/')) if isinstance(value, (int, float)) and not isinstance(value, bool)]
+						row[alias] = AGGREGATE_METHODS[method](values) if values else None
+					result.append(row)
+				return result
+			else:
+				raise ValueError(f'Unsupported $apply step: {name}')
+		return [computed for entity, computed in rows]
+
+	def render(self, collection, entity, options):
+		# Make the JSON for one entity, with '$select' and '$expand'.
+		self_link = f'{self.server.url}/{collection}({entity["@iot.id"]})'
+		selected = None
+		if options.get('$select'):
+			selected = [name.strip() for name in options['$select'].split(',')]
+		output = {}
+		if selected is None or 'id' in selected or '@iot.id' in selected:
+			output['@iot.id'] = entity['@iot.id']
+		if selected is None or '@iot.selfLink' in selected:
+			output['@iot.selfLink'] = self_link
+		for key, value in entity.items():
+			if not key.startswith('_') and key != '@iot.id' and (selected is None or key in selected):
+				output[key] = value
+		for relation in RELATIONS[collection]:
+			if selected is None or relation in selected:
+				output[f'{relation}@iot.navigationLink'] = f'{self_link}/{relation}'
+		for relation, nested_options in parse_expand(options.get('$expand', '')).items():
+			if relation not in RELATIONS[collection]:
+				raise ValueError(f'Cannot $expand {relation} on {collection}')
+			target, related = self.store.related(collection, entity, relation)
+			related = [item for item in related if item is not None]
+			related = self.filter(target, related, nested_options.get('$filter'))
+			related = self.order(target, related, nested_options.get('$orderby'))
+			top = int(nested_options.get('$top', DEFAULT_TOP))
+			skip = int(nested_options.get('$skip', 0))
+			rendered = [self.render(target, item, nested_options) for item in related[skip:skip + top]]
+			# Relations to a single entity (like 'Thing' or
+			# 'FeatureOfInterest') are objects, not lists.
+			if not relation.endswith('s'):
+				output[relation] = rendered[0] if rendered else None
+			else:
+				output[relation] = rendered
+			output.pop(f'{relation}@iot.navigationLink', None)
+		return output
+
+	def run(self, path, entities, single):
+		# Return (status, content type, body, extra headers).
+		options = self.options
+		if single:
+			return 200, 'application/json', json.dumps(self.render(self.collection, entities, options)), {}
+
+		entities = self.filter(self.collection, entities, options.get('$filter'))
+		if '$apply' in options:
+			# The aggregated rows are paged like entities.
+			entities = self.apply(self.collection, entities, options['$apply'])
+		else:
+			entities = self.order(self.collection, entities, options.get('$orderby'))
+		top = min(int(options.get('$top', DEFAULT_TOP)), MAX_TOP)
+		skip = int(options.get('$skip', 0))
+		page = entities[skip:skip + top]
+
+		next_link = None
+		if skip + top < len(entities) and top > 0:
+			next_options = dict(options)
+			next_options['$top'] = str(top)
+			next_options['$skip'] = str(skip + top)
+			next_link = f'{self.server.url}{path}?' + urlencode(next_options, quote_via=quote)
+
+		if '$apply' in options:
+			body = {'value': page}
+			if next_link is not None:
+				body['@iot.nextLink'] = next_link
+			return 200, 'application/json', json.dumps(body), {}
+
+		result_format = options.get('$resultFormat')
+		select = [name.strip() for name in options.get('$select', 'id,phenomenonTime,resultTime,result').split(',')]
+
+		if result_format == 'CSV':
+			rows = [','.join(select)]
+			for entity in page:
+				rendered = self.render(self.collection, entity, {'$select': options.get('$select', ','.join(select))})
+				rows.append(','.join(csv_value(rendered.get('@iot.id' if name == 'id' else name)) for name in select))
+			return 200, 'text/csv', '\n'.join(rows) + '\n', {}
+
+		body = {}
+		if options.get('$count', 'true') != 'false':
+			body['@iot.count'] = len(entities)
+		if next_link is not None:
+			body['@iot.nextLink'] = next_link
+
+		if result_format == 'dataArray':
+			rows = []
+			for entity in page:
+				rendered = self.render(self.collection, entity, {'$select': ','.join(select)})
+				rows.append([rendered.get('@iot.id' if name == 'id' else name) for name in select])
+			datastream_link = f'{self.server.url}{path.rsplit("/", 1)[0]}'
+			body['value'] = [{
+				'Datastream@iot.navigationLink': datastream_link,
+				'components': select,
+				'dataArray@iot.count': len(rows),
+				'dataArray': rows
+			}] if rows else []
+		else:
+			body['value'] = [self.render(self.collection, entity, options) for entity in page]
+		return 200, 'application/json', json.dumps(body), {}
+
+
+def csv_value(value):
+	if value is None:
+		return ''
+	text = value if isinstance(value, str) else json.dumps(value)
+	if any(char in text for char in ',"\n'):
+		return '"' + text.replace('"', '""') + '"'
+	return text
+
+
+# HTTP
+
+def error_body(status, message):
+	return status, 'application/json', json.dumps({'code': status, 'type': 'error', 'message': message}), {}
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# The headers and body are written separately, and without this the
+	# client waits for a delayed TCP acknowledgement on every response.
+	disable_nagle_algorithm = True
+
+	def log_message(self, format, *args):
+		if self.server.mock.verbose:
+			super().log_message(format, *args)
+
+	def send_body(self, status, content_type, body, headers):
+		mock = self.server.mock
+		body = body.encode('utf-8') if isinstance(body, str) else body
+		etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+		last_modified = formatdate(mock.started_at, usegmt=True)
+
+		not_modified = False
+		if status == 200:
+			if self.headers.get('If-None-Match') == etag:
+				not_modified = True
+			elif 'If-None-Match' not in self.headers and 'If-Modified-Since' in self.headers:
+				try:
+					not_modified = parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp() >= int(mock.started_at)
+				except (TypeError, ValueError):
+					pass
+
+		decoded_size = len(body)
+		if not_modified:
+			status, body = 304, b''
+		elif mock.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+			body = gzip.compress(body, 6)
+			headers = dict(headers, **{'Content-Encoding': 'gzip'})
+
+		self.send_response(status)
+		if status != 304:
+			self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+		self.send_header('ETag', etag)
+		self.send_header('Last-Modified', last_modified)
+		for key, value in headers.items():
+			self.send_header(key, value)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+		mock.count(len(body), decoded_size)
+
+	def send_error_body(self, status, message):
+		self.send_body(*error_body(status, message))
+
+	def do_GET(self):
+		mock = self.server.mock
+		mock.delay()
+		url = urlsplit(self.path)
+		if not url.path.startswith(SERVICE_PATH):
+			return self.send_error_body(404, 'Not found')
+		if mock.rate_limited():
+			status, content_type, body, headers = error_body(429, 'Too many requests')
+			return self.send_body(status, content_type, body, {'Retry-After': '1'})
+		status, content_type, body, headers = mock.get(url.path[len(SERVICE_PATH):], url.query)
+		self.send_body(status, content_type, body, headers)
+
+	def do_POST(self):
+		# Only JSON '$batch' requests are supported, with GET requests in
+		# the batch.
+		mock = self.server.mock
+		mock.delay()
+		body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		if not mock.batch or urlsplit(self.path).path != BATCH_PATH:
+			return self.send_error_body(404, 'Not found')
+		if not self.headers.get('Content-Type', '').startswith('application/json'):
+			return self.send_error_body(415, 'Only JSON $batch is supported')
+		try:
+			requests_list = json.loads(body)['requests']
+		except (ValueError, KeyError):
+			return self.send_error_body(400, 'Invalid $batch body')
+
+		responses = []
+		for item in requests_list:
+			if item.get('method', '').lower() != 'get':
+				responses.append({'id': item.get('id'), 'status': 405, 'body': {'message': 'Only GET is supported in a batch'}})
+				continue
+			url = urlsplit(item['url'])
+			path = url.path if url.path.startswith('/') else '/' + url.path
+			if path.startswith(SERVICE_PATH):
+				path = path[len(SERVICE_PATH):]
+			status, content_type, response_body, headers = mock.get(path, url.query)
+			responses.append({
+				'id': item.get('id'),
+				'status': status,
+				'body': json.loads(response_body) if content_type == 'application/json' else response_body
+			})
+		self.send_body(200, 'application/json', json.dumps({'responses': responses}), {})
+
+
+def read_remaining_length(stream):
+	# MQTT sends the packet length in 1 to 4 bytes, 7 bits in each.
+	length = 0
+	for shift in range(0, 28, 7):
+		byte = stream.read(1)
+		if not byte:
+			raise EOFError
+		length |= (byte[0] & 0x7F) << shift
+		if byte[0] < 0x80:
+			return length
+	raise ValueError('Bad MQTT packet length')
+
+
+def encode_packet(packet_type, body):
+	header = bytearray([packet_type])
+	length = len(body)
+	while True:
+		byte = length & 0x7F
+		length >>= 7
+		header.append(byte | 0x80 if length > 0 else byte)
+		if length == 0:
+			return bytes(header) + body
+
+
+def encode_string(text):
+	data = text.encode('utf-8')
+	return len(data).to_bytes(2, 'big') + data
+
+
+def read_string(body, offset):
+	length = int.from_bytes(body[offset:offset + 2], 'big')
+	return body[offset + 2:offset + 2 + length].decode('utf-8'), offset + 2 + length
+
+
+def topic_matches(pattern, topic):
+	# '+' matches one level of the topic, '#' matches all the rest.
+	pattern_levels = pattern.split('/')
+	topic_levels = topic.split('/')
+	for i, level in enumerate(pattern_levels):
+		if level == '#':
+			return True
+		if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+			return False
+	return len(pattern_levels) == len(topic_levels)
+
+
+class MqttHandler(socketserver.StreamRequestHandler):
+	# One connected MQTT client. Only what a subscriber needs is supported:
+	# CONNECT, SUBSCRIBE, UNSUBSCRIBE, PINGREQ, DISCONNECT, and PUBLISH
+	# from the client with QoS 0 or 1. Messages are always sent to
+	# subscribers with QoS 0, and nothing is kept for clients that are
+	# not connected.
+
+	def setup(self):
+		super().setup()
+		self.subscriptions = set()
+		self.write_lock = threading.Lock()
+
+	def send(self, packet):
+		with self.write_lock:
+			self.wfile.write(packet)
+			self.wfile.flush()
+
+	def handle(self):
+		broker = self.server.broker
+		try:
+			while True:
+				first = self.rfile.read(1)
+				if not first:
+					break
+				packet_type = first[0] & 0xF0
+				flags = first[0] & 0x0F
+				body = self.rfile.read(read_remaining_length(self.rfile))
+				if packet_type == 0x10:
+					# CONNECT: accept every client.
+					self.send(encode_packet(0x20, b'\x00\x00'))
+					broker.add_client(self)
+				elif packet_type == 0x80:
+					# SUBSCRIBE: grant QoS 0 for every topic filter.
+					packet_id, offset, granted = body[:2], 2, b''
+					while offset < len(body):
+						topic, offset = read_string(body, offset)
+						offset += 1
+						self.subscriptions.add(topic)
+						granted += b'\x00'
+					self.send(encode_packet(0x90, packet_id + granted))
+				elif packet_type == 0xA0:
+					packet_id, offset = body[:2], 2
+					while offset < len(body):
+						topic, offset = read_string(body, offset)
+						self.subscriptions.discard(topic)
+					self.send(encode_packet(0xB0, packet_id))
+				elif packet_type == 0x30:
+					topic, offset = read_string(body, 0)
+					qos = (flags >> 1) & 0x03
+					if qos > 0:
+						self.send(encode_packet(0x40, body[offset:offset + 2]))
+						offset += 2
+					broker.publish(topic, body[offset:])
+				elif packet_type == 0xC0:
+					self.send(encode_packet(0xD0, b''))
+				elif packet_type == 0xE0:
+					break
+		except (EOFError, OSError, ValueError):
+			pass
+		finally:
+			broker.remove_client(self)
+
+
+class MockMqttBroker:
+	# A small MQTT 3.1.1 broker, for the MQTT extension of SensorThings API,
+	# where new entities are published on topics like
+	# "v1.0/Datastreams(46)/Observations".
+
+	def __init__(self, host='127.0.0.1', port=0):
+		self.clients = set()
+		self.lock = threading.Lock()
+		self.published = 0
+		self.server = socketserver.ThreadingTCPServer((host, port), MqttHandler)
+		self.server.daemon_threads = True
+		self.server.broker = self
+		self.thread = None
+
+	@property
+	def address(self):
+		return self.server.server_address[:2]
+
+	def add_client(self, client):
+		with self.lock:
+			self.clients.add(client)
+
+	def remove_client(self, client):
+		with self.lock:
+			self.clients.discard(client)
+
+	def publish(self, topic, payload):
+		# Send a message to every client with a matching subscription.
+		payload = payload.encode('utf-8') if isinstance(payload, str) else payload
+		packet = encode_packet(0x30, encode_string(topic) + payload)
+		with self.lock:
+			clients = list(self.clients)
+			self.published += 1
+		for client in clients:
+			if any(topic_matches(pattern, topic) for pattern in client.subscriptions):
+				try:
+					client.send(packet)
+				except OSError:
+					pass
+
+	def disconnect_all(self):
+		# Close every client connection, like a broker restart or a network
+		# problem. Clients are expected to connect again.
+		with self.lock:
+			clients = list(self.clients)
+			self.clients.clear()
+		for client in clients:
+			try:
+				client.request.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.disconnect_all()
+		self.server.shutdown()
+		self.server.server_close()
+
+
+class MockServer:
+
+	def __init__(self, host='127.0.0.1', port=0, things=50, observations=5000, latency=0, jitter=0, compress=False, batch=True, foi_geo=True, apply=False, rate_limit=None, mqtt_port=None, seed=1, verbose=False):
+		self.store = Store(things, observations, seed)
+		self.batch = batch
+		self.foi_geo = foi_geo
+		# FROST does not support '$apply', so it is off unless asked for.
+		self.apply = apply
+		# Requests allowed each second, with a burst of up to the same
+		# number. Requests over the limit are answered with "429 Too Many
+		# Requests".
+		self.rate_limit = rate_limit
+		self.tokens = rate_limit or 0
+		self.tokens_at = time.monotonic()
+		self.latency = latency
+		self.jitter = jitter
+		self.compress = compress
+		self.verbose = verbose
+		self.started_at = time.time()
+		self.counter_lock = threading.Lock()
+		self.reset_counters()
+		self.httpd = ThreadingHTTPServer((host, port), Handler)
+		self.httpd.daemon_threads = True
+		self.httpd.mock = self
+		self.thread = None
+		# The MQTT broker is only started if a port is given (0 for any).
+		self.mqtt = MockMqttBroker(host, mqtt_port) if mqtt_port is not None else None
+
+	@property
+	def url(self):
+		host, port = self.httpd.server_address[:2]
+		return f'http://{host}:{port}{SERVICE_PATH}'
+
+	def reset_counters(self):
+		with self.counter_lock:
+			self.requests = 0
+			self.bytes_sent = 0
+			self.bytes_decoded = 0
+
+	def count(self, sent, decoded):
+		with self.counter_lock:
+			self.requests += 1
+			self.bytes_sent += sent
+			self.bytes_decoded += decoded
+
+	def rate_limited(self):
+		if not self.rate_limit:
+			return False
+		with self.counter_lock:
+			now = time.monotonic()
+			self.tokens = min(self.rate_limit, self.tokens + (now - self.tokens_at) * self.rate_limit)
+			self.tokens_at = now
+			if self.tokens < 1:
+				return True
+			self.tokens -= 1
+			return False
+
+	def delay(self):
+		if self.latency or self.jitter:
+			time.sleep(max(0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+	def get(self, path, query):
+		# Return (status, content type, body, extra headers) for a GET.
+		options = dict(parse_qsl(query, keep_blank_values=True))
+		try:
+			return self.handle(path, options)
+		except (KeyError, LookupError):
+			return error_body(404, 'Not found')
+		except ValueError as error:
+			return error_body(400, str(error))
+
+	def handle(self, path, options):
+		# Path is like "/Things", "/Things(1)" or "/Things(1)/Locations".
+		match = re.fullmatch(r'/(\w+)(?:\((\d+)\))?(?:/(\w+))?/?', path)
+		if match is None or match.group(1) not in RELATIONS:
+			raise LookupError(path)
+		collection, entity_id, relation = match.group(1), match.group(2), match.group(3)
+
+		if entity_id is None:
+			if relation is not None:
+				raise LookupError(path)
+			if collection == 'FeaturesOfInterest' and options.get('$filter'):
+				# Do not create every Datastream's Features of Interest just to
+				# look a few up by ID.
+				ids = [int(number) for number in re.findall(r'\bid eq (\d+)', options['$filter'])]
+				if ids and not re.search(r'\b(and|not|ne|gt|ge|lt|le)\b', options['$filter']):
+					entities = [feature for feature in (self.store.get(collection, feature_id) for feature_id in ids) if feature is not None]
+					entities.sort(key=lambda entity: entity['@iot.id'])
+					return Query(self, collection, options).run(path, entities, False)
+			return Query(self, collection, options).run(path, self.store.all(collection), False)
+
+		entity = self.store.get(collection, int(entity_id))
+		if entity is None:
+			raise LookupError(path)
+		if collection == 'Datastreams':
+			# Fills in 'phenomenonTime' and 'observedArea', which FROST keeps
+			# up to date from the Observations.
+			self.store.datastream_observations(entity['@iot.id'])
+		if relation is None:
+			return Query(self, collection, options).run(path, entity, True)
+		if relation not in RELATIONS[collection]:
+			raise LookupError(path)
+		target, related = self.store.related(collection, entity, relation)
+		related = [item for item in related if item is not None]
+		if not relation.endswith('s'):
+			if not related:
+				raise LookupError(path)
+			return Query(self, target, options).run(path, related[0], True)
+		return Query(self, target, options).run(path, related, False)
+
+	def publish_observation(self, datastream_id, result=None):
+		# Add a new Observation to a Datastream and publish it over MQTT on
+		# the same topics as FROST.
+		observation = self.store.add_observation(datastream_id, result)
+		if self.mqtt is not None:
+			payload = json.dumps(Query(self, 'Observations', {}).render('Observations', observation, {}))
+			version = SERVICE_PATH.rsplit('/', 1)[1]
+			self.mqtt.publish(f'{version}/Datastreams({datastream_id})/Observations', payload)
+			self.mqtt.publish(f'{version}/Observations', payload)
+		return observation
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		if self.mqtt is not None:
+			self.mqtt.start()
+		return self
+
+	def stop(self):
+		if self.mqtt is not None:
+			self.mqtt.stop()
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Run a stand-in SensorThings API server with made-up data.')
+	parser.add_argument('--port', type=int, default=8080)
+	parser.add_argument('--things', type=int, default=50, help='number of Things (each has 3 Datastreams)')
+	parser.add_argument('--observations', type=int, default=5000, help='number of Observations in each Datastream')
+	parser.add_argument('--latency', type=float, default=0, help='milliseconds to wait before each response')
+	parser.add_argument('--jitter', type=float, default=0, help='random +/- milliseconds added to the latency')
+	parser.add_argument('--compress', action='store_true', help='gzip responses when the client asks')
+	parser.add_argument('--no-batch', action='store_true', help='answer POST $batch with 404, like a server without batch support')
+	parser.add_argument('--no-foi-geo', action='store_true', help='answer geo.intersects on FeatureOfInterest with 400, like a server that cannot filter on it')
+	parser.add_argument('--apply', action='store_true', help="answer '$apply' groupby/aggregate queries, which FROST does not")
+	parser.add_argument('--rate-limit', type=float, help='requests allowed each second; more are answered with 429 and Retry-After')
+	parser.add_argument('--mqtt-port', type=int, help='also run an MQTT broker on this port')
+	parser.add_argument('--publish', type=int, action='append', help='ID of a Datastream to publish new Observations to over MQTT')
+	parser.add_argument('--publish-interval', type=float, default=5, help='seconds between new Observations for --publish')
+	parser.add_argument('--verbose', action='store_true', help='print each request')
+	args = parser.parse_args()
+
+	server = MockServer(
+		port=args.port,
+		things=args.things,
+		observations=args.observations,
+		latency=args.latency / 1000,
+		jitter=args.jitter / 1000,
+		compress=args.compress,
+		batch=not args.no_batch,
+		foi_geo=not args.no_foi_geo,
+		apply=args.apply,
+		rate_limit=args.rate_limit,
+		mqtt_port=args.mqtt_port,
+		verbose=args.verbose
+	)
+	print(f'Serving {server.url}')
+	if server.mqtt is not None:
+		server.mqtt.start()
+		print(f'MQTT broker on {server.mqtt.address[0]}:{server.mqtt.address[1]}')
+	try:
+		if args.publish:
+			threading.Thread(target=server.httpd.serve_forever, daemon=True).start()
+			while True:
+				time.sleep(args.publish_interval)
+				for datastream_id in args.publish:
+					server.publish_observation(datastream_id)
+		else:
+			server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass